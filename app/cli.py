@@ -0,0 +1,127 @@
+"""
+运维命令行：
+    python -m app.cli rebuild-search-index    # 重建刀具搜索索引（老库升级时迁移会自动跑一次）
+    python -m app.cli rebuild-checkpoints     # 按流水重算库存检查点（同上；手工改过流水后再跑）
+    python -m app.cli backfill-rollup         # 按流水重算小时汇总表（/movements/summary 用；同上）
+    python -m app.cli rebuild-counters        # 清空行数计数器（手工改过库之后跑；下次读列表时按 COUNT 重新补）
+    python -m app.cli migrate [--status]      # 执行没跑过的迁移（老库补索引）；--status 只看状态
+    python -m app.cli archive-movements       # 把超过 archive_after_days 天的流水分批挪进归档表（可放 cron 里每天跑）
+    python -m app.cli --profile-startup       # 另起进程量冷启动：各阶段耗时 + 每个模块的导入时间
+"""
+import argparse
+import asyncio
+import sys
+import time
+from datetime import datetime
+
+from sqlalchemy import delete
+
+from app.config import settings
+from app.db import engine, create_db_and_tables, new_session
+from app.migrations import MIGRATIONS, applied_versions, run_migrations
+from app.models import RowCounter
+from app.services.archive import archive_cutoff, archive_movements
+from app.services.balances import rebuild_checkpoints
+from app.services.rollup import backfill_rollup
+from app.services.search import rebuild_search_index
+from app.startup_profile import profile_startup
+
+
+async def cmd_rebuild_search_index(args: argparse.Namespace) -> None:
+    await create_db_and_tables()
+    async with new_session() as session:
+        n = await rebuild_search_index(session)
+    print(f"搜索索引已重建：{n} 把刀具")
+
+
+async def cmd_rebuild_checkpoints(args: argparse.Namespace) -> None:
+    await create_db_and_tables()
+    async with new_session() as session:
+        n = await rebuild_checkpoints(session)
+    print(f"库存检查点已重建：{n} 个")
+
+
+async def cmd_backfill_rollup(args: argparse.Namespace) -> None:
+    await create_db_and_tables()
+    async with new_session() as session:
+        n = await backfill_rollup(session)
+    print(f"流水汇总表已重算：{n} 条流水")
+
+
+async def cmd_rebuild_counters(args: argparse.Namespace) -> None:
+    await create_db_and_tables()
+    async with new_session() as session:
+        await session.exec(delete(RowCounter))
+        await session.commit()
+    print("行数计数器已清空，下次读取时自动重建")
+
+
+async def cmd_migrate(args: argparse.Namespace) -> None:
+    await create_db_and_tables()
+    if args.status:
+        applied = await applied_versions(engine)
+        for m in MIGRATIONS:
+            print(f"{m.version:04d} {m.name:40s} {'已执行' if m.version in applied else '未执行'}")
+        return
+    ran = await run_migrations(engine)
+    print(f"执行了 {len(ran)} 条迁移" if ran else "没有要执行的迁移")
+
+
+async def cmd_archive_movements(args: argparse.Namespace) -> None:
+    await create_db_and_tables()
+    if args.before:
+        before = datetime.fromisoformat(args.before)
+    else:
+        before = archive_cutoff(settings.archive_after_days if args.days is None else args.days)
+    started = time.perf_counter()
+    async with new_session() as session:
+        n = await archive_movements(session, before, args.batch_size)
+    print(f"已归档 {n} 条 {before:%Y-%m-%d %H:%M:%S}（UTC）之前的流水，用时 {time.perf_counter() - started:.1f}s")
+
+
+def main(argv: list[str] | None = None) -> None:
+    parser = argparse.ArgumentParser(prog="python -m app.cli")
+    parser.add_argument("--profile-startup", action="store_true", help="另起进程量冷启动耗时和各模块导入时间")
+    parser.add_argument("--top", type=int, default=20, help="--profile-startup 列出前几个模块")
+    parser.add_argument("--budget-ms", type=float, help="--profile-startup 超过这么多毫秒退出码为 1")
+    sub = parser.add_subparsers(dest="command")
+
+    p = sub.add_parser("rebuild-search-index", help="重建刀具 name/location 搜索索引")
+    p.set_defaults(func=cmd_rebuild_search_index)
+
+    p = sub.add_parser("rebuild-checkpoints", help="按流水重算每把刀的库存检查点")
+    p.set_defaults(func=cmd_rebuild_checkpoints)
+
+    p = sub.add_parser("backfill-rollup", help="按流水重算按小时的汇总表")
+    p.set_defaults(func=cmd_backfill_rollup)
+
+    p = sub.add_parser("rebuild-counters", help="清空列表 total 用的行数计数器")
+    p.set_defaults(func=cmd_rebuild_counters)
+
+    p = sub.add_parser("migrate", help="执行没跑过的迁移（老库补索引）")
+    p.add_argument("--status", action="store_true", help="只列出各迁移是否已执行")
+    p.set_defaults(func=cmd_migrate)
+
+    p = sub.add_parser("archive-movements", help="把老流水分批挪进归档表")
+    p.add_argument("--days", type=int, help="归档多少天之前的流水（默认 settings.archive_after_days）")
+    p.add_argument("--before", help="直接给边界（UTC），例：2025-01-01；优先于 --days")
+    p.add_argument("--batch-size", type=int, help="每批条数（默认 settings.archive_batch_size）")
+    p.set_defaults(func=cmd_archive_movements)
+
+    args = parser.parse_args(argv)
+    if args.profile_startup:
+        sys.exit(profile_startup(args.top, args.budget_ms))
+    if args.command is None:
+        parser.error("需要一个子命令，或 --profile-startup")
+    asyncio.run(_run(args))
+
+
+async def _run(args: argparse.Namespace) -> None:
+    try:
+        await args.func(args)
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    main()
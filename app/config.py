@@ -0,0 +1,59 @@
+from pydantic_settings import BaseSettings, SettingsConfigDict
+
+
+class Settings(BaseSettings):
+    # 声明.env里会出现的字段
+    secret_key: str= "dev_secret"
+    access_token_expire_minutes: int = 120
+
+    # 数据库：地址 + 连接池（sqlite 内存库会自动改用单连接 StaticPool）
+    database_url: str = "sqlite:///./app.db"
+    db_pool_size: int = 5
+    db_max_overflow: int = 10
+
+    # 启动时自动执行没跑过的迁移（app/migrations.py）；大库想放到维护窗口手动跑 python -m app.cli migrate 就关掉
+    auto_migrate: bool = True
+
+    # SQLite 调优：WAL 让读不等写；busy_timeout 让写者排队而不是立刻报 database is locked
+    sqlite_busy_timeout_ms: int = 5000
+    sqlite_cache_size_kib: int = 64 * 1024
+    sqlite_mmap_size: int = 256 * 1024 * 1024
+    # 事务撞上 SQLITE_BUSY 时整体重试的次数（指数退避）
+    db_busy_retries: int = 5
+    # 慢查询日志：单条 SQL 超过这么多毫秒就连同 EXPLAIN 计划和发起的路由一起记下来；0 关闭
+    slow_query_ms: int = 200
+
+    # 鉴权缓存：token(jti) -> 用户，命中时鉴权不查库；每 recheck 秒读一次 user 变更代数，
+    # 别的进程改/删了用户最多这么久就失效（绕过 ORM 直接改库的要等 TTL）
+    principal_cache_ttl_seconds: int = 60
+    principal_cache_max_size: int = 10000
+    principal_cache_recheck_seconds: float = 1.0
+
+    # 密码哈希：pbkdf2 迭代次数 + 专用线程池（满了直接 503，不拖慢其它接口）
+    password_hash_rounds: int = 29000
+    password_hash_workers: int = 4
+    password_hash_queue: int = 32
+
+    # 列表 total 的估算模式：带过滤条件的 COUNT 按过滤条件缓存几秒
+    count_cache_ttl_seconds: int = 10
+    count_cache_max_size: int = 1024
+
+    # 库存检查点：每把刀每写多少条流水记一次余额（历史库存查询最多回放这么多条）
+    balance_checkpoint_every: int = 100
+
+    # 后台导出任务：同时渲染几个、最多排队几个（满了 429）；结果文件按 (查询, 数据代数) 缓存在磁盘上
+    export_workers: int = 2
+    export_max_pending: int = 16
+    export_cache_dir: str = "./export_cache"
+    export_cache_ttl_seconds: int = 600
+
+    # 流水归档：python -m app.cli archive-movements 把超过这么多天的流水分批挪进归档表；每批多少条、批间歇多久（让出写锁）
+    archive_after_days: int = 365
+    archive_batch_size: int = 2000
+    archive_pause_ms: int = 20
+
+    # v2 写法：指定 env 文件 + 允许额外字段也不报错（可选）
+    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
+
+# 读取.env（实例化时加载并校验）
+settings = Settings()
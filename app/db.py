@@ -1,18 +1,227 @@
-from sqlmodel import SQLModel, Session, create_engine
+import asyncio
+import functools
+import logging
+import random
+import re
+import time
+from typing import Callable
+
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import OperationalError
+from sqlalchemy.ext.asyncio import AsyncEngine, create_async_engine
+from sqlalchemy.pool import AsyncAdaptedQueuePool, StaticPool
 from fastapi import HTTPException
 import uuid
 
+from app.config import settings
+from app.services.metrics import Gauge, current_stats, instrument_engine, observe_pool_wait, registry
+
+
+DATABASE_URL = settings.database_url
+
+# SQLITE_BUSY / SQLITE_LOCKED（扩展错误码取低 8 位）
+_SQLITE_BUSY_CODES = {5, 6}
+BUSY_BACKOFF_SECONDS = 0.02
+
+
+def to_async_url(url: str) -> str:
+    # 同一个库地址换成异步驱动：sqlite -> aiosqlite，postgres -> asyncpg
+    if url.startswith("sqlite://"):
+        return "sqlite+aiosqlite://" + url[len("sqlite://"):]
+    if url.startswith(("postgresql://", "postgres://")):
+        return "postgresql+asyncpg://" + url.split("://", 1)[1]
+    return url
+
+
+def _is_sqlite_memory(url: str) -> bool:
+    path = url.split("://", 1)[1].split("?", 1)[0]
+    return path in ("", "/", "/:memory:") or "mode=memory" in url
+
+
+def _apply_sqlite_pragmas(dbapi_connection, connection_record) -> None:
+    # ✅ 每条新连接都设一遍：这些 PRAGMA 只对当前连接生效（journal_mode=WAL 例外，写进库文件）
+    cur = dbapi_connection.cursor()
+    try:
+        cur.execute("PRAGMA journal_mode=WAL")  # 读者读快照，不再被写事务挡住
+        cur.execute("PRAGMA synchronous=NORMAL")  # WAL 下安全，提交不再每次 fsync
+        cur.execute(f"PRAGMA busy_timeout={int(settings.sqlite_busy_timeout_ms)}")
+        cur.execute(f"PRAGMA cache_size=-{int(settings.sqlite_cache_size_kib)}")  # 负数 = KiB
+        cur.execute(f"PRAGMA mmap_size={int(settings.sqlite_mmap_size)}")
+        cur.execute("PRAGMA temp_store=MEMORY")
+    finally:
+        cur.close()
+
+
+slow_query_log = logging.getLogger("app.slow_query")
+
+# 值得看执行计划的语句（INSERT / PRAGMA 之类不看）
+_EXPLAINABLE = ("SELECT", "WITH", "UPDATE", "DELETE")
+_SCAN_RE = re.compile(r"^(?:SCAN|Seq Scan on) (\w+)")
+_WHERE_RE = re.compile(r"\bWHERE\b", re.IGNORECASE)
+_LIMIT_RE = re.compile(r"\bLIMIT\b", re.IGNORECASE)
+
+
+def explain_query_plan(conn, statement: str, parameters) -> list[str]:
+    """
+    在同一条连接上取这条语句的执行计划（SQLite: EXPLAIN QUERY PLAN 的 detail 列；Postgres: EXPLAIN）。
+    新开一个游标执行，不动原语句还没取完的结果。
+    """
+    if not statement.lstrip()[:6].upper().startswith(_EXPLAINABLE):
+        return []
+    prefix = "EXPLAIN QUERY PLAN " if conn.dialect.name == "sqlite" else "EXPLAIN "
+    cursor = conn.connection.dbapi_connection.cursor()
+    try:
+        cursor.execute(prefix + statement, parameters)
+        return [str(row[-1]).strip() for row in cursor.fetchall()]
+    except Exception as e:  # 计划拿不到不能影响业务语句
+        return [f"EXPLAIN 失败：{e}"]
+    finally:
+        cursor.close()
+
+
+def full_scans(statement: str, plan: list[str]) -> list[str]:
+    """
+    计划里被整表 / 整个索引扫一遍的表（SQLite: SCAN <表>；Postgres: Seq Scan on <表>）。
+    例外：没有 WHERE、有 LIMIT、也不用临时 B 树排序 -> 按索引顺序取前 N 行就停（列表第一页），不算。
+    物化的子查询（SCAN anon_1）不是表，也不算。
+    """
+    bounded = (
+        _LIMIT_RE.search(statement) is not None
+        and _WHERE_RE.search(statement) is None
+        and not any("TEMP B-TREE" in line for line in plan)
+    )
+    tables = []
+    for line in plan:
+        m = _SCAN_RE.match(line)
+        if m and m.group(1) in SQLModel.metadata.tables and not bounded:
+            tables.append(m.group(1))
+    return tables
+
+
+def _query_started(conn, cursor, statement, parameters, context, executemany) -> None:
+    conn.info.setdefault("slow_query_started", []).append(time.perf_counter())
+
+
+def _log_slow_query(conn, cursor, statement, parameters, context, executemany) -> None:
+    elapsed_ms = (time.perf_counter() - conn.info["slow_query_started"].pop()) * 1000
+    if settings.slow_query_ms <= 0 or elapsed_ms < settings.slow_query_ms:
+        return
+    plan = [] if executemany else explain_query_plan(conn, statement, parameters)
+    stats = current_stats()
+    slow_query_log.warning(
+        "慢查询 %.1fms route=%s full_scan=%s\n%s\n计划：\n  %s",
+        elapsed_ms,
+        stats.route if stats is not None else "-",
+        ",".join(full_scans(statement, plan)) or "-",
+        statement,
+        "\n  ".join(plan) or "-",
+    )
+
+
+def _query_failed(context) -> None:
+    started = context.connection.info.get("slow_query_started") if context.connection is not None else None
+    if started:
+        started.pop()
+
+
+class TimedQueuePool(AsyncAdaptedQueuePool):
+    # 借连接的等待时间（池满时排队）：SQLAlchemy 没有“开始借”的事件，只能在这里量
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        finally:
+            observe_pool_wait(time.perf_counter() - started)
+
+
+def build_engine(url: str, pool_size: int | None = None, max_overflow: int | None = None) -> AsyncEngine:
+    async_url = to_async_url(url)
+    pool = {
+        "poolclass": TimedQueuePool,
+        "pool_size": pool_size or settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow if max_overflow is None else max_overflow,
+    }
+    if async_url.startswith("sqlite"):
+        if _is_sqlite_memory(url):
+            # 内存库每条连接都是一个新库，只能共用一条
+            engine = create_async_engine(async_url, poolclass=StaticPool)
+        else:
+            engine = create_async_engine(async_url, **pool)
+        event.listen(engine.sync_engine, "connect", _apply_sqlite_pragmas)
+    else:
+        engine = create_async_engine(async_url, pool_pre_ping=True, **pool)
+    instrument_engine(engine)  # SQL 条数 / 耗时进 /metrics 和 Server-Timing
+    event.listen(engine.sync_engine, "before_cursor_execute", _query_started)
+    event.listen(engine.sync_engine, "after_cursor_execute", _log_slow_query)
+    event.listen(engine.sync_engine, "handle_error", _query_failed)
+    return engine
+
+
+engine = build_engine(DATABASE_URL)
+registry.add(Gauge(
+    "db_pool_checked_out",
+    "连接池当前借出的连接数",
+    fn=lambda: getattr(engine.sync_engine.pool, "checkedout", lambda: 0)(),
+))
+
+
+def dialect_insert(session: AsyncSession, target):
+    # INSERT ... ON CONFLICT（DO NOTHING / DO UPDATE）两种库写法一样，只是方言模块不同
+    dialect = postgresql if session.bind.dialect.name == "postgresql" else sqlite
+    return dialect.insert(target)
+
+
+def is_busy_error(exc: BaseException) -> bool:
+    orig = getattr(exc, "orig", exc)
+    code = getattr(orig, "sqlite_errorcode", None)
+    if code is not None:
+        return code & 0xFF in _SQLITE_BUSY_CODES
+    msg = str(orig).lower()
+    return "database is locked" in msg or "database is busy" in msg
+
+
+def retry_on_busy(fn):
+    """
+    包一层 async fn(session, ...)：事务撞上 SQLITE_BUSY 时回滚、退避，再整段重跑。
+    WAL 下读事务升级成写事务时如果快照已过期，SQLite 直接报 BUSY，不走 busy_timeout，只能重跑。
+    fn 必须自己 commit（整段就是一个事务），重跑才是安全的。
+    """
+    @functools.wraps(fn)
+    async def wrapper(session: AsyncSession, *args, **kwargs):
+        retries = settings.db_busy_retries
+        for attempt in range(retries + 1):
+            try:
+                return await fn(session, *args, **kwargs)
+            except OperationalError as e:
+                if attempt == retries or not is_busy_error(e):
+                    raise
+                await session.rollback()
+                await asyncio.sleep(BUSY_BACKOFF_SECONDS * (2 ** attempt) * (0.5 + random.random()))
+    return wrapper
+
+
+async def create_db_and_tables() -> None:
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+
+
+def new_session() -> AsyncSession:
+    # expire_on_commit=False：异步下提交后再访问属性不能隐式查库
+    return AsyncSession(engine, expire_on_commit=False)
+
 
-DATABASE_URL = "sqlite:///./app.db"
-engine = create_engine(DATABASE_URL, connect_args={"check_same_thread": False})
+def get_session_factory() -> Callable[[], AsyncSession]:
+    # 请求结束后还要查库的后台任务（如导出）用：自己开 session，不借请求的
+    return new_session
 
-def create_db_and_tables() -> None:
-    SQLModel.metadata.create_all(engine)
 
-def get_session():
+async def get_session():
     sid = uuid.uuid4().hex[:6]
     # print(f">>> open session {sid}")
-    session = Session(engine)
+    session = new_session()
     try:
         yield session
     except HTTPException:
@@ -20,11 +229,11 @@ def get_session():
         raise
     except Exception as e:
         # ✅ 其他异常：更像程序错误/DB错误，回滚更合理
-        session.rollback()
+        await session.rollback()
         print("rollback:", type(e), e)
         raise
     finally:
-        session.close()
+        await session.close()
         # print(f"<<< close session {sid}")
 """
 这是一个 Python 中基于 SQLAlchemy（ORM 框架）的**数据库会话生成器函数**，核心作用是安全、复用性地创建数据库会话（Session），简要解析如下：
@@ -1,33 +1,50 @@
 from fastapi import Depends, HTTPException
 from fastapi.security import OAuth2PasswordBearer
-from sqlmodel import Session, select
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.db import get_session
 from app.models import User
-from app.security import decode_token
+from app.security import decode_token_claims
 from app.error import _auth_401
+from app.services.counters import USER_GEN_KEY, read_generation
+from app.services.principal_cache import Principal, principal_cache
 
 # ✅ 关键：auto_error=False，让我们接管“没带token”的错误格式
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="/auth/login", auto_error=False)
 
 
-def require_user(
+async def require_user(
     token: str | None = Depends(oauth2_scheme),
-    session: Session = Depends(get_session),
-) -> User:
+    session: AsyncSession = Depends(get_session),
+) -> Principal:
     # 1) 没带 token / Swagger 授权丢了 / 地址栏直接访问
     if not token:
         raise _auth_401("NOT_AUTHENTICATED", "未登录或登录已失效，请重新登录")
 
-    # 2) token 无效 / 过期 / secret_key 不一致
+    # 2) token 无效 / 过期 / secret_key 不一致（签名和过期每次都验，只缓存查库结果）
     try:
-        username = decode_token(token)
+        claims = decode_token_claims(token)
     except Exception:
         raise _auth_401("INVALID_TOKEN", "Token 无效或已过期，请重新登录")
+    username = claims["sub"]
+    cache_key = claims.get("jti") or f"sub:{username}"
+
+    # ✅ 别的进程改/删过用户：每 recheck 秒读一次 user 变更代数（一条主键查询，所有请求共用），变了就清缓存
+    if principal_cache.recheck_due():
+        principal_cache.sync_user_generation(await read_generation(session, USER_GEN_KEY))
+
+    # ✅ 命中缓存：鉴权不查 user 表
+    principal = principal_cache.get(cache_key)
+    if principal is not None and principal.username == username:
+        return principal
 
     # 3) token 验过了，但用户在库里不存在（账号被删/数据被清空）
-    user = session.exec(select(User).where(User.username == username)).first()
+    generation = principal_cache.generation
+    user = (await session.exec(select(User).where(User.username == username))).first()
     if not user:
         raise _auth_401("USER_NOT_FOUND", "用户不存在或已被删除")
 
-    return user
+    principal = Principal(id=user.id, username=user.username)
+    principal_cache.put(cache_key, principal, generation)
+    return principal
@@ -1,27 +1,22 @@
 from contextlib import asynccontextmanager
-from pydantic_settings import BaseSettings, SettingsConfigDict
 from fastapi import FastAPI
 from fastapi.exceptions import RequestValidationError
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, Response
 from fastapi import Request
-from app.db import create_db_and_tables
-from app.routers import auth, tools, movements
+from app.db import create_db_and_tables, engine
+from app.migrations import ensure_schema
+from app.services.metrics import CONTENT_TYPE, MetricsMiddleware, registry
+from app.routers import auth, tools, movements, exports
+from app.config import Settings, settings  # noqa: F401  配置统一放 app/config.py，这里保留原导入路径
 
 
-class Settings(BaseSettings):
-    # 声明.env里会出现的字段
-    secret_key: str= "dev_secret"
-    access_token_expire_minutes: int = 120
-
-    # v2 写法：指定 env 文件 + 允许额外字段也不报错（可选）
-    model_config = SettingsConfigDict(env_file=".env", extra="ignore")
-
-# 读取.env（实例化时加载并校验）
-settings = Settings()
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
-    create_db_and_tables()  # ✅ 启动阶段
+    # ✅ 启动阶段：结构已是最新版本就只查一行，不做 create_all 的逐表反射
+    if settings.auto_migrate:
+        await ensure_schema(engine)  # ✅ 建缺的表 + 老库补索引等（新库只记一笔）
+    else:
+        await create_db_and_tables()
     yield  # ✅ 应用开始处理请求
     # --- 关闭后执行的代码 (Shutdown) ---
     # 例如：可以在这里关闭数据库连接，你的项目暂时没有手动关闭逻辑，可以留空
@@ -31,15 +26,23 @@ async def lifespan(app: FastAPI):
 
 
 app = FastAPI(title="FastAPI Starter - Tools Ledger", lifespan=lifespan)
+app.add_middleware(MetricsMiddleware)  # ✅ 每个路由的延迟 / 状态码 / SQL 开销 -> /metrics + Server-Timing
 
 app.include_router(auth.router)
 app.include_router(tools.router)
 app.include_router(movements.router)
+app.include_router(exports.router)
 
 @app.get("/health")
-def health():
+async def health():
     return {"ok": True}
 
+
+@app.get("/metrics", include_in_schema=False)
+async def metrics():
+    # Prometheus 文本格式；不鉴权，部署时只对内网 / 负载均衡开放
+    return Response(registry.render(), media_type=CONTENT_TYPE)
+
 @app.exception_handler(RequestValidationError)
 async def validation_exception_handler(request: Request, exc: RequestValidationError):
     return JSONResponse(
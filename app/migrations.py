@@ -0,0 +1,239 @@
+"""
+版本化迁移：create_all 只会建缺的表，已有的表上新加的索引 / 列它不管，老库就一直停在建库那天的结构。
+每条迁移有递增的版本号，执行过的记在 schemamigration 表里；启动时（settings.auto_migrate）
+或 python -m app.cli migrate 按版本顺序补跑没执行过的。
+
+建索引尽量不长时间锁表：
+  - PostgreSQL：CREATE INDEX CONCURRENTLY，建的过程中表照常读写（必须在事务外执行）
+  - SQLite：没有并发建索引，建的时候写者要排队（WAL 下读不受影响）；每个索引单独一个事务，
+    写者只等一个索引的时间，不是整条迁移；建完跑 PRAGMA optimize（限量抽样）让新索引有统计信息
+所有 DDL 都带 IF NOT EXISTS：新库 create_all 已经按模型建好了，迁移只是记一笔；
+多个进程同时启动、或上次跑到一半被杀，重跑也安全。
+
+启动时先只查一行“已执行到哪个版本”：已是最新就跳过 create_all（逐表反射）和迁移，冷启动少几十条查询。
+所以模型的任何结构变化（加索引、加表、加列）都要追加一条迁移；加表的迁移可以不带索引，
+有迁移要跑时会先 create_all 把缺的表建好。已有表上加列用 columns：ADD COLUMN 在建索引之前，
+列已经在（新库 create_all 建的）就跳过；列必须可空或带 DEFAULT，老行直接取默认值。派生数据换了口径（比如搜索倒排的 gram 长度）
+用 data 步骤重建，在索引建完之后、记版本之前跑；中途失败下次启动会重跑，所以 data 步骤要能重入。
+"""
+import time
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Awaitable, Callable, Optional
+
+from sqlalchemy import func, inspect, select, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import DBAPIError
+from sqlalchemy.ext.asyncio import AsyncEngine
+from sqlalchemy.schema import CreateIndex, CreateTable
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import SchemaMigration
+
+
+@dataclass(frozen=True)
+class IndexSpec:
+    name: str
+    table: str
+    columns: tuple[str, ...]
+
+
+@dataclass(frozen=True)
+class ColumnSpec:
+    table: str
+    name: str
+    ddl: str  # 类型和约束，例："INTEGER NOT NULL DEFAULT 0"
+
+
+@dataclass(frozen=True)
+class Migration:
+    version: int
+    name: str
+    indexes: tuple[IndexSpec, ...] = ()
+    data: Optional[Callable[[AsyncEngine], Awaitable[None]]] = None
+    columns: tuple[ColumnSpec, ...] = ()
+
+
+async def _rebuild_search_index(engine: AsyncEngine) -> None:
+    from app.services.search import rebuild_search_index  # 启动快路径不导入 services
+
+    async with AsyncSession(engine) as session:
+        await rebuild_search_index(session)
+
+
+async def _backfill_rollup(engine: AsyncEngine) -> None:
+    from app.services.rollup import backfill_rollup
+
+    async with AsyncSession(engine) as session:
+        await backfill_rollup(session)
+
+
+async def _rebuild_checkpoints(engine: AsyncEngine) -> None:
+    from app.services.balances import rebuild_checkpoints
+
+    async with AsyncSession(engine) as session:
+        await rebuild_checkpoints(session)
+
+
+async def _toolmovement_autoincrement(engine: AsyncEngine) -> None:
+    """
+    SQLite 不能给已有的表加 AUTOINCREMENT：旧表改名，按模型建新表，整表拷过去再建索引，一个事务里做完。
+    sqlite_sequence 从主表和归档表里最大的 id 起步，挪进归档的 id 不会再发出去。
+    已经建成 AUTOINCREMENT 的库（新库 create_all / 重跑）只校准 sqlite_sequence。Postgres 的序列本来就不回退。
+    """
+    if engine.dialect.name != "sqlite":
+        return
+    from app.models import ToolMovement
+
+    table = ToolMovement.__table__
+    async with engine.begin() as conn:
+        # pysqlite 只在 INSERT/UPDATE/DELETE 前自动 BEGIN：显式开事务，DDL 也在事务里，中途失败整体回滚
+        await conn.exec_driver_sql("BEGIN IMMEDIATE")
+        ddl = (await conn.execute(text("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'toolmovement'"))).scalar()
+        if "AUTOINCREMENT" not in ddl.upper():
+            indexes = (await conn.execute(text(
+                "SELECT name FROM sqlite_master WHERE type = 'index' AND tbl_name = 'toolmovement' AND sql IS NOT NULL"
+            ))).scalars().all()
+            for name in indexes:
+                await conn.execute(text(f'DROP INDEX "{name}"'))
+            await conn.execute(text("ALTER TABLE toolmovement RENAME TO _toolmovement_old"))
+            await conn.execute(CreateTable(table))
+            old = {row[1] for row in (await conn.execute(text("PRAGMA table_info(_toolmovement_old)"))).all()}
+            columns = ", ".join(c.name for c in table.c if c.name in old)  # 模型后来加的列（batch_seq）老表没有
+            await conn.execute(text(f"INSERT INTO toolmovement ({columns}) SELECT {columns} FROM _toolmovement_old"))
+            await conn.execute(text("DROP TABLE _toolmovement_old"))
+            for index in table.indexes:  # 数据拷完再建索引：一次排序建好，比边插边维护快
+                await conn.execute(CreateIndex(index))
+        await conn.execute(text("DELETE FROM sqlite_sequence WHERE name = 'toolmovement'"))
+        await conn.execute(text(
+            "INSERT INTO sqlite_sequence (name, seq) SELECT 'toolmovement', max("
+            "coalesce((SELECT max(id) FROM toolmovement), 0), coalesce((SELECT max(id) FROM toolmovementarchive), 0))"
+        ))
+
+
+# ✅ 只能往后追加，不能改已发布的版本号；模型里加了索引，这里要有一条对应的迁移
+MIGRATIONS: tuple[Migration, ...] = (
+    Migration(1, "tool_keyset_indexes", (
+        IndexSpec("ix_tool_name_id", "tool", ("name", "id")),
+        IndexSpec("ix_tool_quantity_id", "tool", ("quantity", "id")),
+        IndexSpec("ix_tool_updated_at_id", "tool", ("updated_at", "id")),
+    )),
+    Migration(2, "movement_composite_indexes", (
+        IndexSpec("ix_toolmovement_created_at_id", "toolmovement", ("created_at", "id")),
+        IndexSpec("ix_toolmovement_tool_id_created_at_id", "toolmovement", ("tool_id", "created_at", "id")),
+        IndexSpec("ix_toolmovement_operator_created_at_id", "toolmovement", ("operator", "created_at", "id")),
+        IndexSpec("ix_toolmovement_action_created_at_id", "toolmovement", ("action", "created_at", "id")),
+    )),
+    Migration(3, "movement_archive_table"),  # 新表：create_all 连同它的索引一起建
+    Migration(4, "tool_search_trigrams", data=_rebuild_search_index),  # 倒排从 1~2 字 gram 换成三字组
+    # 增量同步按提交顺序的序号翻页；老行都是 0，since / 旧游标落在升级前的，第一次增量会整表重拉一遍
+    Migration(5, "tool_change_seq", (
+        IndexSpec("ix_tool_change_seq_id", "tool", ("change_seq", "id")),
+    ), columns=(ColumnSpec("tool", "change_seq", "INTEGER NOT NULL DEFAULT 0"),)),
+    # 流水号永不复用：归档挪走最新的流水后，普通 rowid 会把归档里已有的 id 再发一遍（大表上要整表拷一次）
+    Migration(6, "toolmovement_autoincrement", data=_toolmovement_autoincrement),
+    Migration(7, "tool_search_cjk_bigrams", data=_rebuild_search_index),  # 倒排加上含汉字的二字组
+    # 汇总表 / 库存检查点是写入时维护的，老库升级时表是空的：汇总会把升级前的历史算成 0，检查点缺了只是慢
+    Migration(8, "movement_rollup_backfill", data=_backfill_rollup),
+    Migration(9, "balance_checkpoints_rebuild", data=_rebuild_checkpoints),
+    Migration(10, "toolmovement_batch_seq", columns=(ColumnSpec("toolmovement", "batch_seq", "INTEGER"),)),
+)
+
+LATEST_VERSION = MIGRATIONS[-1].version
+
+
+def _create_index_sql(conn, spec: IndexSpec) -> str:
+    q = conn.dialect.identifier_preparer.quote
+    columns = ", ".join(q(c) for c in spec.columns)
+    concurrently = "CONCURRENTLY " if conn.dialect.name == "postgresql" else ""
+    return f"CREATE INDEX {concurrently}IF NOT EXISTS {q(spec.name)} ON {q(spec.table)} ({columns})"
+
+
+async def _create_index(engine: AsyncEngine, spec: IndexSpec) -> None:
+    if engine.dialect.name == "postgresql":
+        # CONCURRENTLY 不能在事务里跑；建失败会留下一个 INVALID 的索引，IF NOT EXISTS 会把它当成已建好，先删掉
+        async with engine.connect() as conn:
+            conn = await conn.execution_options(isolation_level="AUTOCOMMIT")
+            invalid = (await conn.execute(text(
+                "SELECT 1 FROM pg_index i JOIN pg_class c ON c.oid = i.indexrelid "
+                "WHERE c.relname = :name AND NOT i.indisvalid"
+            ), {"name": spec.name})).first()
+            if invalid:
+                await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {conn.dialect.identifier_preparer.quote(spec.name)}"))
+            await conn.execute(text(_create_index_sql(conn, spec)))
+        return
+    async with engine.begin() as conn:
+        await conn.execute(text(_create_index_sql(conn, spec)))
+
+
+async def _add_column(engine: AsyncEngine, spec: ColumnSpec) -> None:
+    async with engine.begin() as conn:
+        existing = await conn.run_sync(lambda c: {col["name"] for col in inspect(c).get_columns(spec.table)})
+        if spec.name in existing:
+            return
+        q = conn.dialect.identifier_preparer.quote
+        await conn.execute(text(f"ALTER TABLE {q(spec.table)} ADD COLUMN {q(spec.name)} {spec.ddl}"))
+
+
+async def applied_versions(engine: AsyncEngine) -> set[int]:
+    async with engine.begin() as conn:
+        await conn.run_sync(SchemaMigration.__table__.create, checkfirst=True)
+        return set((await conn.execute(select(SchemaMigration.version))).scalars())
+
+
+async def _record(engine: AsyncEngine, migration: Migration) -> None:
+    async with engine.begin() as conn:
+        dialect = postgresql if conn.dialect.name == "postgresql" else sqlite
+        stmt = dialect.insert(SchemaMigration.__table__).values(
+            version=migration.version, name=migration.name, applied_at=datetime.utcnow(),
+        ).on_conflict_do_nothing()  # 别的进程同时跑完了同一条
+        await conn.execute(stmt)
+
+
+async def schema_version(engine: AsyncEngine) -> int:
+    """库里执行到的最新迁移版本；还没有迁移表（新库 / 很老的库）返回 0。"""
+    try:
+        async with engine.connect() as conn:
+            return (await conn.execute(select(func.max(SchemaMigration.version)))).scalar() or 0
+    except DBAPIError:
+        return 0
+
+
+async def run_migrations(engine: AsyncEngine, verbose: bool = True) -> list[Migration]:
+    """按版本顺序执行没跑过的迁移，返回这次执行的。"""
+    applied = await applied_versions(engine)
+    pending = [m for m in MIGRATIONS if m.version not in applied]
+    if not pending:
+        return []
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)  # 新加的表先建好
+
+    ran = []
+    for m in pending:
+        started = time.perf_counter()
+        if verbose:
+            print(f"迁移 {m.version:04d} {m.name} ……")
+        for column in m.columns:
+            await _add_column(engine, column)
+        for spec in m.indexes:
+            await _create_index(engine, spec)
+        if m.data is not None:
+            await m.data(engine)
+        await _record(engine, m)
+        ran.append(m)
+        if verbose:
+            print(f"迁移 {m.version:04d} {m.name} 完成，用时 {time.perf_counter() - started:.1f}s")
+    if ran and engine.dialect.name == "sqlite":
+        async with engine.begin() as conn:
+            # analysis_limit：只抽样每个索引的前若干行，大表上 ANALYZE 也是毫秒级，不拖慢启动
+            await conn.execute(text("PRAGMA analysis_limit=400"))
+            await conn.execute(text("PRAGMA optimize"))
+    return ran
+
+
+async def ensure_schema(engine: AsyncEngine, verbose: bool = True) -> list[Migration]:
+    """启动用：版本已是最新就只查这一行；否则建缺的表 + 跑没跑过的迁移。"""
+    if await schema_version(engine) >= LATEST_VERSION:
+        return []
+    return await run_migrations(engine, verbose)
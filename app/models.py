@@ -1,5 +1,6 @@
 from typing import Optional
 from sqlmodel import SQLModel, Field
+from sqlalchemy import Index, insert_sentinel
 from datetime import datetime, timezone
 
 class User(SQLModel, table=True):
@@ -8,15 +9,50 @@ class User(SQLModel, table=True):
     password_hash: str
 
 class Tool(SQLModel, table=True):
+    # ✅ 列表按 name/quantity 排序时用 id 兜底，(key, id) 复合索引让 keyset 翻页走范围扫描
+    __table_args__ = (
+        Index("ix_tool_name_id", "name", "id"),
+        Index("ix_tool_quantity_id", "quantity", "id"),
+        Index("ix_tool_updated_at_id", "updated_at", "id"),  # /tools/lite?since= 定起点
+        Index("ix_tool_change_seq_id", "change_seq", "id"),  # /tools/lite 增量同步游标
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
     name: str = Field(index=True)
     location: str = Field(default="unknown")
     quantity: int = Field(default=0)
     updated_at: datetime = Field(default_factory=datetime.utcnow)
+    # 最后一次改动所在写事务拿到的 tool 变更代数：按提交顺序递增（updated_at 是提交前在应用里取的，做不到）
+    change_seq: int = Field(default=0)
+
+
+class ToolSearchGram(SQLModel, table=True):
+    # ✅ name/location 的 n-gram 倒排表（三字组 + 含汉字的二字组）：替代 LIKE '%q%' 全表扫描（见 app/services/search.py）
+    gram: str = Field(primary_key=True)
+    tool_id: int = Field(primary_key=True, index=True)
 
 
+class RowCounter(SQLModel, table=True):
+    # ✅ 写入时增量维护的行数：key = tool / movement / movement:tool:{id}；列表的 total 直接读它，不做 COUNT(*)
+    key: str = Field(primary_key=True)
+    value: int = Field(default=0)
+
 
 class ToolMovement(SQLModel, table=True):
+    # ✅ keyset 分页用的复合索引：按 created_at 排序（可带 tool_id / operator / action 过滤）时直接范围扫描
+    #    id 排序走主键；SQLite 的二级索引自带 rowid，(tool_id) 索引即等价于 (tool_id, id)
+    #    老库上这些索引由 app/migrations.py 补建，这里加了新索引，那边也要加一条迁移
+    # ✅ AUTOINCREMENT：id 永不复用。普通 rowid 取 max(id)+1，最新的流水被挪进归档表后会把归档里已有的 id 再发一遍
+    # ✅ batch_seq：批量插入时 SQLAlchemy 往这列填每行在批里的序号，RETURNING 带回来按它把 id 对回参数（见 apply_movement_batch）
+    __table_args__ = (
+        Index("ix_toolmovement_created_at_id", "created_at", "id"),
+        Index("ix_toolmovement_tool_id_created_at_id", "tool_id", "created_at", "id"),
+        Index("ix_toolmovement_operator_created_at_id", "operator", "created_at", "id"),
+        Index("ix_toolmovement_action_created_at_id", "action", "created_at", "id"),
+        insert_sentinel("batch_seq"),
+        {"sqlite_autoincrement": True},
+    )
+
     id: Optional[int] = Field(default=None, primary_key=True)
 
     tool_id: int = Field(foreign_key="tool.id", index=True)
@@ -28,3 +64,58 @@ class ToolMovement(SQLModel, table=True):
     operator: str = Field(index=True) # username
 
     created_at: datetime = Field(default_factory=datetime.utcnow)
+
+
+class ToolMovementArchive(SQLModel, table=True):
+    # ✅ 归档的老流水（见 app/services/archive.py）：列和 ToolMovement 一样，id 沿用原流水号；
+    #    索引照搬主表（单列 + keyset 复合索引），查询跨到归档时两边都能按索引有序读、读够就停
+    __table_args__ = (
+        Index("ix_toolmovementarchive_created_at_id", "created_at", "id"),
+        Index("ix_toolmovementarchive_tool_id_created_at_id", "tool_id", "created_at", "id"),
+        Index("ix_toolmovementarchive_operator_created_at_id", "operator", "created_at", "id"),
+        Index("ix_toolmovementarchive_action_created_at_id", "action", "created_at", "id"),
+    )
+
+    id: int = Field(primary_key=True, sa_column_kwargs={"autoincrement": False})
+    tool_id: int = Field(index=True)
+    action: str = Field(index=True)
+    delta: int
+    note: Optional[str] = None
+    operator: str = Field(index=True)
+    created_at: datetime
+
+
+class ToolBalanceCheckpoint(SQLModel, table=True):
+    # ✅ 每把刀每写 N 条流水记一次“截至这条流水的库存”；查某一时刻的库存 = 最近的检查点 + 之后的少量流水
+    __table_args__ = (
+        Index("ix_toolbalancecheckpoint_tool_id_created_at", "tool_id", "created_at"),
+    )
+
+    tool_id: int = Field(primary_key=True)
+    movement_id: int = Field(primary_key=True)  # 检查点包含到这条流水为止
+    created_at: datetime                        # = 这条流水的 created_at
+    balance: int
+
+
+class MovementRollup(SQLModel, table=True):
+    # ✅ 流水按“UTC 整点小时 × 刀具 × 动作 × 操作人”预聚合，和流水同一事务累加；
+    #    汇总接口读它再按时区折成日/周/月，一年只读几千行而不是几百万条流水
+    __table_args__ = (
+        Index("ix_movementrollup_tool_id_bucket", "tool_id", "bucket"),
+    )
+
+    bucket: datetime = Field(primary_key=True)  # UTC naive，整点
+    tool_id: int = Field(primary_key=True)
+    action: str = Field(primary_key=True)
+    operator: str = Field(primary_key=True)
+    movement_count: int = Field(default=0)
+    qty_in: int = Field(default=0)    # 正向 delta 之和
+    qty_out: int = Field(default=0)   # 负向 delta 的绝对值之和
+    net: int = Field(default=0)       # delta 之和
+
+
+class SchemaMigration(SQLModel, table=True):
+    # ✅ 已执行过的迁移（见 app/migrations.py）：create_all 只建缺的表，不会给已有的表补索引 / 列
+    version: int = Field(primary_key=True)
+    name: str
+    applied_at: datetime = Field(default_factory=datetime.utcnow)
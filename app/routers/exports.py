@@ -0,0 +1,75 @@
+import os
+from typing import Callable
+from urllib.parse import quote
+
+from fastapi import APIRouter, Depends
+from fastapi.responses import FileResponse
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import get_session, get_session_factory
+from app.deps import Principal, require_user
+from app.schemas import ExportJobCreate, ExportJobRead
+from app.services.export_jobs import ExportJob, export_jobs
+from app.services.exports import XLSX_MEDIA_TYPE
+from app.services.ledger import abort
+
+router = APIRouter(prefix="/exports", tags=["exports"])
+
+
+def _job_read(job: ExportJob, cached: bool = False) -> dict:
+    return {
+        "id": job.id,
+        "status": job.status,
+        "q": job.q,
+        "rows": job.rows,
+        "total": job.total,
+        "cached": cached,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+        "error": job.error,
+        "file_url": f"/exports/{job.id}/file" if job.status == "done" else None,
+    }
+
+
+def _get_job(job_id: str) -> ExportJob:
+    job = export_jobs.get(job_id)
+    if job is None:
+        abort(404, "NOT_FOUND", "导出任务不存在或已过期")
+    return job
+
+
+@router.post("", response_model=ExportJobRead, status_code=202)
+async def create_export(
+        data: ExportJobCreate,
+        session: AsyncSession = Depends(get_session),
+        session_factory: Callable[[], AsyncSession] = Depends(get_session_factory),
+        _user: Principal = Depends(require_user),
+):
+    # ✅ 只登记任务立刻返回；同样的 q + 数据没变过 -> 复用已有任务 / 磁盘上的文件，不重复渲染
+    job, cached = await export_jobs.submit(session, session_factory, data.q)
+    return _job_read(job, cached)
+
+
+@router.get("/{job_id}", response_model=ExportJobRead)
+async def get_export(
+        job_id: str,
+        _user: Principal = Depends(require_user),
+):
+    return _job_read(_get_job(job_id))
+
+
+@router.get("/{job_id}/file")
+async def download_export(
+        job_id: str,
+        _user: Principal = Depends(require_user),
+):
+    job = _get_job(job_id)
+    if job.status != "done":
+        abort(409, "EXPORT_NOT_READY", f"导出任务还没完成（{job.status}）")
+    if not os.path.exists(job.path):
+        abort(404, "NOT_FOUND", "导出文件已过期，请重新提交")
+
+    quoted = quote("刀具台账.xlsx")
+    headers = {"Content-Disposition": f"attachment; filename=\"tools.xlsx\"; filename*=UTF-8''{quoted}"}
+    # FileResponse 自带 Content-Length，文件由 sendfile / 分块读发出去，不进内存
+    return FileResponse(job.path, media_type=XLSX_MEDIA_TYPE, headers=headers)
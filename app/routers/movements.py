@@ -1,115 +1,78 @@
-from zoneinfo import ZoneInfo
+import os
 from typing import Optional
-from fastapi import APIRouter, Depends, Query
-from sqlalchemy import func
-from sqlmodel import Session, select
+from urllib.parse import quote
+from fastapi import APIRouter, Depends, Query, Request, Response
+from fastapi.responses import StreamingResponse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
 from app.db import get_session
-from app.models import Tool, User, ToolMovement
-from app.schemas import MovementCreate, MovementRead, MovementListResponse, MovementAction, MovementSort
-from app.services.ledger import calc_signed_delta_and_new_qty, build_note, abort
-from datetime import datetime, date, timedelta, timezone
-
-def _get_zone(tz_str: Optional[str]) -> Optional[ZoneInfo]:
-    if not tz_str:
-        return None
-    tz_str = tz_str.strip()
-    if not tz_str:
-        return None
-    try:
-        return ZoneInfo(tz_str)
-    except Exception:
-        abort(400, "BAD_REQUEST", f"tz 不合法：{tz_str}（例：Asia/Shanghai / Asia/Tokyo / UTC）")
-
-
-def _parse_dt_or_date(s: str, *, is_end: bool, assume_tz: Optional[ZoneInfo]) -> datetime:
-    """
-    支持:
-      - "YYYY-MM-DD"
-      - ISO datetime: "YYYY-MM-DDTHH:MM:SS", "YYYY-MM-DDTHH:MM:SSZ", "YYYY-MM-DDTHH:MM:SS+08:00"
-    规则:
-      - 日期: start=当地00:00:00, end=次日00:00:00 (左闭右开)
-      - datetime: 原样解释
-      - 若输入不带时区: 使用 assume_tz；若 assume_tz 也没有，则按 UTC
-      - 最终返回 UTC-naive（匹配你 DB 里的 utcnow() naive）
-    """
-    s = (s or "").strip()
-    if not s:
-        abort(400, "BAD_REQUEST", "start/end 不能为空")
-
-    # 1) 纯日期
-    if len(s) == 10 and s[4] == "-" and s[7] == "-":
-        try:
-            d = date.fromisoformat(s)
-        except ValueError:
-            abort(400, "BAD_REQUEST", f"日期格式错误：{s}，应为 YYYY-MM-DD")
-
-        local_dt = datetime(d.year, d.month, d.day)
-        if is_end:
-            local_dt = local_dt + timedelta(days=1)
-
-        # 给日期补时区（若没提供 tz，则按 UTC）
-        tz = assume_tz or timezone.utc
-        local_dt = local_dt.replace(tzinfo=tz)
-
-        # 转 UTC -> 去 tzinfo
-        return local_dt.astimezone(timezone.utc).replace(tzinfo=None)
-
-    # 2) datetime（兼容 Z）
-    try:
-        iso = s.replace("Z", "+00:00")
-        dt = datetime.fromisoformat(iso)
-    except ValueError:
-        abort(400, "BAD_REQUEST", f"时间格式错误：{s}，例：2026-01-12T08:30:00 或 2026-01-12T08:30:00Z")
-
-    # 如果输入不带时区，就用 tz 参数；否则尊重输入自己的时区
-    if dt.tzinfo is None:
-        tz = assume_tz or timezone.utc
-        dt = dt.replace(tzinfo=tz)
-
-    # 转 UTC -> 去 tzinfo
-    return dt.astimezone(timezone.utc).replace(tzinfo=None)
-
-
-from app.deps import require_user
+from app.models import ToolMovement
+from app.schemas import MovementCreate, MovementRead, MovementListResponse, MovementAction, MovementSort, ExportFormat
+from app.schemas import MovementBatchCreate, MovementBatchResponse
+from app.schemas import MovementSummaryResponse, SummaryBucket
+from app.services.ledger import abort, apply_movement_batch, record_quantity_change
+from app.services.pagination import encode_cursor, decode_cursor, seek_after
+from app.services.timeutil import _get_zone, _parse_dt_or_date
+from app.services.rollup import GROUP_COLUMNS, summarize_movements
+from app.services.counters import MOVEMENT_KEY, MOVEMENT_GEN_KEY, movement_tool_key, read_generation, read_values, resolve_total
+from app.services.archive import ARCHIVE_KEY, boundary_from, movements_count, movements_select, reaches_archive, read_boundary
+from app.services.http_cache import cache_headers, is_not_modified, list_etag, not_modified, set_cache_headers
+from app.services.fastjson import json_response
+from app.services.exports import (
+    FETCH_CHUNK,
+    XLSX_MEDIA_TYPE,
+    render_movements_xlsx,
+    iter_movements_csv,
+    iter_movements_ndjson,
+    iter_file,
+)
+from datetime import datetime
+
+from app.deps import Principal, require_user
 
 router = APIRouter(prefix="/movements", tags=["movements"])
 
 
 @router.post("", response_model=MovementRead)
-def create_movement(
+async def create_movement(
         data: MovementCreate,
-        session: Session = Depends(get_session),
-        user: User = Depends(require_user),
+        session: AsyncSession = Depends(get_session),
+        user: Principal = Depends(require_user),
 ):
-    tool = session.get(Tool, data.tool_id)
-    if not tool:
-        abort(404, "NOT_FOUND", "Tool not found")
+    # ✅ 库存加减在库里原子完成，并发出库不会丢更新、不会扣成负数
+    mv = await record_quantity_change(session, data.tool_id, data.action, data.delta, data.note, user.username)
+    await session.refresh(mv)
+    return mv
 
-    old_qty = tool.quantity
-    signed_delta, new_qty = calc_signed_delta_and_new_qty(data.action, data.delta, old_qty)
 
-    tool.quantity = new_qty
-    tool.updated_at = datetime.utcnow()
+@router.post("/batch", response_model=MovementBatchResponse)
+async def create_movements_batch(
+        data: MovementBatchCreate,
+        session: AsyncSession = Depends(get_session),
+        user: Principal = Depends(require_user),
+):
+    results = await apply_movement_batch(session, data.items, user.username, data.atomic)
+    succeeded = sum(1 for r in results if r["ok"])
+    return {
+        "total": len(results),
+        "succeeded": succeeded,
+        "failed": len(results) - succeeded,
+        "items": results,
+    }
 
-    note = build_note(data.action, data.delta, old_qty, new_qty, data.note)
 
-    mv = ToolMovement(
-        tool_id=tool.id,
-        action=data.action.value,  # Enum -> str
-        delta=signed_delta,  # ✅ 永远存“真实变化量”
-        note=note,
-        operator=user.username,
-    )
-
-    session.add(tool)
-    session.add(mv)
-    session.commit()
-    session.refresh(mv)
-    return mv
+class MovementConds(list):
+    """
+    WHERE 条件列表；counter_key：不过滤 / 只按 tool_id 过滤时对应的行数计数器，total 直接读它。
+    start：时间范围下界（UTC），判断要不要连归档表一起查。
+    time_only：只有 start / end 条件（按 id 排序时换走时间索引的查法，见 _time_window_ids）。
+    """
+    counter_key: Optional[str] = None
+    start: Optional[datetime] = None
+    time_only: bool = False
 
 
-@router.get("", response_model=MovementListResponse)
-def list_movements(
+async def movement_filters(
     tool_id: Optional[int] = Query(None, ge=1, description="按刀具ID过滤（可选）"),
     action: Optional[MovementAction] = Query(None, description="按动作过滤（可选）"),
     operator: Optional[str] = Query(None, min_length=1, max_length=50, description="按操作人过滤（可选）"),
@@ -117,28 +80,20 @@ def list_movements(
                               description="时区（可选）。例：Asia/Shanghai / Asia/Tokyo / UTC。若 start/end 不带时区则按该时区解释"),
     start: Optional[str] = Query(None, description="开始时间/日期。例：2026-01-12 或 2026-01-12T08:30:00（可配 tz）"),
     end: Optional[str] = Query(None, description="结束时间/日期（左闭右开）。例：2026-01-13 或 2026-01-12T20:00:00（可配 tz）"),
-    sort: MovementSort = Query(MovementSort.id_desc, description="排序方式（可选）"),
-    limit: int = Query(50, ge=1, le=200),
-    offset: int = Query(0, ge=0),
-    session: Session = Depends(get_session),
-    _user: User = Depends(require_user),
-):
-    stmt = select(ToolMovement)
-    count_stmt = select(func.count()).select_from(ToolMovement)
+) -> MovementConds:
+    """列表 / 导出共用的过滤参数（依赖注入），返回 WHERE 条件列表。"""
+    conds = MovementConds()
 
     if tool_id is not None:
-        stmt = stmt.where(ToolMovement.tool_id == tool_id)
-        count_stmt = count_stmt.where(ToolMovement.tool_id == tool_id)
+        conds.append(ToolMovement.tool_id == tool_id)
 
     if action is not None:
-        stmt = stmt.where(ToolMovement.action == action.value)
-        count_stmt = count_stmt.where(ToolMovement.action == action.value)
+        conds.append(ToolMovement.action == action.value)
 
     if operator is not None:
         op = operator.strip()
         if op:
-            stmt = stmt.where(ToolMovement.operator == op)
-            count_stmt = count_stmt.where(ToolMovement.operator == op)
+            conds.append(ToolMovement.operator == op)
     zone = _get_zone(tz)
 
     start_dt = None
@@ -146,28 +101,196 @@ def list_movements(
 
     if start:
         start_dt = _parse_dt_or_date(start, is_end=False, assume_tz=zone)
-        stmt = stmt.where(ToolMovement.created_at >= start_dt)
-        count_stmt = count_stmt.where(ToolMovement.created_at >= start_dt)
+        conds.append(ToolMovement.created_at >= start_dt)
 
     if end:
         end_dt = _parse_dt_or_date(end, is_end=True, assume_tz=zone)
-        stmt = stmt.where(ToolMovement.created_at < end_dt)
-        count_stmt = count_stmt.where(ToolMovement.created_at < end_dt)
+        conds.append(ToolMovement.created_at < end_dt)
 
     if start_dt is not None and end_dt is not None and start_dt >= end_dt:
         abort(400, "BAD_REQUEST", "start 必须早于 end")
 
-    # ✅ sort: 统一入口切换 order_by
-    if sort == MovementSort.id_desc:
-        stmt = stmt.order_by(ToolMovement.id.desc())
-    elif sort == MovementSort.id_asc:
-        stmt = stmt.order_by(ToolMovement.id.asc())
-    elif sort == MovementSort.created_desc:
-        stmt = stmt.order_by(ToolMovement.created_at.desc(), ToolMovement.id.desc())
-    elif sort == MovementSort.created_asc:
-        stmt = stmt.order_by(ToolMovement.created_at.asc(), ToolMovement.id.asc())
+    conds.start = start_dt
+    conds.time_only = bool(conds) and tool_id is None and action is None and operator is None
+    if not conds:
+        conds.counter_key = MOVEMENT_KEY
+    elif len(conds) == 1 and tool_id is not None:
+        conds.counter_key = movement_tool_key(tool_id)
+    return conds
+
+
+# MovementRead 的字段（顺序也是导出列的顺序）
+MOVEMENT_COLUMNS = (
+    ToolMovement.id,
+    ToolMovement.tool_id,
+    ToolMovement.action,
+    ToolMovement.delta,
+    ToolMovement.note,
+    ToolMovement.operator,
+    ToolMovement.created_at,
+)
+
+
+def _movement_order(sort: MovementSort):
+    # ✅ sort: 统一入口切换 order_by（排序键最后一列永远是 id，保证顺序稳定、游标可用）
+    if sort in (MovementSort.id_desc, MovementSort.id_asc):
+        keys = (ToolMovement.id,)
+        key_types = (int,)
+    else:
+        keys = (ToolMovement.created_at, ToolMovement.id)
+        key_types = (datetime, int)
+    desc = sort in (MovementSort.id_desc, MovementSort.created_desc)
+    order_by = [k.desc() if desc else k.asc() for k in keys]
+    return keys, key_types, desc, order_by
+
+
+def _time_window_ids(where: list, desc: bool, n: int):
+    """
+    只按时间过滤、按 id 排序时的页内 id：id IN (子查询)。
+    直接 WHERE created_at 范围 ORDER BY id 时 SQLite 沿主键从一头往回走，窗口外的行也要一行行走过（窗口越旧越慢，最坏整表）；
+    这里 ORDER BY id+0 让它用不上主键顺序，只在 (created_at, id) 覆盖索引里读窗口内的 id，排序取前 n 个再回表，
+    代价只和窗口大小有关。连归档表时 movements_select 把子查询一起换到归档表上，两边各取前 n 个再合并。
+    """
+    pick = ToolMovement.id + 0
+    top = select(ToolMovement.id).where(*where).order_by(pick.desc() if desc else pick.asc()).limit(n)
+    return [ToolMovement.id.in_(top)]
 
-    total = session.exec(count_stmt).one()
-    items = session.exec(stmt.offset(offset).limit(limit)).all()
 
-    return {"items": items, "total": total, "limit": limit, "offset": offset}
\ No newline at end of file
+@router.get("", response_model=MovementListResponse)
+async def list_movements(
+    request: Request,
+    conds: MovementConds = Depends(movement_filters),
+    sort: MovementSort = Query(MovementSort.id_desc, description="排序方式（可选）"),
+    limit: int = Query(50, ge=1, le=200),
+    offset: int = Query(0, ge=0),
+    cursor: Optional[str] = Query(None, description="游标（可选）。传上一页返回的 next_cursor；传了就忽略 offset，深翻页不变慢"),
+    include_total: bool = Query(True, description="是否返回 total；无限滚动传 false，只看 next_cursor"),
+    estimate: bool = Query(False, description="带过滤条件时 total 允许用几秒内缓存的近似值"),
+    session: AsyncSession = Depends(get_session),
+    _user: Principal = Depends(require_user),
+):
+    # ✅ 条件 GET：流水表没有新写入就 304（轮询最新流水的看板）；归档边界和代数一条查询读出来
+    stored = await read_values(session, MOVEMENT_GEN_KEY, ARCHIVE_KEY)
+    etag = list_etag(request, stored.get(MOVEMENT_GEN_KEY, 0))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    # ✅ 时间范围够到归档边界以下才连归档表一起查；近期范围只查主表
+    archived = reaches_archive(boundary_from(stored.get(ARCHIVE_KEY)), conds.start)
+    count_stmt = movements_count(conds, archived)
+    keys, key_types, desc, order_by = _movement_order(sort)
+
+    # ✅ total：不过滤 / 只按 tool_id 过滤读计数器（写入时维护），其它过滤才 COUNT（estimate 时走短缓存）
+    total, total_estimated = await resolve_total(session, count_stmt, conds.counter_key, include_total, estimate)
+
+    # ✅ 游标模式：WHERE (created_at, id) < (...) 走复合索引，第 N 页和第 1 页一样快
+    # ✅ 只有时间范围 + 按 id 排序：走 (created_at, id) 索引只读窗口内的行（见 _time_window_ids）
+    by_window = conds.time_only and len(keys) == 1
+    where = list(conds)
+    if cursor:
+        values = decode_cursor(cursor, sort.value, key_types)
+        # id+0：游标条件也不能让 SQLite 改走主键范围
+        where.append(seek_after((ToolMovement.id + 0,) if by_window else keys, values, desc))
+        offset = 0
+    if by_window:
+        where = _time_window_ids(where, desc, offset + limit + 1)
+    stmt = movements_select(MOVEMENT_COLUMNS, where, order_by, archived)
+
+    # 多取 1 行判断还有没有下一页
+    rows = (await session.exec(stmt.offset(offset).limit(limit + 1))).all()
+    items = rows[:limit]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(sort.value, [getattr(last, k.key) for k in keys])
+
+    # ✅ 快路径：行元组直接拼成 MovementRead 的字段，跳过 Pydantic 二次校验，orjson 编码 + 大 body 压缩
+    return await json_response(request, {
+        "items": [row._asdict() for row in items],
+        "total": total,
+        "total_estimated": total_estimated,
+        "limit": limit,
+        "offset": offset,
+        "next_cursor": next_cursor,
+    }, cache_headers(etag))
+
+
+@router.get("/summary", response_model=MovementSummaryResponse)
+async def movement_summary(
+    request: Request,
+    response: Response,
+    bucket: SummaryBucket = Query(SummaryBucket.day, description="按当地 day / week / month 分桶"),
+    group_by: list[str] = Query([], description="再按 tool / action / operator 分组；可重复传或逗号分隔"),
+    tool_id: Optional[int] = Query(None, ge=1, description="按刀具ID过滤（可选）"),
+    action: Optional[MovementAction] = Query(None, description="按动作过滤（可选）"),
+    operator: Optional[str] = Query(None, min_length=1, max_length=50, description="按操作人过滤（可选）"),
+    tz: Optional[str] = Query(None, description="时区（可选）。分桶和 start/end 都按它解释，默认 UTC"),
+    start: Optional[str] = Query(None, description="开始时间/日期（可配 tz）"),
+    end: Optional[str] = Query(None, description="结束时间/日期（左闭右开，可配 tz）"),
+    session: AsyncSession = Depends(get_session),
+    _user: Principal = Depends(require_user),
+):
+    groups = [g.strip() for raw in group_by for g in raw.split(",") if g.strip()]
+    for g in groups:
+        if g not in GROUP_COLUMNS:
+            abort(400, "BAD_REQUEST", f"group_by 不支持：{g}（可选 tool / action / operator）")
+    groups = list(dict.fromkeys(groups))
+
+    etag = list_etag(request, await read_generation(session, MOVEMENT_GEN_KEY))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+    set_cache_headers(response, etag)
+
+    zone = _get_zone(tz)
+    start_dt = _parse_dt_or_date(start, is_end=False, assume_tz=zone) if start else None
+    end_dt = _parse_dt_or_date(end, is_end=True, assume_tz=zone) if end else None
+    if start_dt is not None and end_dt is not None and start_dt >= end_dt:
+        abort(400, "BAD_REQUEST", "start 必须早于 end")
+
+    # ✅ 读按小时预聚合的 rollup 表，不扫流水
+    items, source = await summarize_movements(
+        session,
+        bucket=bucket.value,
+        group_by=groups,
+        zone=zone,
+        start=start_dt,
+        end=end_dt,
+        tool_id=tool_id,
+        action=action.value if action else None,
+        operator=operator.strip() if operator and operator.strip() else None,
+    )
+    return {
+        "bucket": bucket,
+        "tz": str(zone) if zone else "UTC",
+        "group_by": groups,
+        "source": source,
+        "items": items,
+    }
+
+
+@router.get("/export")
+async def export_movements(
+    format: ExportFormat = Query(ExportFormat.csv, description="导出格式：csv / ndjson / xlsx"),
+    conds: MovementConds = Depends(movement_filters),
+    sort: MovementSort = Query(MovementSort.id_asc, description="排序方式（可选）"),
+    session: AsyncSession = Depends(get_session),
+    _user: Principal = Depends(require_user),
+):
+    _, _, _, order_by = _movement_order(sort)
+    archived = reaches_archive(await read_boundary(session), conds.start)
+    stmt = movements_select(MOVEMENT_COLUMNS, conds, order_by, archived)
+    # ✅ 服务端游标：边读边写，一次请求导完，不做 COUNT、不分页
+    result = await session.stream(stmt.execution_options(yield_per=FETCH_CHUNK))
+
+    filename = f"movements.{format.value}"
+    quoted = quote(f"刀具流水.{format.value}")
+    headers = {"Content-Disposition": f"attachment; filename=\"{filename}\"; filename*=UTF-8''{quoted}"}
+
+    if format == ExportFormat.xlsx:
+        f = await render_movements_xlsx(result)
+        headers["Content-Length"] = str(os.fstat(f.fileno()).st_size)
+        return StreamingResponse(iter_file(f), media_type=XLSX_MEDIA_TYPE, headers=headers)
+    if format == ExportFormat.ndjson:
+        return StreamingResponse(iter_movements_ndjson(result), media_type="application/x-ndjson", headers=headers)
+    return StreamingResponse(iter_movements_csv(result), media_type="text/csv; charset=utf-8", headers=headers)
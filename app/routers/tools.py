@@ -1,28 +1,56 @@
 from datetime import datetime
-import io
-from fastapi import APIRouter, Depends, HTTPException, Query
-from sqlmodel import Session, select
-from fastapi.responses import Response
-from sqlalchemy import func, or_
-from openpyxl import Workbook
-from openpyxl.styles import Font, Alignment, PatternFill
-from openpyxl.worksheet.table import Table, TableStyleInfo
+import os
+import anyio
+from fastapi import APIRouter, Depends, File, HTTPException, Query, Request, Response, UploadFile
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from fastapi.responses import StreamingResponse
+from sqlalchemy import func
 from urllib.parse import quote
 from app.db import get_session
 from app.schemas import ToolCreate, ToolRead, ToolListResponse,MovementAction
 from app.schemas import ToolQuantityUpdate
 from app.schemas import ToolListItem
-from app.deps import require_user
-from app.models import Tool, User, ToolMovement
-from app.services.ledger import calc_signed_delta_and_new_qty, build_note, abort
+from app.schemas import ToolBalanceResponse, ToolHistoryResponse, LiteFormat
+from app.schemas import ToolImportResponse
+from app.deps import Principal, require_user
+from app.models import Tool, ToolMovement
+from app.services.ledger import abort, movements_written, record_quantity_change
+from app.services.counters import (
+    TOOL_KEY,
+    TOOL_GEN_KEY,
+    bump_counters,
+    bump_generations,
+    read_counter,
+    read_generation,
+    resolve_total,
+    tools_changed,
+)
+from app.services.http_cache import cache_headers, is_not_modified, list_etag, not_modified, row_etag, set_cache_headers
+from app.services.fastjson import (
+    MSGPACK_MEDIA_TYPE,
+    iter_json_arrays,
+    iter_json_objects,
+    iter_msgpack_arrays,
+    json_response,
+    msgpack_available,
+    streamed_response,
+)
+from app.services.pagination import encode_cursor, decode_cursor, cursor_sort, seek_after
+from app.services.search import index_tool, unindex_tool, search_condition
+from app.services.balances import balance_at, balances_at
+from app.services.archive import movements_select
+from app.services.timeutil import _get_zone, _parse_dt_or_date
+from app.services.exports import FETCH_CHUNK, XLSX_MEDIA_TYPE, render_tools_xlsx, iter_file
+from app.services.imports import import_tools, read_csv_rows, read_xlsx_rows
 
 router = APIRouter(prefix="/tools", tags=["tools"])
 
 @router.post("", response_model=ToolRead)
-def create_tool(
+async def create_tool(
         data: ToolCreate,
-        session: Session = Depends(get_session),
-        _user: User = Depends(require_user),
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
 ):
     tool = Tool(
         name=data.name,
@@ -30,7 +58,8 @@ def create_tool(
         quantity=data.quantity,
     )
     session.add(tool)
-    session.flush()  # 生成 tool.id
+    await session.flush()  # 生成 tool.id
+    await index_tool(session, tool)  # ✅ 搜索索引和 Tool 同一事务写入
 
     if tool.quantity > 0:
         mv = ToolMovement(
@@ -42,14 +71,40 @@ def create_tool(
         )
         tool.updated_at = datetime.utcnow()
         session.add(mv)
-
-    session.commit()
-    session.refresh(tool)
+        await movements_written(session, [{
+            "tool_id": tool.id,
+            "action": mv.action,
+            "operator": mv.operator,
+            "delta": mv.delta,
+            "created_at": mv.created_at,
+        }])
+    else:
+        await tools_changed(session, [tool.id])  # 有期初流水时 movements_written 里已经记过
+
+    await bump_counters(session, {TOOL_KEY: 1})
+    await session.commit()
+    await session.refresh(tool)
     return tool
 
 
+# 排序键 -> (主排序列, 值类型, 是否倒序)；所有排序最后都用 id 兜底，保证顺序稳定
+SORT_KEYS = {
+    "id_desc": (Tool.id, int, True),
+    "id_asc": (Tool.id, int, False),
+    "name_asc": (Tool.name, str, False),
+    "name_desc": (Tool.name, str, True),
+    "qty_asc": (Tool.quantity, int, False),
+    "qty_desc": (Tool.quantity, int, True),
+}
+
+
+# ToolListItem 的字段，列表接口直接 select 这些列
+TOOL_LIST_COLUMNS = (Tool.id, Tool.name, Tool.location, Tool.quantity)
+
+
 @router.get("", response_model=ToolListResponse)
-def list_tools(
+async def list_tools(
+        request: Request,
         q: str | None = None,
         limit: int = Query(50, ge=1, le=200),
         offset: int = Query(0, ge=0),
@@ -57,245 +112,342 @@ def list_tools(
             "id_desc",
             description="排序：id_desc/id_asc/name_asc/name_desc/qty_asc/qty_desc",
         ),
-        session: Session = Depends(get_session),
-        _user: User = Depends(require_user),
+        cursor: str | None = Query(None, description="游标（可选）。传上一页返回的 next_cursor；传了就忽略 offset"),
+        include_total: bool = Query(True, description="是否返回 total；无限滚动传 false，只看 next_cursor"),
+        estimate: bool = Query(False, description="带 q 时 total 允许用几秒内缓存的近似值"),
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
 ):
+    # ✅ 条件 GET：tool 表的变更代数没变 -> 同样的查询结果一定一样，直接 304，不查数据不序列化
+    etag = list_etag(request, await read_generation(session, TOOL_GEN_KEY))
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
     conds = []
     if q:
-        conds.append(or_(Tool.name.contains(q), Tool.location.contains(q)))
+        conds.append(await search_condition(session, q))
 
-    # total
+    # total：不过滤直接读计数器；带 q 时按 include_total / estimate 决定要不要真 COUNT
     count_stmt = select(func.count()).select_from(Tool)
     if conds:
         count_stmt = count_stmt.where(*conds)
-    total = session.exec(count_stmt).one()
+    total, total_estimated = await resolve_total(
+        session, count_stmt, None if conds else TOOL_KEY, include_total, estimate
+    )
 
     # order by
-    order_map = {
-        "id_desc": Tool.id.desc(),
-        "id_asc": Tool.id.asc(),
-        "name_asc": Tool.name.asc(),
-        "name_desc": Tool.name.desc(),
-        "qty_asc": Tool.quantity.asc(),
-        "qty_desc": Tool.quantity.desc(),
-    }
-    if sort not in order_map:
+    if sort not in SORT_KEYS:
         abort(400, "BAD_REQUEST", f"sort 不支持：{sort}")
-    order_by = order_map[sort]
+    key_col, key_type, desc = SORT_KEYS[sort]
+    keys = (key_col,) if key_col is Tool.id else (key_col, Tool.id)
+    key_types = (key_type,) if key_col is Tool.id else (key_type, int)
 
-    # items
-    items_stmt = select(Tool)
+    # items：只取 ToolListItem 的列，拿行元组，不构造 ORM 对象
+    items_stmt = select(*TOOL_LIST_COLUMNS)
     if conds:
         items_stmt = items_stmt.where(*conds)
+    items_stmt = items_stmt.order_by(*[k.desc() if desc else k.asc() for k in keys])
 
-    items = session.exec(items_stmt.order_by(order_by).offset(offset).limit(limit)).all()
+    # ✅ 游标模式：WHERE (name, id) > (...) 走 (name, id) 索引，翻到多深都是常数代价
+    if cursor:
+        values = decode_cursor(cursor, sort, key_types)
+        items_stmt = items_stmt.where(seek_after(keys, values, desc))
+        offset = 0
 
-    return {
-        "items": items,
+    rows = (await session.exec(items_stmt.offset(offset).limit(limit + 1))).all()
+    items = rows[:limit]
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor(sort, [getattr(last, k.key) for k in keys])
+
+    # ✅ 快路径：字段已经按 ToolListResponse 拼好，跳过 Pydantic 二次校验，orjson 编码 + 大 body 压缩
+    return await json_response(request, {
+        "items": [row._asdict() for row in items],
         "total": total,
+        "total_estimated": total_estimated,
         "limit": limit,
         "offset": offset,
         "q": q,
-    }
+        "next_cursor": next_cursor,
+    }, cache_headers(etag))
+
+
+LITE_FIELDS = tuple(c.key for c in TOOL_LIST_COLUMNS)
+LITE_MAX_LIMIT = 10000
 
 
 @router.get("/lite", response_model=list[ToolListItem])
-def list_tools_lite(
-        session: Session = Depends(get_session),
-        _user: User = Depends(require_user),
+async def list_tools_lite(
+        request: Request,
+        format: LiteFormat = Query(LiteFormat.json, description="json=对象数组；compact=数组的数组（列见 X-Columns）；msgpack=MessagePack"),
+        limit: int = Query(2000, ge=1, le=LITE_MAX_LIMIT),
+        since: str | None = Query(None, description="增量刷新：从 updated_at >= since 的刀具开始拉（ISO 时间，UTC）；之后用 X-Next-Cursor"),
+        tz: str | None = Query(None, description="since 不带时区时按它解释，默认 UTC"),
+        cursor: str | None = Query(None, description="上一次响应头里的 X-Next-Cursor（全量翻页 / 增量同步都用它接着拉）"),
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
 ):
-    stmt = select(Tool).order_by(Tool.id.desc())
-    return session.exec(stmt).all()
+    """
+    下拉框数据源：只取 4 列，按 limit 分页，响应分块流式编码。
+      - 全量：id 倒序；X-Next-Cursor 只在还有下一页时给
+      - 增量（since / 增量游标）：按 (change_seq, id) 升序；X-Next-Cursor 总会给，
+        客户端存下来，下次轮询直接带上，只拿到这之后改过的刀具。
+        change_seq 按提交顺序递增（见 tools_changed）：先取时间、后提交的改动也排在游标后面，不会漏；
+        since 只用来定起点，可能多给几把在它之前改过的刀，客户端按 id 覆盖即可。
+        删除不会出现在增量里：X-Tool-Count 和本地条数对不上时做一次全量。
+    """
+    if format == LiteFormat.msgpack and not msgpack_available():
+        abort(406, "UNSUPPORTED_FORMAT", "服务端未安装 msgpack，请用 format=compact")
+
+    generation = await read_generation(session, TOOL_GEN_KEY)
+    etag = list_etag(request, generation)
+    if is_not_modified(request, etag):
+        return not_modified(etag)
+
+    cursor_kind = cursor_sort(cursor) if cursor else None
+    sync = since is not None or cursor_kind in ("lite_seq", "lite_sync")
+    if sync:
+        keys = (Tool.change_seq, Tool.id)
+        stmt = select(*TOOL_LIST_COLUMNS, Tool.change_seq).order_by(Tool.change_seq.asc(), Tool.id.asc())
+        if cursor is not None and cursor_kind != "lite_sync":
+            position = after = decode_cursor(cursor, "lite_seq", (int, int))
+        else:
+            # since，或升级前按 (updated_at, id) 签发的游标：从 updated_at >= 它的刀具里最早的序号接着拉（子查询，不多一条语句）；
+            # 一把都没有时这一页是空的，游标给当前代数（之后提交的改动序号都比它大）
+            if cursor_kind == "lite_sync":
+                start = decode_cursor(cursor, "lite_sync", (datetime, int))[0]
+            else:
+                start = _parse_dt_or_date(since, is_end=False, assume_tz=_get_zone(tz))
+            # change_seq + 0：走 updated_at 索引的范围，不让 min() 沿 change_seq 索引从头逐行回表找
+            first = select(func.min(Tool.change_seq + 0)).where(Tool.updated_at >= start).scalar_subquery()
+            after = [func.coalesce(first, generation), 0]
+            position = [generation, 0]
+        stmt = stmt.where(seek_after(keys, after, desc=False))
+    else:
+        stmt = select(*TOOL_LIST_COLUMNS).order_by(Tool.id.desc())
+        if cursor:
+            (last_id,) = decode_cursor(cursor, "lite", (int,))
+            stmt = stmt.where(Tool.id < last_id)
+
+    # 一页最多 LITE_MAX_LIMIT 行元组，先取完再流式编码：X-Next-Cursor 要在 body 之前发出
+    rows = (await session.exec(stmt.limit(limit + 1))).all()
+    page = rows[:limit]
+
+    headers = cache_headers(etag)
+    headers["X-Tool-Count"] = str(await read_counter(session, TOOL_KEY, select(func.count()).select_from(Tool)))
+    if sync:
+        last = page[-1] if page else None
+        headers["X-Next-Cursor"] = encode_cursor("lite_seq", [last.change_seq, last.id] if last else position)
+    elif len(rows) > limit:
+        headers["X-Next-Cursor"] = encode_cursor("lite", [page[-1].id])
+
+    data = [tuple(row[:4]) for row in page]
+    if format == LiteFormat.compact:
+        headers["X-Columns"] = ",".join(LITE_FIELDS)
+        return streamed_response(request, iter_json_arrays(data), "application/json", headers)
+    if format == LiteFormat.msgpack:
+        headers["X-Columns"] = ",".join(LITE_FIELDS)
+        return streamed_response(request, iter_msgpack_arrays(data), MSGPACK_MEDIA_TYPE, headers)
+    return streamed_response(request, iter_json_objects(LITE_FIELDS, data), "application/json", headers)
 
 
 @router.get("/export.xlsx")
-def export_tools_xlsx(
+async def export_tools_xlsx(
     q: str | None = None,
-    session: Session = Depends(get_session),
-    _user: User = Depends(require_user),
+    session: AsyncSession = Depends(get_session),
+    _user: Principal = Depends(require_user),
 ):
-    stmt = select(Tool).order_by(Tool.id.asc())
+    # ✅ 只取导出需要的列，按块从游标里拉，不整表 .all()
+    stmt = select(Tool.id, Tool.name, Tool.location, Tool.quantity, Tool.updated_at).order_by(Tool.id.asc())
     if q:
-        stmt = stmt.where(
-            or_(
-                Tool.name.contains(q),
-                Tool.location.contains(q),
-            )
-        )
-    tools = session.exec(stmt).all()
-
-    header_cn = ["编号", "名称", "库位", "数量", "品牌", "型号", "备注", "更新时间"]
-
-    def norm_str(v, default: str) -> str:
-        if v is None:
-            return default
-        s = str(v).strip()
-        return s if s else default
-
-    def norm_int(v, default: int = 0) -> int:
-        if v is None:
-            return default
-        try:
-            return int(v)
-        except Exception:
-            return default
-
-    def norm_dt_obj(v):
-        if v is None:
-            return None
-        if isinstance(v, datetime):
-            return v.replace(tzinfo=None) if v.tzinfo else v
-        return None
-
-    wb = Workbook()
-    ws = wb.active
-    ws.title = "刀具台账"
-
-    # 表头样式（依旧保留，Table 也会有样式，但这让首行更“台账”）
-    header_font = Font(bold=True)
-    header_fill = PatternFill("solid", fgColor="DDDDDD")
-    header_align = Alignment(horizontal="center", vertical="center")
-
-    ws.append(header_cn)
-    ws.row_dimensions[1].height = 26  # 表头行高度（可改成 24/26 更“厚”）
-    for col in range(1, len(header_cn) + 1):
-        cell = ws.cell(row=1, column=col)
-        cell.font = header_font
-        cell.fill = header_fill
-        cell.alignment = header_align
-
-    # 数据行
-    for t in tools:
-        d = t.model_dump()
-        ws.append([
-            norm_int(d.get("id"), 0),
-            norm_str(d.get("name"), "未命名"),
-            norm_str(d.get("location"), "未知"),
-            norm_int(d.get("quantity"), 0),
-            norm_str(d.get("vendor"), ""),
-            norm_str(d.get("model"), ""),
-            norm_str(d.get("remark"), ""),
-            norm_dt_obj(d.get("updated_at")),
-        ])
-
-    data_end_row = 1 + len(tools)  # 表头+数据
-
-    # ✅ 冻结首行
-    ws.freeze_panes = "A2"
-
-    # ✅ 列格式：数量/更新时间
-    for r in range(2, data_end_row + 1):
-        ws.cell(row=r, column=4).number_format = "0"  # 数量
-        ws.cell(row=r, column=8).number_format = "yyyy-mm-dd hh:mm:ss"  # 更新时间
-
-    # ✅ 列宽（稳定台账风格）
-    col_widths = {
-        "A": 8,   # 编号
-        "B": 22,  # 名称
-        "C": 12,  # 库位
-        "D": 8,   # 数量
-        "E": 12,  # 品牌
-        "F": 16,  # 型号
-        "G": 28,  # 备注
-        "H": 20,  # 更新时间
-    }
-    for k, w in col_widths.items():
-        ws.column_dimensions[k].width = w
-
-    # ✅ 加 Table 样式（只覆盖表头+数据）
-    # 如果没有数据，也至少给到表头行，避免范围非法
-    last_row = max(1, data_end_row)
-    table_ref = f"A1:H{last_row}"
-
-    table = Table(displayName=f"ToolsLedger_{datetime.now().strftime('%H%M%S')}", ref=table_ref)
-    style = TableStyleInfo(
-        name="TableStyleMedium9",   # 你也可以换成 Medium2/Medium10 等
-        showFirstColumn=False,
-        showLastColumn=False,
-        showRowStripes=True,        # ✅ 条纹行
-        showColumnStripes=False,
-    )
-    table.tableStyleInfo = style
-    ws.add_table(table)
-
-    # 末尾：导出时间（不在 Table 范围里）
-    ws.append([])
-    ws.append(["导出时间", datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+        stmt = stmt.where(await search_condition(session, q))
+    result = await session.stream(stmt.execution_options(yield_per=FETCH_CHUNK))
 
-    buf = io.BytesIO()
-    wb.save(buf)
-    xlsx_bytes = buf.getvalue()
+    # 渲染到磁盘临时文件，再分块流式返回；峰值内存和导出行数无关
+    f = await render_tools_xlsx(result)
+    size = os.fstat(f.fileno()).st_size
 
     cn_filename = "刀具台账.xlsx"
     quoted = quote(cn_filename)
     headers = {
-        "Content-Disposition": f"attachment; filename=\"tools.xlsx\"; filename*=UTF-8''{quoted}"
+        "Content-Disposition": f"attachment; filename=\"tools.xlsx\"; filename*=UTF-8''{quoted}",
+        "Content-Length": str(size),
     }
 
-    return Response(
-        content=xlsx_bytes,
-        media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
-        headers=headers,
-    )
+    return StreamingResponse(iter_file(f), media_type=XLSX_MEDIA_TYPE, headers=headers)
 
 
-@router.patch("/{tool_id}/quantity", response_model=ToolRead)
-def update_tool_quantity(
-    tool_id: int,
-    body: ToolQuantityUpdate,
-    session: Session = Depends(get_session),
-    user: User = Depends(require_user),
+# 上传文件后缀 -> 解析函数（同步，丢线程里跑）
+IMPORT_READERS = {".xlsx": read_xlsx_rows, ".csv": read_csv_rows}
+
+
+@router.post("/import", response_model=ToolImportResponse)
+async def import_tools_file(
+        file: UploadFile = File(..., description="和 /tools/export.xlsx 同样列布局的 .xlsx，或同表头的 .csv"),
+        dry_run: bool = Query(False, description="只校验不写库，返回校验报告"),
+        session: AsyncSession = Depends(get_session),
+        user: Principal = Depends(require_user),
 ):
-    tool = session.get(Tool, tool_id)
-    if not tool:
-        abort(404, "NOT_FOUND", "Tool not found")
+    suffix = os.path.splitext(file.filename or "")[1].lower()
+    reader = IMPORT_READERS.get(suffix)
+    if reader is None:
+        abort(400, "UNSUPPORTED_FORMAT", "只支持 .xlsx / .csv")
+
+    # ✅ 先整表校验：有一行不合格就整表不导入，报告里带行号
+    try:
+        report = await anyio.to_thread.run_sync(reader, file.file)
+    except Exception:
+        abort(400, "INVALID_FILE", f"文件解析失败，请确认是 {suffix} 格式")
+
+    imported = 0
+    if not dry_run and report.rows and not report.invalid:
+        imported = await import_tools(session, report.rows, user.username)
+    return {
+        "dry_run": dry_run,
+        "total": len(report.rows) + report.invalid,
+        "valid": len(report.rows),
+        "invalid": report.invalid,
+        "imported": imported,
+        "errors": report.errors,
+    }
+
 
-    old_qty = tool.quantity
-    signed_delta, new_qty = calc_signed_delta_and_new_qty(body.action, body.delta, old_qty)
+@router.get("/balance", response_model=ToolBalanceResponse)
+async def tools_balance_at(
+        at: str = Query(..., description="时间点。例：2026-01-12（当天结束时）或 2026-01-12T08:30:00（可配 tz）"),
+        tz: str | None = Query(None, description="时区（可选）。at 不带时区时按它解释，默认 UTC"),
+        tool_id: list[int] | None = Query(None, description="只看这些刀具（可重复传）；不传则按 id 分页列出全部"),
+        limit: int = Query(200, ge=1, le=1000),
+        offset: int = Query(0, ge=0),
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
+):
+    # ✅ 纯日期按“当天结束”算（和 end 的左闭右开一致）：at=2026-01-12 -> 截至 1/13 00:00 之前
+    at_utc = _parse_dt_or_date(at, is_end=True, assume_tz=_get_zone(tz))
 
-    tool.quantity = new_qty
-    tool.updated_at = datetime.utcnow()
+    stmt = select(Tool.id, Tool.name).order_by(Tool.id.asc())
+    if tool_id:
+        stmt = stmt.where(Tool.id.in_(tool_id))
+    tools = (await session.exec(stmt.offset(offset).limit(limit))).all()
 
-    note = build_note(body.action, body.delta, old_qty, new_qty, body.note)
+    # 每把刀：最近检查点 + 之后的少量流水，不回放全部历史
+    balances = await balances_at(session, [tid for tid, _ in tools], at_utc)
+    items = [{"tool_id": tid, "name": name, "balance": balances[tid]} for tid, name in tools]
+    return {"at": at_utc, "items": items, "limit": limit, "offset": offset}
 
-    mv = ToolMovement(
-        tool_id=tool.id,
-        action=body.action.value,
-        delta=signed_delta,
-        note=note,
-        operator=user.username,
-    )
 
-    session.add(tool)
-    session.add(mv)
-    session.commit()
-    session.refresh(tool)
-    return tool
+@router.get("/{tool_id}/history", response_model=ToolHistoryResponse)
+async def tool_history(
+        tool_id: int,
+        start: str | None = Query(None, description="开始时间/日期（可配 tz）；不传则从第一条流水开始"),
+        end: str | None = Query(None, description="结束时间/日期（左闭右开，可配 tz）"),
+        tz: str | None = Query(None, description="时区（可选）。例：Asia/Shanghai"),
+        limit: int = Query(200, ge=1, le=1000),
+        cursor: str | None = Query(None, description="游标（可选）。传上一页返回的 next_cursor"),
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
+):
+    if not await session.get(Tool, tool_id):
+        abort(404, "NOT_FOUND", "Tool not found")
+
+    zone = _get_zone(tz)
+    start_dt = _parse_dt_or_date(start, is_end=False, assume_tz=zone) if start else None
+    end_dt = _parse_dt_or_date(end, is_end=True, assume_tz=zone) if end else None
+    if start_dt is not None and end_dt is not None and start_dt >= end_dt:
+        abort(400, "BAD_REQUEST", "start 必须早于 end")
+
+    keys = (ToolMovement.created_at, ToolMovement.id)
+    conds = [ToolMovement.tool_id == tool_id]
+    if end_dt is not None:
+        conds.append(ToolMovement.created_at < end_dt)
+
+    # 游标里带着上一页末尾的余额，下一页直接接着累加
+    if cursor:
+        created_at, mv_id, balance = decode_cursor(cursor, "history", (datetime, int, int))
+        conds.append(seek_after(keys, (created_at, mv_id), desc=False))
+    elif start_dt is not None:
+        balance = await balance_at(session, tool_id, start_dt)
+        conds.append(ToolMovement.created_at >= start_dt)
+    else:
+        balance = 0
+    opening = balance
+
+    # ✅ 连归档表一起按 (tool_id, created_at, id) 索引有序读：近期的历史那边只是一次索引探测
+    columns = (ToolMovement.id, ToolMovement.created_at, ToolMovement.action, ToolMovement.delta)
+    rows = (await session.exec(movements_select(columns, conds, keys).limit(limit + 1))).all()
+    items = []
+    for mv_id, created_at, action, delta in rows[:limit]:
+        balance += delta
+        items.append({
+            "movement_id": mv_id,
+            "created_at": created_at,
+            "action": action,
+            "delta": delta,
+            "balance": balance,
+        })
+
+    next_cursor = None
+    if len(rows) > limit:
+        last = items[-1]
+        next_cursor = encode_cursor("history", [last["created_at"], last["movement_id"], balance])
+
+    return {
+        "tool_id": tool_id,
+        "start": start_dt,
+        "end": end_dt,
+        "opening_balance": opening,
+        "items": items,
+        "next_cursor": next_cursor,
+    }
+
+
+@router.patch("/{tool_id}/quantity", response_model=ToolRead)
+async def update_tool_quantity(
+    tool_id: int,
+    body: ToolQuantityUpdate,
+    session: AsyncSession = Depends(get_session),
+    user: Principal = Depends(require_user),
+):
+    # ✅ 条件 UPDATE 原子改库存（见 record_quantity_change），不再“读-算-写”
+    await record_quantity_change(session, tool_id, body.action, body.delta, body.note, user.username)
+    return await session.get(Tool, tool_id, populate_existing=True)
 
 
 @router.delete("/{tool_id}")
-def delete_tool(
+async def delete_tool(
         tool_id: int,
-        session: Session = Depends(get_session),
-        _user: User = Depends(require_user),
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
 ):
-    tool = session.get(Tool, tool_id)
+    tool = await session.get(Tool, tool_id)
     # 查询资源：session.get(Tool, tool_id)
     # 通过 tool_id 从数据库中查询 Tool 模型对应的记录（get 方法按主键查询，效率高于 filter）
     if not tool:
         abort(404, "NOT_FOUND", "Tool not found")
-    session.delete(tool)
-    session.commit()
+    await unindex_tool(session, tool.id)
+    await session.delete(tool)
+    await bump_counters(session, {TOOL_KEY: -1})
+    await bump_generations(session, TOOL_GEN_KEY)
+    await session.commit()
     return {"ok": True}
 
 
 @router.get("/{tool_id}", response_model=ToolRead)
-def get_tool(
+async def get_tool(
         tool_id: int,
-        session: Session = Depends(get_session),
-        _user: User = Depends(require_user),
+        request: Request,
+        response: Response,
+        session: AsyncSession = Depends(get_session),
+        _user: Principal = Depends(require_user),
 ):
-    tool = session.get(Tool, tool_id)
+    tool = await session.get(Tool, tool_id)
     if not tool:
         abort(404, "NOT_FOUND", "Tool not found")
+    # ✅ 每次改库存都会刷新 updated_at：主键查一次就能判断没变，304 不带 body
+    etag = row_etag("tool", tool.id, tool.updated_at)
+    if is_not_modified(request, etag, tool.updated_at):
+        return not_modified(etag, tool.updated_at)
+    set_cache_headers(response, etag, tool.updated_at)
     return tool
\ No newline at end of file
@@ -28,6 +28,21 @@ class ToolRead(BaseModel):
     updated_at: datetime
 
 
+class ToolImportError(BaseModel):
+    row: int  # 表格里的行号，表头是第 1 行
+    code: str
+    message: str
+
+
+class ToolImportResponse(BaseModel):
+    dry_run: bool
+    total: int     # 数据行数（不含表头）
+    valid: int
+    invalid: int
+    imported: int  # 有任何一行校验失败就整表不导入，为 0
+    errors: list[ToolImportError]
+
+
 class ToolListItem(BaseModel):
     id: int
     name: str
@@ -37,10 +52,12 @@ class ToolListItem(BaseModel):
 
 class ToolListResponse(BaseModel):
     items: list[ToolListItem]
-    total: int
+    total: int | None = None  # include_total=false 时为 null
+    total_estimated: bool = False
     limit: int
     offset: int
     q: str | None = None
+    next_cursor: str | None = None
 
 
 class MovementAction(str, Enum):
@@ -65,6 +82,26 @@ class MovementRead(BaseModel):
     operator: str
     created_at: datetime
 
+class MovementBatchCreate(BaseModel):
+    items: list[MovementCreate] = Field(..., min_length=1, max_length=10000)
+    atomic: bool = Field(True, description="True=任意一条失败整批回滚；False=失败的条目跳过，其余照常入账")
+
+
+class MovementBatchItemResult(BaseModel):
+    index: int
+    ok: bool
+    id: Optional[int] = None
+    code: Optional[str] = None
+    message: Optional[str] = None
+
+
+class MovementBatchResponse(BaseModel):
+    total: int
+    succeeded: int
+    failed: int
+    items: list[MovementBatchItemResult]
+
+
 class MovementSort(str, Enum):
     id_desc = "id_desc"
     id_asc = "id_asc"
@@ -72,6 +109,43 @@ class MovementSort(str, Enum):
     created_asc = "created_asc"
 
 
+class ExportFormat(str, Enum):
+    csv = "csv"
+    ndjson = "ndjson"
+    xlsx = "xlsx"
+
+
+class LiteFormat(str, Enum):
+    json = "json"        # 对象数组
+    compact = "compact"  # 数组的数组，列名见响应头 X-Columns
+    msgpack = "msgpack"  # MessagePack，结构同 compact
+
+
+class SummaryBucket(str, Enum):
+    day = "day"
+    week = "week"    # ISO 周，标签是当周周一
+    month = "month"
+
+
+class MovementSummaryItem(BaseModel):
+    bucket: str  # 当地日期 2026-01-12 / 周一日期 / 2026-01
+    tool_id: Optional[int] = None
+    action: Optional[MovementAction] = None
+    operator: Optional[str] = None
+    count: int
+    qty_in: int
+    qty_out: int
+    net: int
+
+
+class MovementSummaryResponse(BaseModel):
+    bucket: SummaryBucket
+    tz: str
+    group_by: list[str]
+    source: str  # rollup / movements
+    items: list[MovementSummaryItem]
+
+
 class ToolQuantityUpdate(BaseModel):
     action: MovementAction = Field(..., description="IN/OUT/ADJUST")
     delta: int = Field(..., ge=0, le=100000, description="IN/OUT=变更量(>0)，ADJUST=目标库存(>=0)")
@@ -90,6 +164,62 @@ class ToolQuantityUpdate(BaseModel):
 
 class MovementListResponse(BaseModel):
     items: list[MovementRead]
-    total: int
+    total: Optional[int] = None  # include_total=false 时为 null
+    total_estimated: bool = False
     limit: int
     offset: int
+    next_cursor: Optional[str] = None
+
+
+class ToolBalanceItem(BaseModel):
+    tool_id: int
+    name: str
+    balance: int
+
+
+class ToolBalanceResponse(BaseModel):
+    at: datetime  # UTC；统计 created_at < at 的全部流水
+    items: list[ToolBalanceItem]
+    limit: int
+    offset: int
+
+
+class ToolHistoryPoint(BaseModel):
+    movement_id: int
+    created_at: datetime
+    action: MovementAction
+    delta: int
+    balance: int  # 这条流水之后的库存
+
+
+class ToolHistoryResponse(BaseModel):
+    tool_id: int
+    start: Optional[datetime] = None  # UTC
+    end: Optional[datetime] = None    # UTC
+    opening_balance: int              # 本页第一条之前的库存
+    items: list[ToolHistoryPoint]
+    next_cursor: Optional[str] = None
+
+
+class ExportJobCreate(BaseModel):
+    q: Optional[str] = None  # 和 /tools/export.xlsx 的 q 一样
+
+
+class ExportJobStatus(str, Enum):
+    queued = "queued"
+    running = "running"
+    done = "done"
+    failed = "failed"
+
+
+class ExportJobRead(BaseModel):
+    id: str
+    status: ExportJobStatus
+    q: Optional[str] = None
+    rows: int                     # 已写入的行数
+    total: Optional[int] = None   # 开始渲染后才知道
+    cached: bool = False          # 复用了已有的任务 / 磁盘上的结果文件
+    created_at: datetime
+    finished_at: Optional[datetime] = None
+    error: Optional[str] = None
+    file_url: Optional[str] = None  # done 之后才有
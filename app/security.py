@@ -1,10 +1,22 @@
+import asyncio
 import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from fastapi import HTTPException
 from jose import jwt, JWTError
 from passlib.context import CryptContext
 from uuid import uuid4
 
-pwd_context = CryptContext(schemes=["pbkdf2_sha256"], deprecated="auto")
+from app.config import settings
+
+# ✅ min_rounds = 当前成本：库里老哈希迭代次数偏低时 verify_and_update 会给出新哈希
+pwd_context = CryptContext(
+    schemes=["pbkdf2_sha256"],
+    deprecated="auto",
+    pbkdf2_sha256__default_rounds=settings.password_hash_rounds,
+    pbkdf2_sha256__min_rounds=settings.password_hash_rounds,
+)
 
 
 def hash_password(password: str) -> str:
@@ -15,6 +27,38 @@ def verify_password(password: str, password_hash: str) -> bool:
     return pwd_context.verify(password, password_hash)
 
 
+def verify_and_update_password(password: str, password_hash: str) -> tuple[bool, str | None]:
+    # 返回 (是否正确, 需要升级时的新哈希 / None)
+    return pwd_context.verify_and_update(password, password_hash)
+
+
+class HashPool:
+    """
+    pbkdf2 专用的有界线程池：最多 workers 个在算、queue 个在排队；
+    再多就立刻 503，避免登录高峰占满 AnyIO 线程池、拖住 /tools 之类的普通请求。
+    """
+
+    def __init__(self, workers: int, queue: int):
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pwhash")
+        self._slots = threading.BoundedSemaphore(workers + queue)
+
+    async def run(self, fn, *args):
+        # 在专用线程里算，await 期间不占事件循环、也不占 AnyIO 线程
+        if not self._slots.acquire(blocking=False):
+            raise HTTPException(
+                status_code=503,
+                detail={"code": "SERVER_BUSY", "message": "登录/注册请求过多，请稍后重试"},
+                headers={"Retry-After": "1"},
+            )
+        try:
+            return await asyncio.wrap_future(self._pool.submit(fn, *args))
+        finally:
+            self._slots.release()
+
+
+hash_pool = HashPool(settings.password_hash_workers, settings.password_hash_queue)
+
+
 def create_access_token(subject: str) -> str:
     secret = os.getenv("secret_key", "dev_secret")
     expire_minutes = int(os.getenv("access_token_expire_minutes", "120"))
@@ -35,7 +79,7 @@ def create_access_token(subject: str) -> str:
 
 
 
-def decode_token(token: str) -> str:
+def decode_token_claims(token: str) -> dict:
     secret = os.getenv("secret_key", "dev_secret")
     payload = jwt.decode(token, secret, algorithms=["HS256"])
 
@@ -47,4 +91,8 @@ def decode_token(token: str) -> str:
     if payload.get("type") not in (None, "access"):
         raise ValueError("Invalid token type")
     # print(jwt.decode(token, secret, algorithms=["HS256"]))
-    return sub
+    return payload
+
+
+def decode_token(token: str) -> str:
+    return decode_token_claims(token)["sub"]
@@ -0,0 +1,131 @@
+"""
+流水归档：超过 settings.archive_after_days 的老流水分批从 toolmovement 挪进同库的 toolmovementarchive。
+主表和它的索引只装近期数据，日常的列表 / COUNT 不再为多年的历史买单。
+
+- 归档边界存在 RowCounter（ARCHIVE_KEY，UTC 秒）：created_at 早于边界的流水可能在归档表里，
+  晚于边界的一定在主表。先写边界再挪数据，所以挪到一半时查询照样完整（两张表合起来就是全部流水）
+- 列表 / 导出：时间范围够到边界以下（没传 start 或 start 早于边界）才 UNION ALL 归档表，否则只查主表
+- 单把刀的历史 / 历史库存 / 全量重建：按刀具或检查点做索引范围查询，归档表那边就是一次索引探测，总是带上
+- 流水计数器（列表 total）数的是全部流水，归档只挪表不改计数
+同库的表而不是 ATTACH 另一个库文件：每批“插归档 + 删主表”在一个事务里原子完成，PostgreSQL 上也一样能用。
+"""
+import asyncio
+import calendar
+from datetime import datetime, timedelta
+from typing import Optional, Sequence
+
+from sqlalchemy import Column, delete, func, insert, tuple_, union_all
+from sqlalchemy.sql.visitors import replacement_traverse
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.db import dialect_insert, retry_on_busy
+from app.models import RowCounter, ToolMovement, ToolMovementArchive
+
+ARCHIVE_KEY = "archive:movement"
+
+_hot = ToolMovement.__table__
+_cold = ToolMovementArchive.__table__
+
+
+def boundary_from(value: Optional[int]) -> Optional[datetime]:
+    return datetime.utcfromtimestamp(value) if value is not None else None
+
+
+async def read_boundary(session: AsyncSession) -> Optional[datetime]:
+    value = (await session.exec(select(RowCounter.value).where(RowCounter.key == ARCHIVE_KEY))).first()
+    return boundary_from(value)
+
+
+def reaches_archive(boundary: Optional[datetime], start: Optional[datetime]) -> bool:
+    """查询的时间范围是否够到归档表（没归档过 -> 永远不用查）。"""
+    return boundary is not None and (start is None or start < boundary)
+
+
+def _rebind(expr, columns):
+    # 把表达式里主表的列换成 columns 里同名的列（归档表 / UNION 的结果列）
+    if hasattr(expr, "__clause_element__"):
+        expr = expr.__clause_element__()
+
+    def swap(e):
+        if isinstance(e, Column) and e.table is _hot:
+            return columns[e.key]
+        return None
+
+    return replacement_traverse(expr, {}, swap)
+
+
+def movements_select(columns: Sequence, conds: Sequence, order_by: Sequence = (), include_archive: bool = True):
+    """
+    按 ToolMovement 的列 / 条件 / 排序写查询；include_archive 时同一份条件也套到归档表上 UNION ALL。
+    带排序的 UNION ALL 在 SQLite 里是 MERGE：两边各自按索引有序读，加了 LIMIT 读够就停，不整体排序。
+    """
+    hot = select(*columns).where(*conds)
+    if not include_archive:
+        return hot.order_by(*order_by)
+    cold = select(*(_rebind(c, _cold.c) for c in columns)).where(*(_rebind(c, _cold.c) for c in conds))
+    stmt = union_all(hot, cold)
+    return stmt.order_by(*(_rebind(o, stmt.selected_columns) for o in order_by))
+
+
+def movements_count(conds: Sequence, include_archive: bool):
+    hot = select(func.count()).select_from(_hot).where(*conds)
+    if not include_archive:
+        return hot
+    cold = select(func.count()).select_from(_cold).where(*(_rebind(c, _cold.c) for c in conds))
+    return select(hot.scalar_subquery() + cold.scalar_subquery())
+
+
+def archive_cutoff(days: int, now: Optional[datetime] = None) -> datetime:
+    """days 天前的 UTC 零点：边界取整到天，存成整秒不丢精度。"""
+    day = (now or datetime.utcnow()) - timedelta(days=days)
+    return datetime(day.year, day.month, day.day)
+
+
+async def _raise_boundary(session: AsyncSession, before: datetime) -> None:
+    # 边界只往后推：之前已经归档到更晚的日期就不动
+    current = await read_boundary(session)
+    if current is None or before > current:
+        ins = dialect_insert(session, RowCounter).values(key=ARCHIVE_KEY, value=calendar.timegm(before.timetuple()))
+        await session.exec(ins.on_conflict_do_update(index_elements=[RowCounter.key], set_={"value": ins.excluded.value}))
+    await session.commit()
+
+
+@retry_on_busy
+async def _archive_batch(session: AsyncSession, before: datetime, batch_size: int) -> int:
+    # 最老的 batch_size 条：按 (created_at, id) 取这一批的末尾，插归档 + 删主表都用同一个范围条件，不拼 IN 列表
+    key = (_hot.c.created_at, _hot.c.id)
+    last = (await session.exec(
+        select(*key).where(_hot.c.created_at < before).order_by(*key).offset(batch_size - 1).limit(1)
+    )).first()
+    cond = [_hot.c.created_at < before]
+    if last is not None:
+        cond.append(tuple_(*key) <= tuple_(*last))
+    names = [c.name for c in _cold.c]  # 按归档表的列拷：主表的 batch_seq 只在插入时用，不带走
+    await session.exec(insert(_cold).from_select(names, select(*(_hot.c[n] for n in names)).where(*cond)))
+    moved = (await session.exec(delete(_hot).where(*cond))).rowcount
+    await session.commit()
+    return moved
+
+
+async def archive_movements(
+    session: AsyncSession,
+    before: datetime,
+    batch_size: Optional[int] = None,
+    pause_seconds: Optional[float] = None,
+) -> int:
+    """
+    把 created_at < before 的流水挪进归档表，返回挪了多少条。
+    每批一个短事务，批与批之间歇一下，把写锁让给在线请求；中途停掉下次接着挪即可。
+    """
+    batch_size = batch_size or settings.archive_batch_size
+    pause = settings.archive_pause_ms / 1000 if pause_seconds is None else pause_seconds
+    await _raise_boundary(session, before)
+    total = 0
+    while True:
+        moved = await _archive_batch(session, before, batch_size)
+        total += moved
+        if moved < batch_size:
+            return total
+        await asyncio.sleep(pause)
@@ -0,0 +1,133 @@
+from datetime import datetime
+from typing import Optional
+
+from sqlalchemy import and_, delete, func, insert, or_, tuple_
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.models import ToolBalanceCheckpoint, ToolMovement
+from app.services.archive import movements_select
+
+REBUILD_BATCH = 1000
+
+# 同一把刀的流水都是拿着这把刀的写锁之后才生成 created_at，所以单把刀内 (created_at, id) 与 id 同序：
+# “截至某条流水的余额”和“某时刻之前的余额”可以混用 movement_id / created_at 做边界。
+
+
+def checkpoints_due(every: int, counts: dict[int, int], added: dict[int, int]) -> list[int]:
+    """本次写入让哪些刀的流水条数跨过了 every 的整数倍。counts 是写入后的条数。"""
+    return [tid for tid, n in added.items() if counts[tid] // every > (counts[tid] - n) // every]
+
+
+async def write_checkpoints(session: AsyncSession, tool_ids: list[int]) -> None:
+    """
+    给这些刀在“当前最后一条流水”处记检查点；须在同一写事务里、流水都已写入之后调用。
+    余额和 rebuild_checkpoints / 没有检查点时一个口径：上一个检查点 + 之后的流水求和，不取 Tool.quantity
+    （老数据里库存和流水之和对不上时，写入时记的和重算出来的也一样）。
+    """
+    last_ids = (
+        select(func.max(ToolMovement.id))
+        .where(ToolMovement.tool_id.in_(tool_ids))
+        .group_by(ToolMovement.tool_id)
+    )
+    rows = (await session.exec(
+        select(ToolMovement.tool_id, ToolMovement.id, ToolMovement.created_at).where(ToolMovement.id.in_(last_ids))
+    )).all()
+    if rows:
+        balances = await balances_at(session, [tid for tid, _, _ in rows])
+        await session.exec(
+            insert(ToolBalanceCheckpoint),
+            params=[
+                {"tool_id": tid, "movement_id": mv_id, "created_at": created_at, "balance": balances[tid]}
+                for tid, mv_id, created_at in rows
+            ],
+        )
+
+
+async def _latest_checkpoints(
+    session: AsyncSession, tool_ids: list[int], at: Optional[datetime]
+) -> dict[int, tuple[int, datetime, int]]:
+    # 每把刀 at 之前（at 为 None：全部）最近的检查点：tool_id -> (movement_id, created_at, balance)
+    cp = ToolBalanceCheckpoint
+    cond = [cp.tool_id.in_(tool_ids)]
+    if at is not None:
+        cond.append(cp.created_at < at)
+    latest = (
+        select(cp.tool_id, func.max(cp.movement_id).label("movement_id"))
+        .where(*cond)
+        .group_by(cp.tool_id)
+        .subquery()
+    )
+    rows = (await session.exec(
+        select(cp.tool_id, cp.movement_id, cp.created_at, cp.balance)
+        .join(latest, and_(cp.tool_id == latest.c.tool_id, cp.movement_id == latest.c.movement_id))
+    )).all()
+    return {tid: (mv_id, created_at, balance) for tid, mv_id, created_at, balance in rows}
+
+
+async def balances_at(session: AsyncSession, tool_ids: list[int], at: Optional[datetime] = None) -> dict[int, int]:
+    """
+    这些刀在 at（UTC naive，不含）之前的库存：最近检查点的余额 + 检查点之后、at 之前的流水；at 为 None 时算到最后一条流水。
+    每把刀的尾巴最多 balance_checkpoint_every 条，走 (tool_id, created_at, id) 索引范围扫描。
+    """
+    if not tool_ids:
+        return {}
+    checkpoints = await _latest_checkpoints(session, tool_ids, at)
+
+    ranges = []
+    for tid in tool_ids:
+        cond = [ToolMovement.tool_id == tid]
+        if at is not None:
+            cond.append(ToolMovement.created_at < at)
+        if tid in checkpoints:
+            mv_id, created_at, _ = checkpoints[tid]
+            cond += [ToolMovement.created_at >= created_at, ToolMovement.id > mv_id]
+        ranges.append(and_(*cond))
+    # 尾巴可能落在归档表里（很久没动过的刀 / 查很早的时间点）：两边一起按同样的范围求和，各自走索引
+    tail = movements_select((ToolMovement.tool_id, ToolMovement.delta), [or_(*ranges)]).subquery()
+    tails = dict((await session.exec(
+        select(tail.c.tool_id, func.sum(tail.c.delta)).group_by(tail.c.tool_id)
+    )).all())
+
+    return {
+        tid: (checkpoints[tid][2] if tid in checkpoints else 0) + (tails.get(tid) or 0)
+        for tid in tool_ids
+    }
+
+
+async def balance_at(session: AsyncSession, tool_id: int, at: datetime) -> int:
+    return (await balances_at(session, [tool_id], at))[tool_id]
+
+
+async def rebuild_checkpoints(session: AsyncSession) -> int:
+    """按流水（含归档）全量重算检查点（老库升级后跑一次）。返回写入的检查点数。"""
+    every = settings.balance_checkpoint_every
+    await session.exec(delete(ToolBalanceCheckpoint))
+    written = 0
+    last = (0, 0)
+    current, n, balance = None, 0, 0
+    while True:
+        batch = (await session.exec(
+            movements_select(
+                (ToolMovement.tool_id, ToolMovement.id, ToolMovement.created_at, ToolMovement.delta),
+                [tuple_(ToolMovement.tool_id, ToolMovement.id) > tuple_(*last)],
+                (ToolMovement.tool_id, ToolMovement.id),
+            ).limit(REBUILD_BATCH)
+        )).all()
+        if not batch:
+            break
+        rows = []
+        for tid, mv_id, created_at, delta in batch:
+            if tid != current:
+                current, n, balance = tid, 0, 0
+            n += 1
+            balance += delta
+            if n % every == 0:
+                rows.append({"tool_id": tid, "movement_id": mv_id, "created_at": created_at, "balance": balance})
+        if rows:
+            await session.exec(insert(ToolBalanceCheckpoint), params=rows)
+        written += len(rows)
+        last = (batch[-1][0], batch[-1][1])
+    await session.commit()
+    return written
@@ -0,0 +1,195 @@
+import threading
+import time
+from collections import OrderedDict
+from typing import Collection
+
+from sqlalchemy import String, bindparam, func, true, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.db import dialect_insert
+from app.models import RowCounter, Tool, ToolMovement, ToolMovementArchive
+
+TOOL_KEY = "tool"
+MOVEMENT_KEY = "movement"
+
+# 变更代数：对应的表每次写入 +1，ETag 用（见 app/services/http_cache.py）
+TOOL_GEN_KEY = "gen:tool"
+MOVEMENT_GEN_KEY = "gen:movement"
+USER_GEN_KEY = "gen:user"  # 鉴权缓存用（见 app/services/principal_cache.py）
+
+
+def movement_tool_key(tool_id: int) -> str:
+    return f"movement:tool:{tool_id}"
+
+
+def movement_count_stmt(tool_id: int | None = None):
+    # 流水计数器算的是全部流水：归档只是挪表，不改计数；补种子时两张表都要数
+    counts = []
+    for m in (ToolMovement, ToolMovementArchive):
+        stmt = select(func.count()).select_from(m)
+        if tool_id is not None:
+            stmt = stmt.where(m.tool_id == tool_id)
+        counts.append(stmt.scalar_subquery())
+    return select(counts[0] + counts[1])
+
+
+async def _seed(session: AsyncSession, count_stmt, params: list[dict]) -> None:
+    # 一条 INSERT ... SELECT count(*) 补种子：计数和插入在同一条语句里，中间不会漏掉并发写入的行。
+    # params 每组至少有 key；count_stmt 里的 bindparam 也从这里取，多组时一次 executemany 补一批 key
+    seed = select(bindparam("key", type_=String), count_stmt.scalar_subquery()).where(true())
+    stmt = dialect_insert(session, RowCounter.__table__).from_select(["key", "value"], seed).on_conflict_do_nothing()
+    await session.exec(stmt, params=params)
+
+
+async def bump_counters(
+    session: AsyncSession,
+    deltas: dict[str, int],
+    seeds: dict[str, dict] | None = None,
+    seed_stmt=None,
+) -> dict[str, int]:
+    """
+    在写事务里给计数器加减（和业务行同一事务提交，计数永远和表一致）。
+    计数行还不存在就跳过，第一次读的时候按真实 COUNT 补出来（见 read_counter）；
+    seeds 里给了 key -> seed_stmt（带 bindparam 的 COUNT 语句）的参数则当场补（调用方须已写入本次的行），
+    并返回这些 key 的新值；缺的 key 一起 executemany 补，批量写到一堆新刀具时不会一把刀一条语句。
+    """
+    params = [{"k": k, "n": n} for k, n in deltas.items() if n]
+    if params:
+        table = RowCounter.__table__
+        await session.exec(
+            table.update()
+            .where(table.c.key == bindparam("k"))
+            .values(value=table.c.value + bindparam("n")),
+            params=params,
+        )
+    if not seeds:
+        return {}
+
+    stmt = select(RowCounter.key, RowCounter.value).where(RowCounter.key.in_(seeds))
+    values = dict((await session.exec(stmt)).all())
+    missing = [k for k in seeds if k not in values]
+    if missing:
+        await _seed(session, seed_stmt, [{"key": k, **seeds[k]} for k in missing])
+        values.update((await session.exec(stmt.where(RowCounter.key.in_(missing)))).all())
+    return values
+
+
+async def bump_generations(session: AsyncSession, *keys: str) -> dict[str, int]:
+    """
+    变更代数 +1（和写入同一事务），返回新值。第一次写入时以当前毫秒时间戳起步，
+    这样删库重建后代数不会和旧库撞上，客户端手里的旧 ETag 不会被误判为“没变”。
+    +1 拿到的写锁（SQLite）/ 行锁（Postgres）要到提交才放，后提交的事务拿到的代数一定更大。
+    """
+    start = int(time.time() * 1000)
+    ins = dialect_insert(session, RowCounter).values([{"key": k, "value": start} for k in keys])
+    stmt = ins.on_conflict_do_update(index_elements=[RowCounter.key], set_={"value": RowCounter.value + 1})
+    return dict((await session.exec(stmt.returning(RowCounter.key, RowCounter.value))).all())
+
+
+async def tools_changed(session: AsyncSession, tool_ids: Collection[int], *keys: str) -> dict[str, int]:
+    """
+    改了刀具的写事务提交前调：tool（和 keys）的变更代数 +1，tool_ids 的 change_seq 记成 tool 的新代数。
+    /tools/lite 增量同步按 (change_seq, id) 翻，后提交的改动排在后面，不会因为提交晚于别人而被游标跳过。
+    """
+    gens = await bump_generations(session, TOOL_GEN_KEY, *keys)
+    if tool_ids:
+        await session.exec(
+            update(Tool)
+            .where(Tool.id.in_(tool_ids))
+            .values(change_seq=gens[TOOL_GEN_KEY])
+            .execution_options(synchronize_session=False)
+        )
+    return gens
+
+
+async def read_generation(session: AsyncSession, key: str) -> int:
+    return (await session.exec(select(RowCounter.value).where(RowCounter.key == key))).first() or 0
+
+
+async def read_values(session: AsyncSession, *keys: str) -> dict[str, int]:
+    """一条查询读多个计数器 / 代数；不存在的 key 不在结果里。"""
+    return dict((await session.exec(select(RowCounter.key, RowCounter.value).where(RowCounter.key.in_(keys)))).all())
+
+
+async def read_counter(session: AsyncSession, key: str, count_stmt) -> int:
+    value = (await session.exec(select(RowCounter.value).where(RowCounter.key == key))).first()
+    if value is not None:
+        return value
+    # 老库 / 新 key 第一次读：补种子
+    await _seed(session, count_stmt, [{"key": key}])
+    await session.commit()
+    return (await session.exec(select(RowCounter.value).where(RowCounter.key == key))).one()
+
+
+class CountCache:
+    """
+    带过滤条件的 COUNT 结果缓存（只在 estimate 模式用）：key = 编译后的 SQL + 参数。
+    TTL 到期前不感知写入，所以返回的是“几秒内的近似值”。
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl = ttl_seconds
+        self.max_size = max_size
+        self._data: OrderedDict[str, tuple[float, int]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> int | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None:
+                return None
+            if entry[0] <= now:
+                del self._data[key]
+                return None
+            self._data.move_to_end(key)
+            return entry[1]
+
+    def put(self, key: str, value: int) -> None:
+        with self._lock:
+            self._data[key] = (time.monotonic() + self.ttl, value)
+            self._data.move_to_end(key)
+            while len(self._data) > self.max_size:
+                self._data.popitem(last=False)
+
+    def clear(self) -> None:
+        with self._lock:
+            self._data.clear()
+
+
+count_cache = CountCache(settings.count_cache_ttl_seconds, settings.count_cache_max_size)
+
+
+def _cache_key(session: AsyncSession, count_stmt) -> str:
+    compiled = count_stmt.compile(dialect=session.bind.dialect)
+    return f"{compiled}|{sorted(compiled.params.items())!r}"
+
+
+async def resolve_total(
+    session: AsyncSession,
+    count_stmt,
+    counter_key: str | None,
+    include_total: bool,
+    estimate: bool,
+) -> tuple[int | None, bool]:
+    """
+    列表的 total，返回 (total, 是否估算值)：
+      - include_total=False：不算，给 None（无限滚动只要 next_cursor）
+      - 不过滤 / 只按 tool_id 过滤：读写入时维护的计数器，精确且 O(1)
+      - 其它过滤 + estimate：按过滤条件缓存几秒的 COUNT
+      - 其它过滤：照常 COUNT(*)
+    """
+    if not include_total:
+        return None, False
+    if counter_key is not None:
+        return await read_counter(session, counter_key, count_stmt), False
+    if estimate:
+        key = _cache_key(session, count_stmt)
+        total = count_cache.get(key)
+        if total is None:
+            total = (await session.exec(count_stmt)).one()
+            count_cache.put(key, total)
+        return total, True
+    return (await session.exec(count_stmt)).one(), False
@@ -0,0 +1,155 @@
+import asyncio
+import glob
+import hashlib
+import os
+import time
+import uuid
+from datetime import datetime
+from typing import Callable, Optional
+
+from sqlalchemy import func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.config import settings
+from app.models import Tool
+from app.services.counters import TOOL_GEN_KEY, TOOL_KEY, read_counter, read_generation
+from app.services.exports import FETCH_CHUNK, render_tools_xlsx
+from app.services.ledger import abort
+from app.services.search import search_condition
+
+
+class ExportJob:
+    def __init__(self, key: str, q: Optional[str], path: str):
+        self.id = uuid.uuid4().hex
+        self.key = key
+        self.q = q
+        self.path = path
+        self.status = "queued"  # queued / running / done / failed
+        self.rows = 0
+        self.total: Optional[int] = None
+        self.error: Optional[str] = None
+        self.created_at = datetime.utcnow()
+        self.finished_at: Optional[datetime] = None
+        self.task: Optional[asyncio.Task] = None
+
+    def on_rows(self, n: int) -> None:
+        self.rows += n
+
+
+class ExportJobs:
+    """
+    后台导出：POST 只登记任务，渲染由最多 workers 个并发的后台协程做，请求立刻返回。
+    结果文件名 = hash(查询, tool 表变更代数)：数据没变、查询一样就直接复用磁盘上的文件；
+    有写入代数就变了，新请求自然落到新文件上，旧文件过了 TTL 被清掉。
+    任务表在进程内存里；多进程部署时任务状态不共享，但磁盘缓存共享（同一个 cache_dir）。
+    """
+
+    def __init__(self, workers: int, max_pending: int, cache_dir: str, ttl_seconds: int):
+        self.workers = workers
+        self.max_pending = max_pending
+        self.cache_dir = cache_dir
+        self.ttl = ttl_seconds
+        self.jobs: dict[str, ExportJob] = {}
+        self.by_key: dict[str, ExportJob] = {}
+        self._sem: Optional[asyncio.Semaphore] = None
+
+    def _semaphore(self) -> asyncio.Semaphore:
+        if self._sem is None:
+            self._sem = asyncio.Semaphore(self.workers)
+        return self._sem
+
+    def _fresh(self, path: str) -> bool:
+        try:
+            return time.time() - os.path.getmtime(path) < self.ttl
+        except OSError:
+            return False
+
+    def pending(self) -> int:
+        return sum(1 for j in self.jobs.values() if j.status in ("queued", "running"))
+
+    def get(self, job_id: str) -> Optional[ExportJob]:
+        return self.jobs.get(job_id)
+
+    def sweep(self) -> None:
+        """清掉过期的任务记录和缓存文件（每次提交时顺手做）。"""
+        for job in list(self.jobs.values()):
+            if job.finished_at is not None and not self._fresh(job.path):
+                del self.jobs[job.id]
+                if self.by_key.get(job.key) is job:
+                    del self.by_key[job.key]
+        active = {j.id for j in self.jobs.values() if j.status in ("queued", "running")}
+        for path in glob.glob(os.path.join(self.cache_dir, "tools-*")):
+            if path.endswith(".part") and path.rsplit(".", 2)[-2] in active:
+                continue
+            if not self._fresh(path):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+
+    async def submit(
+        self,
+        session: AsyncSession,
+        session_factory: Callable[[], AsyncSession],
+        q: Optional[str],
+    ) -> tuple[ExportJob, bool]:
+        """返回 (任务, 是否复用了已有任务 / 缓存文件)。"""
+        self.sweep()
+        generation = await read_generation(session, TOOL_GEN_KEY)
+        key = hashlib.sha1(f"tools|{q or ''}|{generation}".encode("utf-8")).hexdigest()[:32]
+
+        job = self.by_key.get(key)
+        if job is not None and (job.status in ("queued", "running") or (job.status == "done" and self._fresh(job.path))):
+            return job, True
+
+        job = ExportJob(key, q, os.path.join(self.cache_dir, f"tools-{key}.xlsx"))
+        reused = self._fresh(job.path)
+        if reused:
+            # 重启前 / 别的进程渲染好的
+            job.status = "done"
+            job.finished_at = datetime.utcnow()
+        else:
+            if self.pending() >= self.max_pending:
+                abort(429, "EXPORT_BUSY", "导出任务排队已满，请稍后再试")
+            job.task = asyncio.create_task(self._run(job, session_factory))
+        self.jobs[job.id] = job
+        self.by_key[key] = job
+        return job, reused
+
+    async def _run(self, job: ExportJob, session_factory: Callable[[], AsyncSession]) -> None:
+        part = f"{job.path}.{job.id}.part"
+        async with self._semaphore():
+            job.status = "running"
+            try:
+                os.makedirs(self.cache_dir, exist_ok=True)
+                async with session_factory() as session:
+                    stmt = select(Tool.id, Tool.name, Tool.location, Tool.quantity, Tool.updated_at).order_by(Tool.id.asc())
+                    count_stmt = select(func.count()).select_from(Tool)
+                    if job.q:
+                        cond = await search_condition(session, job.q)
+                        stmt = stmt.where(cond)
+                        job.total = (await session.exec(count_stmt.where(cond))).one()
+                    else:
+                        job.total = await read_counter(session, TOOL_KEY, count_stmt)
+                    result = await session.stream(stmt.execution_options(yield_per=FETCH_CHUNK))
+                    with open(part, "wb") as f:
+                        await render_tools_xlsx(result, f, job.on_rows)
+                # 先写 .part 再原子改名：别的请求只会看到完整的文件
+                os.replace(part, job.path)
+                job.status = "done"
+            except Exception as e:
+                job.status = "failed"
+                job.error = str(e) or type(e).__name__
+                if os.path.exists(part):
+                    os.remove(part)
+            finally:
+                job.finished_at = datetime.utcnow()
+
+
+export_jobs = ExportJobs(
+    settings.export_workers,
+    settings.export_max_pending,
+    settings.export_cache_dir,
+    settings.export_cache_ttl_seconds,
+)
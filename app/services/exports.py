@@ -0,0 +1,253 @@
+import csv
+import io
+import json
+import tempfile
+from datetime import datetime
+from typing import IO, TYPE_CHECKING, AsyncIterator, Callable, Iterator
+
+import anyio
+
+if TYPE_CHECKING:
+    from openpyxl.cell import WriteOnlyCell
+
+# ✅ openpyxl 导入要近 0.1s，只有导出 xlsx 用得到：放到第一次建 writer 时再导入，不拖慢 worker 冷启动
+
+XLSX_MEDIA_TYPE = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+
+# 导出时每次从库里取多少行（服务端游标分批拉，内存不随总行数增长）
+FETCH_CHUNK = 1000
+STREAM_CHUNK = 64 * 1024
+
+MOVEMENT_HEADER_CN = ["流水号", "刀具ID", "动作", "变化量", "备注", "操作人", "时间(UTC)"]
+
+
+def norm_str(v, default: str) -> str:
+    if v is None:
+        return default
+    s = str(v).strip()
+    return s if s else default
+
+
+def norm_int(v, default: int = 0) -> int:
+    if v is None:
+        return default
+    try:
+        return int(v)
+    except Exception:
+        return default
+
+
+def norm_dt_obj(v):
+    if v is None:
+        return None
+    if isinstance(v, datetime):
+        return v.replace(tzinfo=None) if v.tzinfo else v
+    return None
+
+
+class _XlsxWriter:
+    """
+    write-only 模式的台账表：行直接写进临时 XML，不在内存里攒 Cell 对象。
+    列样式（数量 / 时间）提前注册成 NamedStyle，每行只引用名字。
+    """
+
+    sheet_title = ""
+    header_cn: list[str] = []
+    col_widths: dict[str, int] = {}
+
+    def __init__(self):
+        from openpyxl import Workbook
+        from openpyxl.cell import WriteOnlyCell
+        from openpyxl.styles import Font, Alignment, PatternFill, NamedStyle
+
+        self._cell = WriteOnlyCell
+        self.wb = Workbook(write_only=True)
+        self.ws = self.wb.create_sheet(self.sheet_title)
+        self.rows = 0
+
+        self.wb.add_named_style(NamedStyle(name="台账数量", number_format="0"))
+        self.wb.add_named_style(NamedStyle(name="台账时间", number_format="yyyy-mm-dd hh:mm:ss"))
+
+        # write-only 下列宽 / 冻结 / 行高必须在写第一行之前设置
+        for k, w in self.col_widths.items():
+            self.ws.column_dimensions[k].width = w
+        self.ws.freeze_panes = "A2"  # ✅ 冻结首行
+        self.ws.row_dimensions[1].height = 26  # 表头行高度
+
+        # 表头样式（依旧保留，Table 也会有样式，但这让首行更“台账”）
+        header_font = Font(bold=True)
+        header_fill = PatternFill("solid", fgColor="DDDDDD")
+        header_align = Alignment(horizontal="center", vertical="center")
+        header = []
+        for title in self.header_cn:
+            cell = WriteOnlyCell(self.ws, title)
+            cell.font = header_font
+            cell.fill = header_fill
+            cell.alignment = header_align
+            header.append(cell)
+        self.ws.append(header)
+
+    def append_many(self, rows) -> None:
+        for row in rows:
+            self.append(*row)
+
+    def _styled(self, value, style: str) -> "WriteOnlyCell":
+        cell = self._cell(self.ws, value)
+        cell.style = style
+        return cell
+
+    def save(self, fileobj: IO[bytes]) -> None:
+        # 末尾：导出时间
+        self.ws.append([])
+        self.ws.append(["导出时间", datetime.now().strftime("%Y-%m-%d %H:%M:%S")])
+        self.wb.save(fileobj)
+
+
+class ToolsXlsxWriter(_XlsxWriter):
+    sheet_title = "刀具台账"
+    header_cn = ["编号", "名称", "库位", "数量", "品牌", "型号", "备注", "更新时间"]
+
+    # ✅ 列宽（稳定台账风格）
+    col_widths = {
+        "A": 8,   # 编号
+        "B": 22,  # 名称
+        "C": 12,  # 库位
+        "D": 8,   # 数量
+        "E": 12,  # 品牌
+        "F": 16,  # 型号
+        "G": 28,  # 备注
+        "H": 20,  # 更新时间
+    }
+
+    def append(self, tool_id, name, location, quantity, updated_at) -> None:
+        self.ws.append([
+            norm_int(tool_id, 0),
+            norm_str(name, "未命名"),
+            norm_str(location, "未知"),
+            self._styled(norm_int(quantity, 0), "台账数量"),
+            "",  # 品牌
+            "",  # 型号
+            "",  # 备注
+            self._styled(norm_dt_obj(updated_at), "台账时间"),
+        ])
+        self.rows += 1
+
+    def save(self, fileobj: IO[bytes]) -> None:
+        from openpyxl.worksheet.filters import AutoFilter
+        from openpyxl.worksheet.table import Table, TableColumn, TableStyleInfo
+
+        # ✅ 加 Table 样式（只覆盖表头+数据）；没有数据也至少给到表头行，避免范围非法
+        last_row = 1 + self.rows
+        ref = f"A1:H{last_row}"
+        table = Table(displayName=f"ToolsLedger_{datetime.now().strftime('%H%M%S')}", ref=ref)
+        # write-only 模式读不回表头单元格，列名要手动声明
+        table.tableColumns = [TableColumn(id=i, name=name) for i, name in enumerate(self.header_cn, 1)]
+        table.autoFilter = AutoFilter(ref=ref)
+        table.tableStyleInfo = TableStyleInfo(
+            name="TableStyleMedium9",   # 你也可以换成 Medium2/Medium10 等
+            showFirstColumn=False,
+            showLastColumn=False,
+            showRowStripes=True,        # ✅ 条纹行
+            showColumnStripes=False,
+        )
+        self.ws.add_table(table)
+        super().save(fileobj)
+
+
+class MovementsXlsxWriter(_XlsxWriter):
+    sheet_title = "刀具流水"
+    header_cn = MOVEMENT_HEADER_CN
+    col_widths = {
+        "A": 10,  # 流水号
+        "B": 8,   # 刀具ID
+        "C": 10,  # 动作
+        "D": 8,   # 变化量
+        "E": 32,  # 备注
+        "F": 12,  # 操作人
+        "G": 20,  # 时间
+    }
+
+    def append(self, mv_id, tool_id, action, delta, note, operator, created_at) -> None:
+        self.ws.append([
+            mv_id,
+            tool_id,
+            action,
+            self._styled(delta, "台账数量"),
+            note or "",
+            operator,
+            self._styled(norm_dt_obj(created_at), "台账时间"),
+        ])
+        self.rows += 1
+
+
+async def _render(
+    writer: _XlsxWriter,
+    result,
+    fileobj: IO[bytes] | None = None,
+    on_rows: Callable[[int], None] | None = None,
+) -> IO[bytes]:
+    # result: AsyncResult（session.stream + yield_per）；每批行的写入和最后的压缩都丢到线程里，不卡事件循环
+    async for partition in result.partitions():
+        await anyio.to_thread.run_sync(writer.append_many, partition)
+        if on_rows is not None:
+            on_rows(len(partition))
+    f = fileobj if fileobj is not None else tempfile.TemporaryFile()
+    await anyio.to_thread.run_sync(writer.save, f)
+    f.seek(0)
+    return f
+
+
+async def render_tools_xlsx(
+    result,
+    fileobj: IO[bytes] | None = None,
+    on_rows: Callable[[int], None] | None = None,
+) -> IO[bytes]:
+    """result 的行：(id, name, location, quantity, updated_at)。默认写到磁盘临时文件；on_rows 每写完一批回调行数。"""
+    return await _render(ToolsXlsxWriter(), result, fileobj, on_rows)
+
+
+async def render_movements_xlsx(result) -> IO[bytes]:
+    """result 的行：(id, tool_id, action, delta, note, operator, created_at)。"""
+    return await _render(MovementsXlsxWriter(), result)
+
+
+async def iter_movements_csv(result) -> AsyncIterator[bytes]:
+    # 带 BOM，Excel 直接双击打开中文不乱码；服务端游标每吐一批就编码一批
+    buf = io.StringIO()
+    w = csv.writer(buf)
+    buf.write("\ufeff")
+    w.writerow(MOVEMENT_HEADER_CN)
+    async for partition in result.partitions():
+        for mv_id, tool_id, action, delta, note, operator, created_at in partition:
+            w.writerow([mv_id, tool_id, action, delta, note or "", operator, created_at.isoformat(sep=" ")])
+        yield buf.getvalue().encode("utf-8")
+        buf.seek(0)
+        buf.truncate()
+    if buf.tell():
+        yield buf.getvalue().encode("utf-8")
+
+
+async def iter_movements_ndjson(result) -> AsyncIterator[bytes]:
+    # 字段名和 MovementRead 保持一致，一行一个 JSON
+    async for partition in result.partitions():
+        lines = [
+            json.dumps({
+                "id": mv_id,
+                "tool_id": tool_id,
+                "action": action,
+                "delta": delta,
+                "note": note,
+                "operator": operator,
+                "created_at": created_at.isoformat(),
+            }, ensure_ascii=False)
+            for mv_id, tool_id, action, delta, note, operator, created_at in partition
+        ]
+        yield ("\n".join(lines) + "\n").encode("utf-8")
+
+
+def iter_file(f: IO[bytes]) -> Iterator[bytes]:
+    try:
+        while chunk := f.read(STREAM_CHUNK):
+            yield chunk
+    finally:
+        f.close()
@@ -0,0 +1,155 @@
+import gzip
+import zlib
+from typing import Iterable, Iterator, Sequence
+
+import anyio
+import orjson
+from fastapi import Request, Response
+from fastapi.responses import StreamingResponse
+
+try:  # br 可选：装了 brotli 才协商
+    import brotli
+except ImportError:  # pragma: no cover
+    brotli = None
+
+# 小于这个大小不压缩（压缩头 + CPU 不划算）
+COMPRESS_MIN_BYTES = 1024
+# 超过这个大小丢到线程里压缩，不卡事件循环
+COMPRESS_IN_THREAD_BYTES = 256 * 1024
+GZIP_LEVEL = 5
+BROTLI_QUALITY = 4
+# 流式编码时每块多少行
+STREAM_ROWS = 1000
+MSGPACK_MEDIA_TYPE = "application/x-msgpack"
+
+
+def dumps(payload) -> bytes:
+    # orjson：datetime 输出和 FastAPI 默认一致（naive -> 2026-01-12T08:30:00.123456），中文不转义
+    return orjson.dumps(payload)
+
+
+def _accepted(accept_encoding: str) -> set[str]:
+    encodings = set()
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = params.strip()
+        if q.startswith("q="):
+            try:
+                if float(q[2:]) <= 0:
+                    continue
+            except ValueError:
+                continue
+        if name:
+            encodings.add(name.strip())
+    return encodings
+
+
+def pick_encoding(accept_encoding: str | None) -> str | None:
+    accepted = _accepted(accept_encoding or "")
+    if brotli is not None and "br" in accepted:
+        return "br"
+    if "gzip" in accepted or "*" in accepted:
+        return "gzip"
+    return None
+
+
+def _compress(body: bytes, encoding: str) -> bytes:
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+async def compressed_response(
+    request: Request,
+    body: bytes,
+    media_type: str,
+    headers: dict[str, str] | None = None,
+) -> Response:
+    """大 body 按 Accept-Encoding 协商 br / gzip；小 body 原样返回。"""
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    encoding = pick_encoding(request.headers.get("accept-encoding")) if len(body) >= COMPRESS_MIN_BYTES else None
+    if encoding:
+        if len(body) >= COMPRESS_IN_THREAD_BYTES:
+            body = await anyio.to_thread.run_sync(_compress, body, encoding)
+        else:
+            body = _compress(body, encoding)
+        headers["Content-Encoding"] = encoding
+    return Response(content=body, media_type=media_type, headers=headers)
+
+
+async def json_response(request: Request, payload, headers: dict[str, str] | None = None) -> Response:
+    """
+    列表接口的快路径：payload 已经是按 response_model 字段拼好的 dict/list（从行元组直接构造），
+    不再走 Pydantic 校验 + jsonable_encoder，直接 orjson 编码。
+    """
+    return await compressed_response(request, dumps(payload), "application/json", headers)
+
+
+def _compress_stream(chunks: Iterable[bytes], encoding: str) -> Iterator[bytes]:
+    # 流式压缩：边编码边压，不先拼出完整 body
+    if encoding == "br":
+        c = brotli.Compressor(quality=BROTLI_QUALITY)
+        for chunk in chunks:
+            out = c.process(chunk)
+            if out:
+                yield out
+        yield c.finish()
+        return
+    c = zlib.compressobj(GZIP_LEVEL, zlib.DEFLATED, 31)  # wbits=31 -> gzip 头
+    for chunk in chunks:
+        out = c.compress(chunk)
+        if out:
+            yield out
+    yield c.flush()
+
+
+def streamed_response(
+    request: Request,
+    chunks: Iterable[bytes],
+    media_type: str,
+    headers: dict[str, str] | None = None,
+) -> StreamingResponse:
+    headers = dict(headers or {})
+    headers["Vary"] = "Accept-Encoding"
+    encoding = pick_encoding(request.headers.get("accept-encoding"))
+    if encoding:
+        chunks = _compress_stream(chunks, encoding)
+        headers["Content-Encoding"] = encoding
+    return StreamingResponse(chunks, media_type=media_type, headers=headers)
+
+
+def iter_json_objects(fields: Sequence[str], rows: Sequence[Sequence]) -> Iterator[bytes]:
+    """[{"id": 1, ...}, ...]，每 STREAM_ROWS 行编码一块。"""
+    yield b"["
+    for i in range(0, len(rows), STREAM_ROWS):
+        part = b",".join(orjson.dumps(dict(zip(fields, row))) for row in rows[i:i + STREAM_ROWS])
+        yield (b"," + part) if i else part
+    yield b"]"
+
+
+def iter_json_arrays(rows: Sequence[Sequence]) -> Iterator[bytes]:
+    """[[1, "名称", "库位", 3], ...]：不重复字段名，体积小一半左右。"""
+    yield b"["
+    for i in range(0, len(rows), STREAM_ROWS):
+        part = orjson.dumps([tuple(row) for row in rows[i:i + STREAM_ROWS]])[1:-1]
+        yield (b"," + part) if i else part
+    yield b"]"
+
+
+def msgpack_available() -> bool:
+    try:
+        import msgpack  # noqa: F401
+    except ImportError:
+        return False
+    return True
+
+
+def iter_msgpack_arrays(rows: Sequence[Sequence]) -> Iterator[bytes]:
+    """MessagePack：外层数组头 + 每行一个数组（和 compact 同构）。"""
+    import msgpack
+
+    packer = msgpack.Packer()
+    yield packer.pack_array_header(len(rows))
+    for i in range(0, len(rows), STREAM_ROWS):
+        yield b"".join(packer.pack(list(row)) for row in rows[i:i + STREAM_ROWS])
@@ -0,0 +1,66 @@
+import hashlib
+from datetime import datetime, timezone
+from email.utils import format_datetime, parsedate_to_datetime
+
+from fastapi import Request, Response
+
+# 轮询的看板每次都会带上 If-None-Match 回来问，所以让它每次都回源校验，而不是靠本地过期时间
+CACHE_CONTROL = "private, no-cache"
+
+
+def list_etag(request: Request, generation: int) -> str:
+    """
+    列表类接口的 ETag：表的变更代数 + 路径 + 查询参数（参数顺序无关）。
+    代数没变，同样的查询返回的内容一定一样。
+    """
+    query = "&".join(sorted(f"{k}={v}" for k, v in request.query_params.multi_items()))
+    digest = hashlib.sha1(f"{generation}|{request.url.path}|{query}".encode("utf-8")).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def row_etag(kind: str, row_id: int, updated_at: datetime) -> str:
+    return f'"{kind}-{row_id}-{int(updated_at.replace(tzinfo=timezone.utc).timestamp() * 1_000_000)}"'
+
+
+def http_date(dt: datetime) -> str:
+    # DB 里是 UTC naive
+    return format_datetime(dt.replace(tzinfo=timezone.utc, microsecond=0), usegmt=True)
+
+
+def _etag_in(header: str, etag: str) -> bool:
+    # If-None-Match 用弱比较：W/"x" 和 "x" 视为同一个
+    if header.strip() == "*":
+        return True
+    bare = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == bare for tag in header.split(","))
+
+
+def is_not_modified(request: Request, etag: str, last_modified: datetime | None = None) -> bool:
+    inm = request.headers.get("if-none-match")
+    if inm is not None:
+        return _etag_in(inm, etag)  # 带了 If-None-Match 就不再看 If-Modified-Since（RFC 9110）
+    ims = request.headers.get("if-modified-since")
+    if ims and last_modified is not None:
+        try:
+            since = parsedate_to_datetime(ims)
+        except (TypeError, ValueError):
+            return False
+        if since.tzinfo is None:
+            since = since.replace(tzinfo=timezone.utc)
+        return last_modified.replace(tzinfo=timezone.utc, microsecond=0) <= since
+    return False
+
+
+def cache_headers(etag: str, last_modified: datetime | None = None) -> dict[str, str]:
+    headers = {"ETag": etag, "Cache-Control": CACHE_CONTROL}
+    if last_modified is not None:
+        headers["Last-Modified"] = http_date(last_modified)
+    return headers
+
+
+def not_modified(etag: str, last_modified: datetime | None = None) -> Response:
+    return Response(status_code=304, headers=cache_headers(etag, last_modified))
+
+
+def set_cache_headers(response: Response, etag: str, last_modified: datetime | None = None) -> None:
+    response.headers.update(cache_headers(etag, last_modified))
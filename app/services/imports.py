@@ -0,0 +1,176 @@
+import csv
+import io
+from datetime import datetime
+from typing import IO, Iterable, Iterator
+
+from sqlalchemy import insert
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import dialect_insert, retry_on_busy
+from app.models import RowCounter, Tool, ToolMovement, ToolSearchGram
+from app.schemas import MovementAction
+from app.services.counters import TOOL_GEN_KEY, TOOL_KEY, bump_counters, bump_generations, movement_tool_key
+from app.services.ledger import movements_written
+from app.services.search import tool_grams
+
+# 一次 executemany 写多少把刀（连同它们的 n-gram / 入库流水）
+IMPORT_BATCH = 5000
+IMPORT_MAX_ROWS = 100_000
+# 报告里最多列多少条错误，避免一张烂表把响应撑爆
+IMPORT_MAX_ERRORS = 200
+
+# 表头 -> 字段；中文表头和 /tools/export.xlsx 一致（编号 / 品牌 / 更新时间等列导入时忽略，id 重新分配）
+IMPORT_HEADERS = {
+    "名称": "name",
+    "name": "name",
+    "库位": "location",
+    "location": "location",
+    "数量": "quantity",
+    "quantity": "quantity",
+}
+
+
+class ImportReport:
+    def __init__(self):
+        self.rows: list[dict] = []
+        self.errors: list[dict] = []
+        self.invalid = 0
+
+    def error(self, row: int, code: str, message: str) -> None:
+        self.invalid += 1
+        if len(self.errors) < IMPORT_MAX_ERRORS:
+            self.errors.append({"row": row, "code": code, "message": message})
+
+
+def _header_index(header: Iterable) -> dict[str, int]:
+    index = {}
+    for i, title in enumerate(header):
+        field = IMPORT_HEADERS.get(str(title).strip().lower() if title is not None else "")
+        if field and field not in index:
+            index[field] = i
+    return index
+
+
+def _quantity(v) -> int | None:
+    # Excel 里的数字常是 3.0；字符串 "3" 也收
+    if v is None or (isinstance(v, str) and not v.strip()):
+        return 0
+    if isinstance(v, bool):
+        return None
+    if isinstance(v, float):
+        return int(v) if v.is_integer() else None
+    try:
+        return int(str(v).strip())
+    except ValueError:
+        return None
+
+
+def validate_rows(rows: Iterator[tuple]) -> ImportReport:
+    """
+    第一行是表头，逐行校验（口径和 ToolCreate 一致），行号按表格里的行号（表头是第 1 行）。
+    遇到整行空白就停：导出的表格末尾是“空行 + 导出时间”。
+    """
+    report = ImportReport()
+    header = next(rows, None)
+    index = _header_index(header or ())
+    if "name" not in index:
+        report.error(1, "MISSING_COLUMN", "找不到“名称”列（表头须和导出的台账一致）")
+        return report
+
+    def cell(row, field):
+        i = index.get(field)
+        return row[i] if i is not None and i < len(row) else None
+
+    for n, row in enumerate(rows, start=2):
+        if all(v is None or (isinstance(v, str) and not v.strip()) for v in row):
+            break
+        if n - 1 > IMPORT_MAX_ROWS:
+            report.error(n, "TOO_MANY_ROWS", f"一次最多导入 {IMPORT_MAX_ROWS} 行")
+            break
+        name = cell(row, "name")
+        name = str(name).strip() if name is not None else ""
+        if not name:
+            report.error(n, "INVALID_NAME", "名称不能为空")
+            continue
+        qty = _quantity(cell(row, "quantity"))
+        if qty is None or qty < 0:
+            report.error(n, "INVALID_QUANTITY", f"数量必须是 >= 0 的整数：{cell(row, 'quantity')!r}")
+            continue
+        location = cell(row, "location")
+        location = str(location).strip() if location is not None else ""
+        report.rows.append({"name": name, "location": location or "unknown", "quantity": qty})
+    return report
+
+
+def read_xlsx_rows(fileobj: IO[bytes]) -> ImportReport:
+    from openpyxl import load_workbook  # 只有导入 xlsx 用得到，不放模块顶上拖慢冷启动
+
+    # read_only：按行流式解析 sheet XML，不在内存里建整张表的 Cell 对象
+    wb = load_workbook(fileobj, read_only=True, data_only=True)
+    try:
+        return validate_rows(wb.worksheets[0].iter_rows(values_only=True))
+    finally:
+        wb.close()
+
+
+def read_csv_rows(fileobj: IO[bytes]) -> ImportReport:
+    # utf-8-sig：兼容 Excel 另存的带 BOM 的 CSV
+    text = io.TextIOWrapper(fileobj, encoding="utf-8-sig", newline="")
+    try:
+        return validate_rows(tuple(r) for r in csv.reader(text))
+    finally:
+        text.detach()
+
+
+@retry_on_busy
+async def import_tools(session: AsyncSession, rows: list[dict], operator: str) -> int:
+    """
+    批量建刀：每 IMPORT_BATCH 行一条 INSERT（executemany）写 Tool，再一条写 n-gram、一条写期初 IN 流水，
+    派生数据走 movements_written，和逐个 POST /tools 的结果一致；整个导入一个事务，要么全进要么全不进。
+    插入用 Core 的 Table（不走 ORM 批量插入逐行整理参数那一层）。
+    """
+    now = datetime.utcnow()
+    # 新刀的 change_seq 直接写进 INSERT：先把 tool 代数 +1 拿到本事务的序号（有期初库存的刀写流水时还会再记一次）
+    seq = (await bump_generations(session, TOOL_GEN_KEY))[TOOL_GEN_KEY]
+    for i in range(0, len(rows), IMPORT_BATCH):
+        chunk = rows[i:i + IMPORT_BATCH]
+        # RETURNING 不要求按参数顺序（SQLite 要按顺序就只能一行一条 INSERT），
+        # 派生数据只依赖返回行自己的 name / location / quantity，不需要和输入行对上号
+        t = Tool.__table__.c
+        created = (await session.exec(
+            insert(Tool.__table__).returning(t.id, t.name, t.location, t.quantity),
+            params=[{**r, "updated_at": now, "change_seq": seq} for r in chunk],
+        )).all()
+
+        grams = [
+            {"gram": g, "tool_id": tid}
+            for tid, name, location, _ in created
+            for g in tool_grams(name, location)
+        ]
+        if grams:
+            await session.exec(insert(ToolSearchGram.__table__), params=grams)
+
+        movements = [
+            {
+                "tool_id": tid,
+                "action": MovementAction.IN.value,
+                "delta": qty,
+                "note": "导入入库",
+                "operator": operator,
+                "created_at": now,
+            }
+            for tid, _, _, qty in created
+            if qty > 0
+        ]
+        if movements:
+            await session.exec(insert(ToolMovement.__table__), params=movements)
+            # 新刀的流水数从 0 起：先把计数行放好，movements_written 就不用逐把刀 COUNT 补种子
+            await session.exec(
+                dialect_insert(session, RowCounter.__table__).on_conflict_do_nothing(),
+                params=[{"key": movement_tool_key(m["tool_id"]), "value": 0} for m in movements],
+            )
+            await movements_written(session, movements)
+
+        await bump_counters(session, {TOOL_KEY: len(chunk)})
+    await session.commit()
+    return len(rows)
@@ -1,14 +1,34 @@
+from collections import Counter
+from datetime import datetime
 from fastapi import HTTPException
-from app.schemas import MovementAction
+from sqlalchemy import bindparam, insert, update
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from app.db import retry_on_busy
+from app.models import Tool, ToolMovement
+from app.schemas import MovementAction, MovementCreate
+from app.config import settings
+from app.services.balances import checkpoints_due, write_checkpoints
+from app.services.rollup import apply_rollup
+from app.services.counters import (
+    MOVEMENT_GEN_KEY,
+    MOVEMENT_KEY,
+    bump_counters,
+    movement_count_stmt,
+    movement_tool_key,
+    tools_changed,
+)
 
 
 def abort(status_code: int, code: str, message: str) -> None:
     raise HTTPException(status_code=status_code, detail={"code": code, "message": message})
 
 
-def calc_signed_delta_and_new_qty(
-    action: MovementAction, delta: int, old_qty: int
-) -> tuple[int, int]:
+# ADJUST 基于“读到的旧库存”做条件更新（CAS）时，被并发写抢先后最多重试几次
+CAS_RETRIES = 5
+
+
+def check_delta(action: MovementAction, delta: int) -> None:
     # 统一口径：IN/OUT delta>0，ADJUST delta>=0(目标库存)
     if action in (MovementAction.IN, MovementAction.OUT) and delta <= 0:
         abort(400, "INVALID_DELTA", "IN/OUT 的 delta 必须 > 0")
@@ -16,6 +36,12 @@ def calc_signed_delta_and_new_qty(
     if action == MovementAction.ADJUST and delta < 0:
         abort(400, "INVALID_DELTA", "ADJUST 的 delta 必须 >= 0（目标库存）")
 
+
+def calc_signed_delta_and_new_qty(
+    action: MovementAction, delta: int, old_qty: int
+) -> tuple[int, int]:
+    check_delta(action, delta)
+
     if action == MovementAction.IN:
         signed_delta = delta
         new_qty = old_qty + delta
@@ -52,3 +78,189 @@ def build_note(
         return f"出库 {input_delta}（{old_qty}->{new_qty}）"
     # ADJUST：input_delta 是目标库存
     return f"盘点调整为 {input_delta}（{old_qty}->{new_qty}）"
+
+
+async def apply_quantity_change(
+    session: AsyncSession,
+    tool_id: int,
+    action: MovementAction,
+    delta: int,
+) -> tuple[int, int, int]:
+    """
+    并发安全地改库存，返回 (signed_delta, old_qty, new_qty)，不提交。
+      - IN/OUT：一条 UPDATE ... SET quantity = quantity + :d WHERE quantity + :d >= 0 RETURNING，
+        加减和库存校验都在库里原子完成，两个并发 OUT 不可能都扣成功
+      - ADJUST：目标值依赖旧库存（要记 signed_delta），用 WHERE quantity = :old 做 CAS，被抢先就重读重试
+    """
+    check_delta(action, delta)
+    now = datetime.utcnow()
+
+    if action != MovementAction.ADJUST:
+        signed_delta = delta if action == MovementAction.IN else -delta
+        row = (await session.exec(
+            update(Tool)
+            .where(Tool.id == tool_id, Tool.quantity + signed_delta >= 0)
+            .values(quantity=Tool.quantity + signed_delta, updated_at=now)
+            .returning(Tool.quantity)
+        )).first()
+        if row is None:
+            current = (await session.exec(select(Tool.quantity).where(Tool.id == tool_id))).first()
+            if current is None:
+                abort(404, "NOT_FOUND", "Tool not found")
+            abort(400, "INSUFFICIENT_STOCK", f"库存不足：当前 {current}，要出库 {delta}")
+        new_qty = row[0]
+        return signed_delta, new_qty - signed_delta, new_qty
+
+    for _ in range(CAS_RETRIES):
+        old_qty = (await session.exec(select(Tool.quantity).where(Tool.id == tool_id))).first()
+        if old_qty is None:
+            abort(404, "NOT_FOUND", "Tool not found")
+        signed_delta, new_qty = calc_signed_delta_and_new_qty(action, delta, old_qty)
+        res = await session.exec(
+            update(Tool)
+            .where(Tool.id == tool_id, Tool.quantity == old_qty)
+            .values(quantity=new_qty, updated_at=now)
+        )
+        if res.rowcount == 1:
+            return signed_delta, old_qty, new_qty
+    abort(409, "CONCURRENT_UPDATE", "库存正在被频繁修改，请稍后重试")
+
+
+async def movements_written(session: AsyncSession, rows: list[dict]) -> None:
+    """
+    所有写流水的地方（新建入库 / 单条 / 批量）在流水和库存都写完、提交前调一次，同一事务里维护派生数据：
+      - 行数计数器（总流水数、每把刀的流水数）
+      - 每把刀每 balance_checkpoint_every 条流水一个库存检查点
+      - 按小时的汇总表（/movements/summary 用）
+      - tool / movement 两张表的变更代数（ETag 用；写流水必然改了库存），改到的刀具记下 change_seq（增量同步用）
+    rows 里每条至少有 tool_id / action / operator / delta / created_at。
+    """
+    per_tool = Counter(r["tool_id"] for r in rows)
+    deltas = {MOVEMENT_KEY: len(rows)}
+    deltas.update({movement_tool_key(tid): n for tid, n in per_tool.items()})
+    # 每把刀的条数要当场知道（决定要不要记检查点），缺计数行就地补
+    seeds = {movement_tool_key(tid): {"tool_id": tid} for tid in per_tool}
+    values = await bump_counters(session, deltas, seeds, movement_count_stmt(bindparam("tool_id")))
+
+    counts = {tid: values[movement_tool_key(tid)] for tid in per_tool}
+    due = checkpoints_due(settings.balance_checkpoint_every, counts, per_tool)
+    if due:
+        await write_checkpoints(session, due)
+
+    await apply_rollup(session, rows)
+    await tools_changed(session, per_tool, MOVEMENT_GEN_KEY)
+
+
+@retry_on_busy
+async def record_quantity_change(
+    session: AsyncSession,
+    tool_id: int,
+    action: MovementAction,
+    delta: int,
+    note: str | None,
+    operator: str,
+) -> ToolMovement:
+    """改库存 + 写流水，同一事务提交。"""
+    signed_delta, old_qty, new_qty = await apply_quantity_change(session, tool_id, action, delta)
+    mv = ToolMovement(
+        tool_id=tool_id,
+        action=action.value,  # Enum -> str
+        delta=signed_delta,  # ✅ 永远存“真实变化量”
+        note=build_note(action, delta, old_qty, new_qty, note),
+        operator=operator,
+    )
+    session.add(mv)
+    await movements_written(session, [{
+        "tool_id": tool_id,
+        "action": mv.action,
+        "operator": operator,
+        "delta": signed_delta,
+        "created_at": mv.created_at,
+    }])
+    await session.commit()
+    return mv
+
+
+def _plan_batch(
+    items: list[MovementCreate],
+    qty: dict[int, int],
+    operator: str,
+    atomic: bool,
+    now: datetime,
+) -> tuple[list[dict], list[dict]]:
+    results: list[dict] = []
+    rows: list[dict] = []
+    for i, it in enumerate(items):
+        try:
+            if it.tool_id not in qty:
+                abort(404, "NOT_FOUND", "Tool not found")
+            old_qty = qty[it.tool_id]
+            signed_delta, new_qty = calc_signed_delta_and_new_qty(it.action, it.delta, old_qty)
+        except HTTPException as e:
+            if atomic:
+                abort(e.status_code, e.detail["code"], f"items[{i}]：{e.detail['message']}")
+            results.append({"index": i, "ok": False, **e.detail})
+            continue
+
+        qty[it.tool_id] = new_qty  # ✅ 后面的条目基于前面算完的库存继续算
+        rows.append({
+            "tool_id": it.tool_id,
+            "action": it.action.value,
+            "delta": signed_delta,
+            "note": build_note(it.action, it.delta, old_qty, new_qty, it.note),
+            "operator": operator,
+            "created_at": now,
+        })
+        results.append({"index": i, "ok": True})
+    return results, rows
+
+
+@retry_on_busy
+async def apply_movement_batch(
+    session: AsyncSession,
+    items: list[MovementCreate],
+    operator: str,
+    atomic: bool,
+) -> list[dict]:
+    """
+    批量入账：一次查出涉及的全部刀具，按提交顺序逐条算库存，
+    再一条 UPDATE（executemany）写库存、一条 INSERT（executemany，多行 VALUES）写流水，同一个事务提交。
+    读快照之前先对这些刀具做一次空 UPDATE 拿写锁（SQLite 库级 / Postgres 行级），
+    整批计算期间没人能改这些库存，快照就是提交时的真实值，不会丢更新。
+    返回每条的结果（index/ok/id 或 code/message）。
+    """
+    tool_ids = {it.tool_id for it in items}
+    await session.exec(
+        update(Tool)
+        .where(Tool.id.in_(tool_ids))
+        .values(quantity=Tool.quantity)
+        .execution_options(synchronize_session=False)
+    )
+    qty = dict((await session.exec(select(Tool.id, Tool.quantity).where(Tool.id.in_(tool_ids)))).all())
+
+    now = datetime.utcnow()
+    try:
+        results, rows = _plan_batch(items, qty, operator, atomic, now)
+    except HTTPException:
+        await session.rollback()  # 尽快放掉写锁
+        raise
+    if not rows:
+        await session.rollback()
+        return results
+
+    touched = {r["tool_id"] for r in rows}
+    await session.exec(
+        update(Tool),
+        params=[{"id": tid, "quantity": qty[tid], "updated_at": now} for tid in touched],
+    )
+    # ✅ 不靠 id 的大小猜顺序：batch_seq 哨兵列带着每行的序号进库再由 RETURNING 带回，
+    #    SQLAlchemy 按它把结果排回参数顺序，依旧是多行 VALUES 批量插入（没有哨兵列时 SQLite 只能一行一条）
+    mv = ToolMovement.__table__
+    ids = (await session.exec(insert(mv).returning(mv.c.id, sort_by_parameter_order=True), params=rows)).scalars().all()
+    ok_results = (r for r in results if r["ok"])
+    for r, mv_id in zip(ok_results, ids):
+        r["id"] = mv_id
+    await movements_written(session, rows)
+
+    await session.commit()
+    return results
@@ -0,0 +1,264 @@
+import threading
+import time
+from contextvars import ContextVar
+from typing import Callable, Optional
+
+from sqlalchemy import event
+
+# Prometheus 默认的延迟桶（秒）
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+# 每个请求的查询条数桶：N+1 一眼就能从分布里看出来
+QUERY_COUNT_BUCKETS = (1, 2, 3, 5, 10, 20, 50, 100)
+
+# 没匹配上路由的请求统一记成一个 route，避免随便扫个 URL 就撑爆标签基数
+UNMATCHED_ROUTE = "unmatched"
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+INF_LABEL = 'le="+Inf"'
+
+
+def _escape(v: str) -> str:
+    return str(v).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{n}="{_escape(v)}"' for n, v in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _num(v: float) -> str:
+    return str(int(v)) if float(v).is_integer() else repr(float(v))
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.label_names = labels
+        self._lock = threading.Lock()
+
+    def header(self) -> list[str]:
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    """值用 inc 累加；不带标签的也可以给一个 fn，渲染时现取别处自己数的累计值（如鉴权缓存命中数）。"""
+
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help, labels)
+        self._values: dict[tuple, float] = {}
+        self.fn = fn
+
+    def inc(self, *labels, amount: float = 1) -> None:
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> list[str]:
+        if self.fn is not None:
+            return self.header() + [f"{self.name} {_num(self.fn())}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return self.header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    """值可以直接 inc/dec，也可以给一个 fn，渲染时现取（如连接池当前借出数）。"""
+
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, fn: Optional[Callable[[], float]] = None):
+        super().__init__(name, help)
+        self.value = 0.0
+        self.fn = fn
+
+    def inc(self, amount: float = 1) -> None:
+        with self._lock:
+            self.value += amount
+
+    def dec(self, amount: float = 1) -> None:
+        self.inc(-amount)
+
+    def render(self) -> list[str]:
+        value = self.fn() if self.fn is not None else self.value
+        return self.header() + [f"{self.name} {_num(value)}"]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple = LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # labels -> [每个桶的计数..., +Inf 计数, sum]
+        self._values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, *labels) -> None:
+        with self._lock:
+            v = self._values.get(labels)
+            if v is None:
+                v = self._values[labels] = [0] * (len(self.buckets) + 1) + [0.0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    v[i] += 1
+            v[-2] += 1
+            v[-1] += value
+
+    def render(self) -> list[str]:
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self.header()
+        for k, v in items:
+            for bound, n in zip(self.buckets, v):
+                le = 'le="%s"' % _num(bound)
+                lines.append(f"{self.name}_bucket{_labels(self.label_names, k, le)} {n}")
+            lines.append(f"{self.name}_bucket{_labels(self.label_names, k, INF_LABEL)} {v[-2]}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, k)} {_num(v[-1])}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, k)} {v[-2]}")
+        return lines
+
+
+class Registry:
+    def __init__(self):
+        self.metrics: list[_Metric] = []
+
+    def add(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    def render(self) -> bytes:
+        lines = []
+        for m in self.metrics:
+            lines.extend(m.render())
+        return ("\n".join(lines) + "\n").encode("utf-8")
+
+
+registry = Registry()
+
+http_requests = registry.add(Counter(
+    "http_requests_total", "HTTP 请求数", ("method", "route", "status"),
+))
+http_latency = registry.add(Histogram(
+    "http_request_duration_seconds", "HTTP 请求耗时（到响应体发完）", ("method", "route"),
+))
+http_in_flight = registry.add(Gauge("http_requests_in_flight", "正在处理的 HTTP 请求数"))
+db_queries = registry.add(Histogram(
+    "http_request_db_queries", "每个请求执行的 SQL 条数", ("route",), QUERY_COUNT_BUCKETS,
+))
+db_time = registry.add(Histogram(
+    "http_request_db_seconds", "每个请求花在 SQL 上的时间", ("route",),
+))
+db_statements = registry.add(Counter("db_queries_total", "执行的 SQL 总条数（含后台任务）"))
+pool_wait = registry.add(Histogram("db_pool_checkout_wait_seconds", "从连接池借连接的等待时间"))
+
+
+class RequestStats:
+    __slots__ = ("scope", "queries", "db_seconds", "pool_wait_seconds")
+
+    def __init__(self, scope: Optional[dict] = None):
+        self.scope = scope
+        self.queries = 0
+        self.db_seconds = 0.0
+        self.pool_wait_seconds = 0.0
+
+    @property
+    def route(self) -> str:
+        # 路由匹配之后 scope 里才有 route；中间件里、匹配之前查的库算 unmatched
+        route = (self.scope or {}).get("route")
+        return getattr(route, "path", None) or UNMATCHED_ROUTE
+
+
+# 当前请求的 DB 开销；SQLAlchemy 的 async 桥接（greenlet）会带上调用方的 contextvars
+_request_stats: ContextVar[Optional[RequestStats]] = ContextVar("request_stats", default=None)
+
+
+def current_stats() -> Optional[RequestStats]:
+    return _request_stats.get()
+
+
+def observe_pool_wait(seconds: float) -> None:
+    pool_wait.observe(seconds)
+    stats = _request_stats.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+def instrument_engine(engine) -> None:
+    """给引擎挂上 SQL 计数 / 计时；engine 是 AsyncEngine 或同步 Engine。"""
+    sync_engine = getattr(engine, "sync_engine", engine)
+
+    @event.listens_for(sync_engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(sync_engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        elapsed = time.perf_counter() - conn.info["query_started"].pop()
+        db_statements.inc()
+        stats = _request_stats.get()
+        if stats is not None:
+            stats.queries += 1
+            stats.db_seconds += elapsed
+
+    @event.listens_for(sync_engine, "handle_error")
+    def _error(context):
+        started = context.connection.info.get("query_started") if context.connection is not None else None
+        if started:
+            started.pop()
+
+
+def server_timing(stats: RequestStats, app_seconds: float) -> str:
+    return (
+        f'db;dur={stats.db_seconds * 1000:.1f};desc="{stats.queries} queries", '
+        f"pool;dur={stats.pool_wait_seconds * 1000:.1f}, "
+        f"app;dur={app_seconds * 1000:.1f}"
+    )
+
+
+class MetricsMiddleware:
+    """
+    纯 ASGI 中间件（不用 BaseHTTPMiddleware：那个会把流式响应整个缓冲一遍）：
+      - 按路由模板（/tools/{tool_id}，不是真实路径）记延迟、状态码、在途数
+      - 每个请求的 SQL 条数 / 耗时 / 借连接等待，写进 Server-Timing 头
+    Server-Timing 在响应头发出那一刻取值，流式响应后面查的库只进 /metrics，不进头。
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        stats = RequestStats(scope)
+        token = _request_stats.set(stats)
+        started = time.perf_counter()
+        status = 500
+        http_in_flight.inc()
+
+        async def send_wrapper(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", []))
+                timing = server_timing(stats, time.perf_counter() - started)
+                headers.append((b"server-timing", timing.encode("latin-1")))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            elapsed = time.perf_counter() - started
+            http_in_flight.dec()
+            _request_stats.reset(token)
+            route = stats.route
+            method = scope["method"]
+            http_requests.inc(method, route, str(status))
+            http_latency.observe(elapsed, method, route)
+            db_queries.observe(stats.queries, route)
+            db_time.observe(stats.db_seconds, route)
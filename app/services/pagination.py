@@ -0,0 +1,63 @@
+import base64
+import json
+from datetime import datetime
+from typing import Any, Sequence
+
+from sqlalchemy import tuple_
+
+from app.services.ledger import abort
+
+
+def encode_cursor(sort: str, values: Sequence[Any]) -> str:
+    # ✅ 游标 = 排序方式 + 最后一行的排序键；对客户端是不透明字符串
+    keys = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps({"s": sort, "k": keys}, ensure_ascii=False, separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def _load(cursor: str) -> dict:
+    padded = cursor + "=" * (-len(cursor) % 4)
+    return json.loads(base64.urlsafe_b64decode(padded.encode("ascii")))
+
+
+def cursor_sort(cursor: str) -> str:
+    """游标是按哪种排序签发的（同一个接口有多种翻页方式时用来分流）。"""
+    try:
+        sort = _load(cursor)["s"]
+        if not isinstance(sort, str):
+            raise ValueError("bad sort")
+        return sort
+    except Exception:
+        abort(400, "BAD_CURSOR", "cursor 无效")
+
+
+def decode_cursor(cursor: str, sort: str, types: Sequence[type]) -> list[Any]:
+    try:
+        data = _load(cursor)
+        keys = data["k"]
+        if data["s"] != sort or len(keys) != len(types):
+            raise ValueError("sort mismatch")
+        values = []
+        for t, v in zip(types, keys):
+            if t is datetime:
+                values.append(datetime.fromisoformat(v))
+            elif t is int:
+                if not isinstance(v, int) or isinstance(v, bool):
+                    raise ValueError("bad int")
+                values.append(v)
+            else:
+                values.append(t(v))
+        return values
+    except Exception:
+        abort(400, "BAD_CURSOR", "cursor 无效，或与当前 sort 不匹配")
+
+
+def seek_after(cols: Sequence[Any], values: Sequence[Any], desc: bool):
+    """
+    keyset 条件：取排在 values 之后的行。
+    多列时用行值比较 (a, b) < (x, y)，能直接走 (a, b) 复合索引做范围扫描。
+    """
+    if len(cols) == 1:
+        return cols[0] < values[0] if desc else cols[0] > values[0]
+    left, right = tuple_(*cols), tuple_(*values)
+    return left < right if desc else left > right
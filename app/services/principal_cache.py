@@ -0,0 +1,129 @@
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+
+from sqlalchemy import event
+from sqlalchemy.dialects import postgresql, sqlite
+
+from app.config import settings
+from app.models import RowCounter, User
+from app.services.counters import USER_GEN_KEY
+from app.services.metrics import Counter, Gauge, registry
+
+
+@dataclass(frozen=True, slots=True)
+class Principal:
+    """鉴权通过的当前用户：接口只用到 id / username，缓存里也只存这两样，不伪造 User 行。"""
+    id: int
+    username: str
+
+
+class PrincipalCache:
+    """
+    进程内鉴权缓存：key = token 的 jti，value = Principal。
+      - TTL + LRU 双重上限，命中时 require_user 不查库
+      - 用户被改/删时按 user_id 失效（见下方 ORM 事件）；同一事务里 user 变更代数 +1，
+        别的进程每 recheck 秒顺带读一次代数（所有命中共用这一次），变了就整个清空
+      - generation：查库期间发生过失效，就不把查到的旧数据写回缓存
+    管不到的：绕过 ORM 直接改 user 表（手写 SQL / 别的程序），这种改动最多要等 TTL 才生效。
+    """
+
+    def __init__(self, ttl_seconds: float, max_size: int, recheck_seconds: float = 1.0):
+        self.ttl = ttl_seconds
+        self.max_size = max_size
+        self.recheck = recheck_seconds
+        self.hits = 0
+        self.misses = 0
+        self.generation = 0
+        self.user_generation: int | None = None
+        self._checked_at = float("-inf")
+        self._data: OrderedDict[str, tuple[float, Principal]] = OrderedDict()
+        self._by_user: dict[int, set[str]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Principal | None:
+        now = time.monotonic()
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is None or entry[0] <= now:
+                if entry is not None:
+                    self._drop(key)
+                self.misses += 1
+                return None
+            self._data.move_to_end(key)
+            self.hits += 1
+            return entry[1]
+
+    def put(self, key: str, principal: Principal, generation: int) -> None:
+        if self.max_size <= 0 or self.ttl <= 0:
+            return
+        with self._lock:
+            if generation != self.generation:
+                return
+            if key in self._data:
+                self._drop(key)
+            self._data[key] = (time.monotonic() + self.ttl, principal)
+            self._by_user.setdefault(principal.id, set()).add(key)
+            while len(self._data) > self.max_size:
+                self._drop(next(iter(self._data)))
+
+    def recheck_due(self) -> bool:
+        """该重新读一次库里的 user 变更代数了：每个进程每 recheck 秒最多一次。"""
+        return time.monotonic() - self._checked_at >= self.recheck
+
+    def sync_user_generation(self, value: int) -> None:
+        """读到的 user 变更代数和上次不一样：有进程改/删过用户，不知道是谁，整个清空。"""
+        with self._lock:
+            self._checked_at = time.monotonic()
+            if value == self.user_generation:
+                return
+            changed = self.user_generation is not None
+            self.user_generation = value
+        if changed:
+            self.clear()
+
+    def invalidate_user(self, user_id: int | None) -> None:
+        with self._lock:
+            self.generation += 1
+            for key in self._by_user.pop(user_id, set()):
+                self._data.pop(key, None)
+
+    def clear(self) -> None:
+        with self._lock:
+            self.generation += 1
+            self._data.clear()
+            self._by_user.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._data)}
+
+    def _drop(self, key: str) -> None:
+        _, principal = self._data.pop(key)
+        keys = self._by_user.get(principal.id)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_user[principal.id]
+
+
+principal_cache = PrincipalCache(
+    settings.principal_cache_ttl_seconds,
+    settings.principal_cache_max_size,
+    settings.principal_cache_recheck_seconds,
+)
+registry.add(Counter("principal_cache_hits_total", "鉴权缓存命中数", fn=lambda: principal_cache.stats()["hits"]))
+registry.add(Counter("principal_cache_misses_total", "鉴权缓存未命中数（要查库）", fn=lambda: principal_cache.stats()["misses"]))
+registry.add(Gauge("principal_cache_size", "鉴权缓存当前条数", fn=lambda: principal_cache.stats()["size"]))
+
+
+@event.listens_for(User, "after_update")
+@event.listens_for(User, "after_delete")
+def _invalidate_principal(mapper, connection, target: User) -> None:
+    principal_cache.invalidate_user(target.id)
+    # 和这次改动同一事务：user 变更代数 +1，其它进程下次 recheck 时看到，清掉各自的缓存
+    dialect = postgresql if connection.dialect.name == "postgresql" else sqlite
+    table = RowCounter.__table__
+    ins = dialect.insert(table).values(key=USER_GEN_KEY, value=int(time.time() * 1000))
+    connection.execute(ins.on_conflict_do_update(index_elements=[table.c.key], set_={"value": table.c.value + 1}))
@@ -0,0 +1,221 @@
+from datetime import datetime, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from sqlalchemy import delete, func
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import dialect_insert
+from app.models import MovementRollup, ToolMovement
+from app.services.archive import movements_select, reaches_archive, read_boundary
+
+BACKFILL_BATCH = 5000
+FETCH_CHUNK = 1000
+
+# group_by 可选维度 -> (rollup 列, 流水列)
+GROUP_COLUMNS = {
+    "tool": (MovementRollup.tool_id, ToolMovement.tool_id),
+    "action": (MovementRollup.action, ToolMovement.action),
+    "operator": (MovementRollup.operator, ToolMovement.operator),
+}
+GROUP_FIELDS = {"tool": "tool_id", "action": "action", "operator": "operator"}
+
+
+def hour_bucket(dt: datetime) -> datetime:
+    return dt.replace(minute=0, second=0, microsecond=0)
+
+
+def rollup_rows(rows: list[dict]) -> list[dict]:
+    """把一批流水（tool_id / action / operator / delta / created_at）先在内存里按小时聚合。"""
+    acc: dict[tuple, dict] = {}
+    for r in rows:
+        key = (hour_bucket(r["created_at"]), r["tool_id"], r["action"], r["operator"])
+        a = acc.get(key)
+        if a is None:
+            a = acc[key] = {
+                "bucket": key[0], "tool_id": key[1], "action": key[2], "operator": key[3],
+                "movement_count": 0, "qty_in": 0, "qty_out": 0, "net": 0,
+            }
+        d = r["delta"]
+        a["movement_count"] += 1
+        a["qty_in"] += d if d > 0 else 0
+        a["qty_out"] += -d if d < 0 else 0
+        a["net"] += d
+    return list(acc.values())
+
+
+async def apply_rollup(session: AsyncSession, rows: list[dict]) -> None:
+    """累加进 rollup 表（INSERT ... ON CONFLICT DO UPDATE），和流水同一事务。"""
+    params = rollup_rows(rows)
+    if not params:
+        return
+    ins = dialect_insert(session, MovementRollup.__table__)
+    t = MovementRollup.__table__.c
+    stmt = ins.on_conflict_do_update(
+        index_elements=[t.bucket, t.tool_id, t.action, t.operator],
+        set_={
+            "movement_count": t.movement_count + ins.excluded.movement_count,
+            "qty_in": t.qty_in + ins.excluded.qty_in,
+            "qty_out": t.qty_out + ins.excluded.qty_out,
+            "net": t.net + ins.excluded.net,
+        },
+    )
+    await session.exec(stmt, params=params)
+
+
+async def backfill_rollup(session: AsyncSession) -> int:
+    """按流水（含归档）全量重算 rollup（老库升级后 / 手工改过流水后跑）。返回处理的流水条数。"""
+    await session.exec(delete(MovementRollup))
+    count = 0
+    last_id = 0
+    while True:
+        batch = (await session.exec(
+            movements_select(
+                (
+                    ToolMovement.id,
+                    ToolMovement.tool_id,
+                    ToolMovement.action,
+                    ToolMovement.operator,
+                    ToolMovement.delta,
+                    ToolMovement.created_at,
+                ),
+                [ToolMovement.id > last_id],
+                (ToolMovement.id,),
+            ).limit(BACKFILL_BATCH)
+        )).all()
+        if not batch:
+            break
+        await apply_rollup(session, [
+            {"tool_id": tid, "action": action, "operator": op, "delta": delta, "created_at": created_at}
+            for _, tid, action, op, delta, created_at in batch
+        ])
+        count += len(batch)
+        last_id = batch[-1][0]
+    await session.commit()
+    return count
+
+
+def bucket_label(local: datetime, bucket: str) -> str:
+    if bucket == "month":
+        return local.strftime("%Y-%m")
+    d = local.date()
+    if bucket == "week":
+        d = d - timedelta(days=d.weekday())  # ISO 周，周一开头
+    return d.isoformat()
+
+
+def _is_hour_aligned(dt: Optional[datetime]) -> bool:
+    return dt is None or (dt.minute, dt.second, dt.microsecond) == (0, 0, 0)
+
+
+class _Summary:
+    def __init__(self, bucket: str, group_by: list[str], zone: ZoneInfo | timezone):
+        self.bucket = bucket
+        self.group_by = group_by
+        self.zone = zone
+        self.acc: dict[tuple, list[int]] = {}
+
+    def label(self, utc_naive: datetime) -> str:
+        return bucket_label(utc_naive.replace(tzinfo=timezone.utc).astimezone(self.zone), self.bucket)
+
+    def add(self, label: str, groups: tuple, count: int, qty_in: int, qty_out: int, net: int) -> None:
+        a = self.acc.setdefault((label, *groups), [0, 0, 0, 0])
+        a[0] += count
+        a[1] += qty_in
+        a[2] += qty_out
+        a[3] += net
+
+    def items(self) -> list[dict]:
+        out = []
+        # ✅ 按原值排序（tool_id 10 排在 2 后面），None 排最前
+        for key in sorted(self.acc, key=lambda k: tuple((v is not None, v) for v in k)):
+            count, qty_in, qty_out, net = self.acc[key]
+            item = {"bucket": key[0], "count": count, "qty_in": qty_in, "qty_out": qty_out, "net": net}
+            item.update({GROUP_FIELDS[g]: v for g, v in zip(self.group_by, key[1:])})
+            out.append(item)
+        return out
+
+
+async def summarize_movements(
+    session: AsyncSession,
+    *,
+    bucket: str,
+    group_by: list[str],
+    zone: Optional[ZoneInfo],
+    start: Optional[datetime],
+    end: Optional[datetime],
+    tool_id: Optional[int] = None,
+    action: Optional[str] = None,
+    operator: Optional[str] = None,
+) -> tuple[list[dict], str]:
+    """
+    按时区折成 day/week/month 的流水汇总，返回 (items, 数据来源 rollup / movements)。
+    rollup 是 UTC 整点小时粒度：start/end 不在整点、或时区和 UTC 差半小时（如 Asia/Kolkata）时，
+    小时桶没法精确切开，退回直接聚合流水，结果依旧准确，只是慢。
+    """
+    summary = _Summary(bucket, group_by, zone or timezone.utc)
+
+    if _is_hour_aligned(start) and _is_hour_aligned(end):
+        items = await _from_rollup(session, summary, start, end, tool_id, action, operator)
+        if items is not None:
+            return items, "rollup"
+        summary = _Summary(bucket, group_by, zone or timezone.utc)
+    return await _from_movements(session, summary, start, end, tool_id, action, operator), "movements"
+
+
+async def _from_rollup(session, summary: _Summary, start, end, tool_id, action, operator) -> list[dict] | None:
+    r = MovementRollup
+    groups = [GROUP_COLUMNS[g][0] for g in summary.group_by]
+    stmt = select(
+        r.bucket,
+        *groups,
+        func.sum(r.movement_count),
+        func.sum(r.qty_in),
+        func.sum(r.qty_out),
+        func.sum(r.net),
+    ).group_by(r.bucket, *groups)
+    if start is not None:
+        stmt = stmt.where(r.bucket >= start)
+    if end is not None:
+        stmt = stmt.where(r.bucket < end)
+    if tool_id is not None:
+        stmt = stmt.where(r.tool_id == tool_id)
+    if action is not None:
+        stmt = stmt.where(r.action == action)
+    if operator is not None:
+        stmt = stmt.where(r.operator == operator)
+
+    n = len(groups)
+    for row in (await session.exec(stmt)).all():
+        local = row[0].replace(tzinfo=timezone.utc).astimezone(summary.zone)
+        if local.minute:
+            return None  # 时区不是整点偏移，小时桶会跨当地的日界
+        summary.add(bucket_label(local, summary.bucket), tuple(row[1:1 + n]), *row[1 + n:])
+    return summary.items()
+
+
+async def _from_movements(session, summary: _Summary, start, end, tool_id, action, operator) -> list[dict]:
+    m = ToolMovement
+    groups = [GROUP_COLUMNS[g][1] for g in summary.group_by]
+    conds = []
+    if start is not None:
+        conds.append(m.created_at >= start)
+    if end is not None:
+        conds.append(m.created_at < end)
+    if tool_id is not None:
+        conds.append(m.tool_id == tool_id)
+    if action is not None:
+        conds.append(m.action == action)
+    if operator is not None:
+        conds.append(m.operator == operator)
+    # 时间范围够到归档边界以下才连归档表一起扫
+    archived = reaches_archive(await read_boundary(session), start)
+    stmt = movements_select((m.created_at, *groups, m.delta), conds, include_archive=archived)
+
+    result = await session.stream(stmt.execution_options(yield_per=FETCH_CHUNK))
+    async for partition in result.partitions():
+        for row in partition:
+            d = row[-1]
+            summary.add(summary.label(row[0]), tuple(row[1:-1]), 1, max(d, 0), max(-d, 0), d)
+    return summary.items()
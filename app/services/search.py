@@ -0,0 +1,106 @@
+from sqlalchemy import and_, delete, func, insert, literal, or_, union_all
+from sqlmodel import select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.models import Tool, ToolSearchGram
+
+REBUILD_BATCH = 1000
+
+# 三字组：一两个字的 gram（“刀”“φ”“a1”）几乎每把刀都有，倒排太长，查起来比直接扫表还慢
+GRAM = 3
+# 例外：含汉字的二字组也进倒排。“合金”“铣刀”这种两个字的中文词是最常见的搜索，只有三字组的话只能扫表
+CJK_GRAM = 2
+# 数倒排长度时每个 gram 最多数到这么多：够分出谁最少，又不用为常见的 gram 数完整条倒排
+PROBE_CAP = 50000
+# q 很长时只比较前这么多个三字组：任何一个三字组给出的候选都是对的，只是可能不是最短的
+PROBE_GRAMS = 16
+
+
+def _is_cjk(ch: str) -> bool:
+    return "\u3400" <= ch <= "\u9fff" or "\uf900" <= ch <= "\ufaff"
+
+
+def _grams(text: str | None) -> set[str]:
+    # 统一小写（和 SQLite LIKE 对 ASCII 不区分大小写一致）
+    s = (text or "").lower()
+    grams = {s[i:i + GRAM] for i in range(len(s) - GRAM + 1)}
+    grams.update(
+        s[i:i + CJK_GRAM] for i in range(len(s) - CJK_GRAM + 1)
+        if any(_is_cjk(ch) for ch in s[i:i + CJK_GRAM])
+    )
+    return grams
+
+
+def _query_grams(q: str) -> list[str]:
+    # 三字组的倒排一定不比它里面的二字组长：q 够三个字就只比三字组
+    grams = _grams(q)
+    return sorted({g for g in grams if len(g) == GRAM} or grams)
+
+
+def tool_grams(name: str | None, location: str | None) -> set[str]:
+    return _grams(name) | _grams(location)
+
+
+async def index_tool(session: AsyncSession, tool: Tool) -> None:
+    """写入/刷新一把刀具的 n-gram；和 Tool 的写操作放在同一事务里。"""
+    await unindex_tool(session, tool.id)
+    rows = [{"gram": g, "tool_id": tool.id} for g in tool_grams(tool.name, tool.location)]
+    if rows:
+        await session.exec(insert(ToolSearchGram), params=rows)
+
+
+async def unindex_tool(session: AsyncSession, tool_id: int) -> None:
+    await session.exec(delete(ToolSearchGram).where(ToolSearchGram.tool_id == tool_id))
+
+
+async def search_condition(session: AsyncSession, q: str):
+    """
+    q 的子串匹配条件（name 或 location）：
+      - q 没有可查的 gram（一个字 / 两个字且不含汉字）：直接 LIKE 扫表（这么短的词本来就命中一大片）
+      - 否则先一条语句数出 q 的每个 gram 各有多少条倒排，只拿最少的那条做候选：
+        包含 q 的刀具一定含有 q 的每个 gram，候选是结果的超集；再对候选行做精确子串校验。
+        不对多条倒排求交集：常见的 gram 一条就上万行，每条都读完再交，比只查最短那条的候选还慢
+    """
+    like = or_(Tool.name.contains(q, autoescape=True), Tool.location.contains(q, autoescape=True))
+    grams = _query_grams(q)
+    if not grams:
+        return like
+    probe = union_all(*(
+        select(
+            select(func.count())
+            .select_from(select(literal(1)).where(ToolSearchGram.gram == g).limit(PROBE_CAP).subquery())
+            .scalar_subquery(),
+            literal(g),
+        )
+        for g in grams[:PROBE_GRAMS]
+    ))
+    rarest = min((await session.exec(probe)).all())[1]
+    candidates = select(ToolSearchGram.tool_id).where(ToolSearchGram.gram == rarest)
+    return and_(Tool.id.in_(candidates), like)
+
+
+async def rebuild_search_index(session: AsyncSession) -> int:
+    """全量重建（老库第一次升级 / 手动改过数据后用）。返回处理的刀具数。"""
+    await session.exec(delete(ToolSearchGram))
+    count = 0
+    last_id = 0
+    while True:
+        batch = (await session.exec(
+            select(Tool.id, Tool.name, Tool.location)
+            .where(Tool.id > last_id)
+            .order_by(Tool.id)
+            .limit(REBUILD_BATCH)
+        )).all()
+        if not batch:
+            break
+        rows = [
+            {"gram": g, "tool_id": tool_id}
+            for tool_id, name, location in batch
+            for g in tool_grams(name, location)
+        ]
+        if rows:
+            await session.exec(insert(ToolSearchGram), params=rows)
+        count += len(batch)
+        last_id = batch[-1][0]
+    await session.commit()
+    return count
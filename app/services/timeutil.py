@@ -0,0 +1,66 @@
+from datetime import datetime, date, timedelta, timezone
+from typing import Optional
+from zoneinfo import ZoneInfo
+
+from app.services.ledger import abort
+
+
+def _get_zone(tz_str: Optional[str]) -> Optional[ZoneInfo]:
+    if not tz_str:
+        return None
+    tz_str = tz_str.strip()
+    if not tz_str:
+        return None
+    try:
+        return ZoneInfo(tz_str)
+    except Exception:
+        abort(400, "BAD_REQUEST", f"tz 不合法：{tz_str}（例：Asia/Shanghai / Asia/Tokyo / UTC）")
+
+
+def _parse_dt_or_date(s: str, *, is_end: bool, assume_tz: Optional[ZoneInfo]) -> datetime:
+    """
+    支持:
+      - "YYYY-MM-DD"
+      - ISO datetime: "YYYY-MM-DDTHH:MM:SS", "YYYY-MM-DDTHH:MM:SSZ", "YYYY-MM-DDTHH:MM:SS+08:00"
+    规则:
+      - 日期: start=当地00:00:00, end=次日00:00:00 (左闭右开)
+      - datetime: 原样解释
+      - 若输入不带时区: 使用 assume_tz；若 assume_tz 也没有，则按 UTC
+      - 最终返回 UTC-naive（匹配你 DB 里的 utcnow() naive）
+    """
+    s = (s or "").strip()
+    if not s:
+        abort(400, "BAD_REQUEST", "start/end 不能为空")
+
+    # 1) 纯日期
+    if len(s) == 10 and s[4] == "-" and s[7] == "-":
+        try:
+            d = date.fromisoformat(s)
+        except ValueError:
+            abort(400, "BAD_REQUEST", f"日期格式错误：{s}，应为 YYYY-MM-DD")
+
+        local_dt = datetime(d.year, d.month, d.day)
+        if is_end:
+            local_dt = local_dt + timedelta(days=1)
+
+        # 给日期补时区（若没提供 tz，则按 UTC）
+        tz = assume_tz or timezone.utc
+        local_dt = local_dt.replace(tzinfo=tz)
+
+        # 转 UTC -> 去 tzinfo
+        return local_dt.astimezone(timezone.utc).replace(tzinfo=None)
+
+    # 2) datetime（兼容 Z）
+    try:
+        iso = s.replace("Z", "+00:00")
+        dt = datetime.fromisoformat(iso)
+    except ValueError:
+        abort(400, "BAD_REQUEST", f"时间格式错误：{s}，例：2026-01-12T08:30:00 或 2026-01-12T08:30:00Z")
+
+    # 如果输入不带时区，就用 tz 参数；否则尊重输入自己的时区
+    if dt.tzinfo is None:
+        tz = assume_tz or timezone.utc
+        dt = dt.replace(tzinfo=tz)
+
+    # 转 UTC -> 去 tzinfo
+    return dt.astimezone(timezone.utc).replace(tzinfo=None)
@@ -0,0 +1,109 @@
+"""
+冷启动剖析：另起一个全新的 Python 进程，带 -X importtime 导入 app.main、跑 lifespan、请求一次 /health，
+报告各阶段耗时、按顶层包汇总的导入时间和最慢的模块。
+（当前进程里模块早就导入过了，量不出冷启动，只能另起进程。）
+    python -m app.cli --profile-startup [--top 20] [--budget-ms 1000]
+"""
+import json
+import os
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+
+MARKER = "@@startup-profile@@"
+
+# 子进程里跑的探针：只用标准库计时，TestClient 在 app 导入完之后才导入，不算进 app 的导入时间
+PROBE = f"""
+import json, time
+t0 = time.perf_counter()
+import app.main
+t1 = time.perf_counter()
+from fastapi.testclient import TestClient
+t2 = time.perf_counter()
+with TestClient(app.main.app) as client:
+    t3 = time.perf_counter()
+    status = client.get("/health").status_code
+    t4 = time.perf_counter()
+print({MARKER!r} + json.dumps({{
+    "import_app": t1 - t0, "lifespan": t3 - t2, "first_health": t4 - t3, "health_status": status,
+}}))
+"""
+
+
+@dataclass
+class ImportRecord:
+    name: str
+    self_us: int
+    cumulative_us: int
+    depth: int
+
+
+def parse_importtime(stderr: str) -> list[ImportRecord]:
+    """解析 -X importtime 的输出：import time: self [us] | cumulative | imported package"""
+    records = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:"):
+            continue
+        parts = line[len("import time:"):].split("|")
+        if len(parts) != 3 or not parts[0].strip().isdigit():
+            continue  # 表头
+        raw = parts[2].rstrip()
+        name = raw.lstrip()
+        records.append(ImportRecord(name, int(parts[0]), int(parts[1]), (len(raw) - len(name) - 1) // 2))
+    return records
+
+
+def by_package(records: list[ImportRecord]) -> list[tuple[str, int]]:
+    totals: dict[str, int] = {}
+    for r in records:
+        top = r.name.split(".")[0]
+        totals[top] = totals.get(top, 0) + r.self_us
+    return sorted(totals.items(), key=lambda kv: kv[1], reverse=True)
+
+
+def _ms(us: float) -> str:
+    return f"{us / 1000:8.1f} ms"
+
+
+def profile_startup(top: int = 20, budget_ms: float | None = None) -> int:
+    root = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+    started = time.perf_counter()
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", PROBE],
+        cwd=root, capture_output=True, text=True,
+    )
+    total = time.perf_counter() - started
+    line = next((ln for ln in proc.stdout.splitlines() if ln.startswith(MARKER)), None)
+    if proc.returncode != 0 or line is None:
+        print(proc.stdout)
+        print(proc.stderr[-4000:], file=sys.stderr)
+        print("冷启动剖析失败：子进程没跑到 /health")
+        return 1
+
+    phases = json.loads(line[len(MARKER):])
+    records = parse_importtime(proc.stderr)
+    total_ms = total * 1000
+    print(f"冷启动（起进程 -> /health 返回 {phases['health_status']}）：{total_ms:.1f} ms"
+          f"（-X importtime 本身会让导入慢一些）")
+    print(f"  解释器启动等    {_ms((total - phases['import_app'] - phases['lifespan'] - phases['first_health']) * 1e6)}")
+    print(f"  import app.main {_ms(phases['import_app'] * 1e6)}")
+    print(f"  lifespan        {_ms(phases['lifespan'] * 1e6)}  （结构版本检查 / 建表 / 迁移）")
+    print(f"  第一次 /health  {_ms(phases['first_health'] * 1e6)}")
+
+    print(f"\n按顶层包汇总的导入时间（前 {top}）：")
+    for name, us in by_package(records)[:top]:
+        print(f"  {name:40s}{_ms(us)}")
+
+    print(f"\n自身导入最慢的模块（前 {top}）：")
+    for r in sorted(records, key=lambda r: r.self_us, reverse=True)[:top]:
+        print(f"  {r.name:60s}{_ms(r.self_us)}")
+
+    print("\napp 自己的模块（累计，含它带进来的依赖）：")
+    for r in sorted((r for r in records if r.name.split(".")[0] == "app"), key=lambda r: r.cumulative_us, reverse=True):
+        print(f"  {r.name:40s}{_ms(r.cumulative_us)}")
+
+    if budget_ms is not None and total_ms > budget_ms:
+        print(f"\n超出预算：{total_ms:.1f} ms > {budget_ms:.0f} ms")
+        return 1
+    return 0
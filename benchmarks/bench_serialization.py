@@ -0,0 +1,102 @@
+"""
+列表序列化：旧路径 vs 快路径
+    python -m benchmarks.bench_serialization [--rows 5000] [--repeat 20]
+
+旧路径：select(ORM 对象) -> response_model 校验 -> jsonable 化 -> json.dumps（FastAPI 默认）
+快路径：select(列) 行元组 -> dict -> orjson（app/services/fastjson.py）
+"""
+import argparse
+import asyncio
+import json
+import statistics
+import time
+from datetime import datetime, timedelta
+
+from sqlalchemy import insert
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import build_engine
+from app.models import Tool, ToolMovement
+from app.routers.movements import MOVEMENT_COLUMNS
+from app.schemas import MovementListResponse
+from app.services.fastjson import dumps
+
+
+def _stdlib_json(payload) -> bytes:
+    # 和 starlette JSONResponse.render 一样的参数
+    return json.dumps(payload, ensure_ascii=False, allow_nan=False, indent=None, separators=(",", ":")).encode("utf-8")
+
+
+async def _seed(session: AsyncSession, n: int) -> None:
+    session.add(Tool(id=1, name="基准刀", location="B1", quantity=n))
+    base = datetime(2026, 1, 1)
+    await session.exec(insert(ToolMovement), params=[
+        {
+            "tool_id": 1,
+            "action": "IN",
+            "delta": 1,
+            "note": f"基准入库 {i}",
+            "operator": "bench",
+            "created_at": base + timedelta(seconds=i),
+        }
+        for i in range(n)
+    ])
+    await session.commit()
+
+
+async def _old_path(session: AsyncSession, n: int) -> bytes:
+    rows = (await session.exec(select(ToolMovement).order_by(ToolMovement.id.desc()).limit(n))).all()
+    payload = {"items": rows, "total": n, "total_estimated": False, "limit": n, "offset": 0, "next_cursor": None}
+    model = MovementListResponse.model_validate(payload, from_attributes=True)
+    return _stdlib_json(model.model_dump(mode="json"))
+
+
+async def _fast_path(session: AsyncSession, n: int) -> bytes:
+    rows = (await session.exec(select(*MOVEMENT_COLUMNS).order_by(ToolMovement.id.desc()).limit(n))).all()
+    payload = {
+        "items": [r._asdict() for r in rows],
+        "total": n,
+        "total_estimated": False,
+        "limit": n,
+        "offset": 0,
+        "next_cursor": None,
+    }
+    return dumps(payload)
+
+
+async def _time(fn, session, n, repeat) -> list[float]:
+    out = []
+    for _ in range(repeat):
+        session.expunge_all()  # 旧路径每次请求都是新 session，重新构造 ORM 对象
+        t0 = time.perf_counter()
+        await fn(session, n)
+        out.append((time.perf_counter() - t0) * 1000)
+    return out
+
+
+async def main(rows: int, repeat: int) -> None:
+    engine = build_engine("sqlite://")
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    try:
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            await _seed(session, rows)
+            old_body = await _old_path(session, rows)
+            fast_body = await _fast_path(session, rows)
+            assert json.loads(old_body) == json.loads(fast_body), "两条路径的输出不一致"
+
+            for name, fn in (("old (ORM + pydantic + json)", _old_path), ("fast (rows + orjson)", _fast_path)):
+                times = await _time(fn, session, rows, repeat)
+                print(f"{name:32s} median {statistics.median(times):8.2f} ms   min {min(times):8.2f} ms")
+            print(f"body: {len(fast_body)} bytes, {rows} rows")
+    finally:
+        await engine.dispose()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.bench_serialization")
+    parser.add_argument("--rows", type=int, default=5000)
+    parser.add_argument("--repeat", type=int, default=20)
+    args = parser.parse_args()
+    asyncio.run(main(args.rows, args.repeat))
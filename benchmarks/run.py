@@ -0,0 +1,288 @@
+"""
+基准套件：在固定种子生成的大库上（见 benchmarks/seed.py）压主要接口，输出 JSON，按阈值 / 上次结果判回归。
+    python -m benchmarks.run                                   # 默认 20 万刀具 / 500 万流水
+    python -m benchmarks.run --tools 20000 --movements 500000  # 小库快速跑
+    python -m benchmarks.run --only list_tools --out /tmp/r.json --baseline benchmarks/results/last.json
+    python -m benchmarks.run --base-url http://127.0.0.1:8000  # 压已经起着的服务（库要是同一个基准库）
+
+默认在进程内直接调 ASGI app（httpx.ASGITransport），不经过网络，结果只反映应用 + 数据库本身。
+每个场景先预热几次，再用 concurrency 个并发协程跑满 requests 次，记 p50 / p99 / 平均延迟、吞吐和出错数。
+阈值（benchmarks/thresholds.json）只对同一规模的数据集生效；有一项超标退出码为 1，方便接 CI。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import random
+import sqlite3
+import statistics
+import subprocess
+import sys
+import time
+from dataclasses import dataclass
+from datetime import datetime, timedelta
+from typing import Awaitable, Callable
+
+from benchmarks.seed import dataset_path, ensure_dataset
+
+HERE = os.path.dirname(__file__)
+THRESHOLDS_PATH = os.path.join(HERE, "thresholds.json")
+DEFAULT_OUT = os.path.join(HERE, "results", "latest.json")
+
+BENCH_USER = {"username": "bench", "password": "bench-password"}
+SORTS = ["id_desc", "id_asc", "name_asc", "name_desc", "qty_asc", "qty_desc"]
+QUERIES = ["铣刀", "Φ12", "镗刀Φ3", "A17-", "丝锥Φ8-1"]
+BATCH_ITEMS = 1000
+
+
+@dataclass
+class Scenario:
+    name: str
+    call: Callable[[object, random.Random], Awaitable[object]]  # (client, rng) -> response
+    requests: int = 200
+    concurrency: int = 4
+    warmup: int = 5
+
+
+def _percentile(sorted_ms: list[float], p: float) -> float:
+    if not sorted_ms:
+        return 0.0
+    k = min(len(sorted_ms) - 1, max(0, round(p / 100 * len(sorted_ms) + 0.5) - 1))
+    return sorted_ms[k]
+
+
+async def _run_scenario(client, sc: Scenario, seed: int) -> dict:
+    rng = random.Random(f"{seed}:{sc.name}")
+    for _ in range(sc.warmup):
+        await sc.call(client, rng)
+
+    latencies: list[float] = []
+    errors = 0
+    remaining = sc.requests
+
+    async def worker():
+        nonlocal remaining, errors
+        while remaining > 0:
+            remaining -= 1
+            t0 = time.perf_counter()
+            r = await sc.call(client, rng)
+            latencies.append((time.perf_counter() - t0) * 1000)
+            if r.status_code >= 400:
+                errors += 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(sc.concurrency)))
+    wall = time.perf_counter() - started
+    latencies.sort()
+    return {
+        "requests": len(latencies),
+        "concurrency": sc.concurrency,
+        "errors": errors,
+        "rps": round(len(latencies) / wall, 1),
+        "p50_ms": round(_percentile(latencies, 50), 2),
+        "p99_ms": round(_percentile(latencies, 99), 2),
+        "mean_ms": round(statistics.fmean(latencies), 2),
+        "max_ms": round(latencies[-1], 2),
+    }
+
+
+def build_scenarios(meta: dict, auth: dict, scale: float) -> list[Scenario]:
+    hot = meta["hot_tools"]
+    tools = meta["tools"]
+    start = datetime.fromisoformat(meta["start"])
+    days = (datetime.fromisoformat(meta["end"]) - start).days
+
+    def n(requests: int) -> int:
+        return max(5, int(requests * scale))
+
+    def get(url_fn):
+        async def call(client, rng):
+            return await client.get(url_fn(rng), headers=auth)
+        return call
+
+    def cold_tool(rng):
+        return rng.randint(1, tools)
+
+    def day(rng):
+        d = start + timedelta(days=rng.randrange(days))
+        return d.date().isoformat(), (d + timedelta(days=1)).date().isoformat()
+
+    scenarios = [
+        Scenario(f"list_tools.{s}", get(lambda rng, s=s: f"/tools?sort={s}&limit=50"), n(300))
+        for s in SORTS
+    ]
+    scenarios += [
+        Scenario("list_tools.q", get(lambda rng: f"/tools?q={rng.choice(QUERIES)}&limit=50"), n(200)),
+        Scenario("list_tools.q_no_total", get(lambda rng: f"/tools?q={rng.choice(QUERIES)}&limit=50&include_total=false"), n(200)),
+        Scenario("list_tools.q_estimate", get(lambda rng: f"/tools?q={rng.choice(QUERIES)}&limit=50&estimate=true"), n(200)),
+        Scenario("list_movements.all", get(lambda rng: "/movements?limit=50"), n(300)),
+        Scenario("list_movements.hot_tool", get(lambda rng: f"/movements?tool_id={rng.choice(hot)}&limit=50"), n(300)),
+        Scenario("list_movements.cold_tool", get(lambda rng: f"/movements?tool_id={cold_tool(rng)}&limit=50"), n(300)),
+        Scenario("list_movements.action", get(lambda rng: f"/movements?action={rng.choice(['IN', 'OUT', 'ADJUST'])}&limit=50"), n(200)),
+        Scenario("list_movements.operator", get(lambda rng: f"/movements?operator=op{rng.randint(1, 20):02d}&limit=50"), n(200)),
+        Scenario("list_movements.day", get(lambda rng: "/movements?start={}&end={}&sort=created_desc&limit=50".format(*day(rng))), n(200)),
+        Scenario(
+            "list_movements.hot_tool_action_day",
+            get(lambda rng: "/movements?tool_id={}&action=OUT&start={}&end={}&limit=50".format(rng.choice(hot), *day(rng))),
+            n(200),
+        ),
+        Scenario("export_tools_xlsx.q", get(lambda rng: f"/tools/export.xlsx?q={rng.choice(QUERIES)}"), n(20), 2, 1),
+        Scenario("export_tools_xlsx.full", get(lambda rng: "/tools/export.xlsx"), max(2, int(3 * scale)), 1, 1),
+    ]
+
+    async def update_quantity(client, rng):
+        # 热点刀具上的并发写：IN 1，只测写路径（原子加减 + 流水 + 派生数据 + 提交）
+        return await client.patch(f"/tools/{rng.choice(hot)}/quantity", json={"action": "IN", "delta": 1}, headers=auth)
+
+    async def movement_batch(client, rng):
+        # 批量入账：每次 BATCH_ITEMS 条 IN 1，散在随机刀具上（吞吐 rows/s = req/s × BATCH_ITEMS）
+        items = [{"tool_id": cold_tool(rng), "action": "IN", "delta": 1} for _ in range(BATCH_ITEMS)]
+        return await client.post("/movements/batch", json={"items": items}, headers=auth)
+
+    async def login(client, rng):
+        return await client.post("/auth/login", data=BENCH_USER)
+
+    scenarios += [
+        Scenario("update_tool_quantity.hot_concurrent", update_quantity, n(400), 8),
+        Scenario(f"create_movements_batch.{BATCH_ITEMS}", movement_batch, n(40), 2, 2),
+        Scenario("login", login, n(60), 4, 2),
+    ]
+    return scenarios
+
+
+async def _client(base_url: str | None):
+    import httpx
+
+    if base_url:
+        return httpx.AsyncClient(base_url=base_url, timeout=120)
+    from app.db import engine
+    from app.main import app
+    from app.migrations import ensure_schema
+
+    # ASGITransport 不跑 lifespan：种子库可能是老版本生成的（比如还没有归档表），先像服务启动时一样补到最新结构
+    await ensure_schema(engine, verbose=False)
+    return httpx.AsyncClient(transport=httpx.ASGITransport(app=app), base_url="http://bench", timeout=120)
+
+
+async def run(args, meta: dict) -> dict:
+    client = await _client(args.base_url)
+    try:
+        await client.post("/auth/register", json=BENCH_USER)
+        token = (await client.post("/auth/login", data=BENCH_USER)).json()["access_token"]
+        auth = {"Authorization": f"Bearer {token}"}
+
+        results = {}
+        for sc in build_scenarios(meta, auth, args.scale):
+            if args.only and not any(sc.name.startswith(o) for o in args.only):
+                continue
+            results[sc.name] = r = await _run_scenario(client, sc, meta["seed"])
+            print(
+                f"{sc.name:40s} p50 {r['p50_ms']:9.2f} ms  p99 {r['p99_ms']:9.2f} ms  "
+                f"{r['rps']:8.1f} req/s  errors {r['errors']}",
+                flush=True,
+            )
+        return results
+    finally:
+        await client.aclose()
+        if not args.base_url:
+            from app.db import engine
+
+            await engine.dispose()
+
+
+def check(results: dict, meta: dict, thresholds: dict | None, baseline: dict | None, tolerance: float) -> list[str]:
+    """返回回归列表：超过阈值，或 p50 比基线慢了 tolerance 以上。"""
+    problems = []
+    for name, r in results.items():
+        if r["errors"]:
+            problems.append(f"{name}: {r['errors']} 个请求出错")
+    dataset = {k: meta[k] for k in ("tools", "movements", "seed")}
+    if thresholds and thresholds.get("dataset") == dataset:
+        for name, limit in thresholds["scenarios"].items():
+            r = results.get(name)
+            if r is None:
+                continue
+            if "p99_ms" in limit and r["p99_ms"] > limit["p99_ms"]:
+                problems.append(f"{name}: p99 {r['p99_ms']}ms > 阈值 {limit['p99_ms']}ms")
+            if "min_rps" in limit and r["rps"] < limit["min_rps"]:
+                problems.append(f"{name}: 吞吐 {r['rps']} < 阈值 {limit['min_rps']} req/s")
+    if baseline and baseline.get("dataset") == dataset:
+        for name, r in results.items():
+            base = baseline["results"].get(name)
+            if base and r["p50_ms"] > base["p50_ms"] * (1 + tolerance):
+                problems.append(f"{name}: p50 {r['p50_ms']}ms 比基线 {base['p50_ms']}ms 慢了 {tolerance:.0%} 以上")
+    return problems
+
+
+def _git_rev() -> str | None:
+    try:
+        return subprocess.check_output(["git", "rev-parse", "--short", "HEAD"], cwd=HERE, text=True).strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def _load(path: str | None) -> dict | None:
+    if not path or not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def main(argv: list[str] | None = None) -> int:
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.run")
+    parser.add_argument("--tools", type=int, default=200_000)
+    parser.add_argument("--movements", type=int, default=5_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--scale", type=float, default=1.0, help="每个场景的请求数乘这个系数")
+    parser.add_argument("--only", action="append", help="只跑名字以此开头的场景（可重复）")
+    parser.add_argument("--base-url", help="压已经起着的服务；不传则进程内直接调 app")
+    parser.add_argument("--out", default=DEFAULT_OUT)
+    parser.add_argument("--thresholds", default=THRESHOLDS_PATH)
+    parser.add_argument("--baseline", help="上次的结果 JSON；p50 慢了 --tolerance 以上算回归")
+    parser.add_argument("--tolerance", type=float, default=0.25)
+    parser.add_argument("--slow-log", action="store_true", help="打开慢查询日志（默认关掉，热点写会刷屏）")
+    args = parser.parse_args(argv)
+    if not args.slow_log:
+        logging.getLogger("app.slow_query").disabled = True
+
+    # app.db 在导入时按配置建引擎，所以要在任何 app 模块导入之前指过去。
+    # 基准会写库（改库存 / 注册用户），在副本上跑，种子库保持原样，每次结果可比
+    work = dataset_path(args.tools, args.movements, args.seed) + ".run"
+    os.environ["DATABASE_URL"] = f"sqlite:///{work}"
+    path, meta = ensure_dataset(args.tools, args.movements, args.seed)
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(work + suffix):
+            os.remove(work + suffix)
+    with sqlite3.connect(path) as src, sqlite3.connect(work) as dst:
+        src.backup(dst)
+
+    results = asyncio.run(run(args, meta))
+    report = {
+        "dataset": {k: meta[k] for k in ("tools", "movements", "seed")},
+        "env": {
+            "git": _git_rev(),
+            "python": platform.python_version(),
+            "sqlite": sqlite3.sqlite_version,
+            "platform": platform.platform(),
+            "target": args.base_url or "asgi",
+            "scale": args.scale,
+        },
+        "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+        "results": results,
+    }
+    problems = check(results, meta, _load(args.thresholds), _load(args.baseline), args.tolerance)
+    report["regressions"] = problems
+
+    os.makedirs(os.path.dirname(os.path.abspath(args.out)), exist_ok=True)
+    with open(args.out, "w", encoding="utf-8") as f:
+        json.dump(report, f, ensure_ascii=False, indent=2)
+    print(f"结果已写入 {args.out}")
+    for p in problems:
+        print("回归：", p)
+    return 1 if problems else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,162 @@
+"""
+基准数据集：固定随机种子生成刀具 + 流水，写进一个 SQLite 文件，之后重复使用。
+    python -m benchmarks.seed [--tools 200000] [--movements 5000000] [--seed 42]
+
+- 流水有明显热点：1% 的刀具吃掉一半流水（模拟常用刀）；操作人也是少数几个人占大头
+- 流水时间覆盖一年，随 id 递增；每把刀先有一条期初入库，之后随机 IN / OUT / ADJUST，库存永不为负
+- 写完后用线上同一套重建函数补齐派生数据（搜索索引、检查点、小时汇总）；计数器留空，第一次读时补
+同样的参数 + 种子，生成的库逐行相同；文件已存在就直接用（旁边的 .json 记着热点刀具等元数据）。
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import random
+import time
+from datetime import datetime, timedelta
+
+DATA_DIR = os.path.join(os.path.dirname(__file__), ".data")
+INSERT_BATCH = 20_000
+
+TOOL_KINDS = ["铣刀", "立铣刀", "球头刀", "钻头", "中心钻", "丝锥", "镗刀", "铰刀", "车刀", "倒角刀"]
+OPERATORS = [f"op{i:02d}" for i in range(1, 21)]
+START = datetime(2025, 1, 1)
+SPAN = timedelta(days=365)
+
+
+def dataset_path(tools: int, movements: int, seed: int) -> str:
+    return os.path.join(DATA_DIR, f"bench-{tools}-{movements}-{seed}.db")
+
+
+def _tool_row(i: int, rng: random.Random) -> dict:
+    return {
+        "name": f"{TOOL_KINDS[i % len(TOOL_KINDS)]}Φ{rng.randint(1, 40)}-{i + 1}",
+        "location": f"A{rng.randint(1, 60):02d}-{rng.randint(1, 40):02d}",
+        "quantity": 0,
+        "updated_at": START,
+    }
+
+
+def _movements(tools: int, movements: int, hot: list[int], rng: random.Random, balance: list[int]):
+    """按时间顺序吐出流水行（tool 下标从 0 开始）；balance 边生成边更新。"""
+    step = SPAN.total_seconds() / movements
+    t = 0.0
+    opened = 0
+    for n in range(movements):
+        t += rng.expovariate(1 / step)  # 泊松到达，时间随 id 单调递增
+        operator = OPERATORS[min(int(rng.expovariate(0.25)), len(OPERATORS) - 1)]
+        if opened < tools and (opened == 0 or movements - n <= tools - opened or rng.random() < tools / movements):
+            idx, action, delta = opened, "IN", rng.randint(50, 500)  # 期初入库
+            opened += 1
+        else:
+            idx = rng.choice(hot) if rng.random() < 0.5 else rng.randrange(opened)
+            if idx >= opened:
+                idx = rng.randrange(opened)
+            r = rng.random()
+            if r < 0.1:
+                action, delta = "ADJUST", rng.randint(0, 600) - balance[idx]
+            elif r < 0.55 and balance[idx] > 0:
+                action, delta = "OUT", -rng.randint(1, min(20, balance[idx]))
+            else:
+                action, delta = "IN", rng.randint(1, 20)
+            if delta == 0:
+                action, delta = "IN", 1
+        balance[idx] += delta
+        yield {
+            "tool_id": idx + 1,
+            "action": action,
+            "delta": delta,
+            "note": None,
+            "operator": operator,
+            "created_at": START + timedelta(seconds=t),
+        }
+
+
+async def _seed(path: str, tools: int, movements: int, seed: int) -> dict:
+    # app.db 一导入就按 DATABASE_URL 建引擎；放在这里导入，run.py 才能先把地址指到基准库
+    from sqlalchemy import bindparam, insert
+    from sqlmodel import SQLModel
+    from sqlmodel.ext.asyncio.session import AsyncSession
+
+    from app.db import build_engine
+    from app.models import Tool, ToolMovement
+    from app.services.balances import rebuild_checkpoints
+    from app.services.rollup import backfill_rollup
+    from app.services.search import rebuild_search_index
+
+    logging.getLogger("app.slow_query").disabled = True  # 整批插入条条都“慢”，不用记
+    rng = random.Random(seed)
+    hot = rng.sample(range(tools), max(1, tools // 100))
+    engine = build_engine(f"sqlite:///{path}")
+    try:
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            for i in range(0, tools, INSERT_BATCH):
+                rows = [_tool_row(j, rng) for j in range(i, min(i + INSERT_BATCH, tools))]
+                await session.exec(insert(Tool.__table__), params=rows)
+
+            balance = [0] * tools
+            batch = []
+            for mv in _movements(tools, movements, hot, rng, balance):
+                batch.append(mv)
+                if len(batch) == INSERT_BATCH:
+                    await session.exec(insert(ToolMovement.__table__), params=batch)
+                    batch = []
+            if batch:
+                await session.exec(insert(ToolMovement.__table__), params=batch)
+
+            t = Tool.__table__
+            await session.exec(
+                t.update().where(t.c.id == bindparam("tid")).values(quantity=bindparam("qty"), updated_at=START + SPAN),
+                params=[{"tid": i + 1, "qty": q} for i, q in enumerate(balance)],
+            )
+            await session.commit()
+
+            await rebuild_search_index(session)
+            await rebuild_checkpoints(session)
+            await backfill_rollup(session)
+    finally:
+        await engine.dispose()
+    return {
+        "tools": tools,
+        "movements": movements,
+        "seed": seed,
+        "hot_tools": sorted(i + 1 for i in hot),
+        "operators": OPERATORS,
+        "start": START.isoformat(),
+        "end": (START + SPAN).isoformat(),
+    }
+
+
+def ensure_dataset(tools: int, movements: int, seed: int = 42) -> tuple[str, dict]:
+    """返回 (库文件路径, 元数据)；没有就现生成。"""
+    if movements < tools:
+        raise ValueError("movements 不能少于 tools（每把刀至少一条期初入库）")
+    path = dataset_path(tools, movements, seed)
+    meta_path = path + ".json"
+    if os.path.exists(path) and os.path.exists(meta_path):
+        with open(meta_path, encoding="utf-8") as f:
+            return path, json.load(f)
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+    for p in (path, path + "-wal", path + "-shm"):
+        if os.path.exists(p):
+            os.remove(p)  # 上次生成到一半
+    t0 = time.perf_counter()
+    print(f"生成基准库 {path}（{tools} 把刀具 / {movements} 条流水）……")
+    meta = asyncio.run(_seed(path, tools, movements, seed))
+    print(f"生成完毕，用时 {time.perf_counter() - t0:.1f}s")
+    with open(meta_path, "w", encoding="utf-8") as f:
+        json.dump(meta, f, ensure_ascii=False)
+    return path, meta
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m benchmarks.seed")
+    parser.add_argument("--tools", type=int, default=200_000)
+    parser.add_argument("--movements", type=int, default=5_000_000)
+    parser.add_argument("--seed", type=int, default=42)
+    args = parser.parse_args()
+    print(ensure_dataset(args.tools, args.movements, args.seed)[0])
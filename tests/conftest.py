@@ -1,11 +1,19 @@
 import os
+from contextlib import contextmanager
+
 import pytest
+from sqlalchemy import event
 from fastapi.testclient import TestClient
-from sqlmodel import SQLModel, Session, create_engine
-from sqlalchemy.pool import StaticPool
+from sqlmodel import SQLModel
+from sqlmodel.ext.asyncio.session import AsyncSession
 
 from app.main import app
-from app.db import get_session
+from app.db import build_engine, explain_query_plan, full_scans, get_session, get_session_factory
+
+
+async def _create_all(engine):
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
 
 
 @pytest.fixture(scope="session")
@@ -14,20 +22,73 @@ def client():
     os.environ.setdefault("secret_key", "test_secret")
     os.environ.setdefault("access_token_expire_minutes", "120")
 
-    engine = create_engine(
-        "sqlite://",
-        connect_args={"check_same_thread": False},
-        poolclass=StaticPool,
-    )
-    SQLModel.metadata.create_all(engine)
+    engine = build_engine("sqlite://")  # 内存库：自动单连接 StaticPool
 
-    def override_get_session():
-        with Session(engine) as session:
+    async def override_get_session():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
             yield session
 
     app.dependency_overrides[get_session] = override_get_session
+    # 后台任务（导出）自己开 session，也要落到测试库上
+    app.dependency_overrides[get_session_factory] = lambda: lambda: AsyncSession(engine, expire_on_commit=False)
 
     with TestClient(app) as c:
+        c.portal.call(_create_all, engine)
         yield c
 
     app.dependency_overrides.clear()
+
+
+@pytest.fixture
+def db(client):
+    """在 app 的事件循环里，用测试库的 session 跑 async fn(session)，返回 fn 的结果。"""
+    def run(fn):
+        async def go():
+            agen = app.dependency_overrides[get_session]()
+            session = await agen.__anext__()
+            try:
+                return await fn(session)
+            finally:
+                await agen.aclose()
+        return client.portal.call(go)
+    return run
+
+
+@pytest.fixture
+def query_budget(db, monkeypatch):
+    """
+    with query_budget(3):
+        client.get("/tools")
+    块里执行的 SQL 不超过 max_queries 条，且每条的执行计划里都没有全表扫描（口径见 app.db.full_scans）；
+    allow_scan 放行已知要扫、且扫的就是小表的表名。返回块里执行过的 [(sql, 计划)]。
+    鉴权缓存每秒一次的 user 代数复查不算在单个请求头上：先同步好，块里不再复查。
+    """
+    from app.services.counters import USER_GEN_KEY, read_generation
+    from app.services.principal_cache import principal_cache
+
+    async def get_engine(session):
+        return session.get_bind()
+
+    engine = db(get_engine)
+    principal_cache.sync_user_generation(db(lambda s: read_generation(s, USER_GEN_KEY)))
+    monkeypatch.setattr(principal_cache, "recheck", float("inf"))
+
+    @contextmanager
+    def budget(max_queries: int, allow_scan: tuple[str, ...] = ()):
+        seen: list[tuple[str, list[str]]] = []
+
+        def capture(conn, cursor, statement, parameters, context, executemany):
+            seen.append((statement, [] if executemany else explain_query_plan(conn, statement, parameters)))
+
+        event.listen(engine, "after_cursor_execute", capture)
+        try:
+            yield seen
+        finally:
+            event.remove(engine, "after_cursor_execute", capture)
+        listing = "\n---\n".join(sql for sql, _ in seen)
+        assert len(seen) <= max_queries, f"执行了 {len(seen)} 条 SQL，预算 {max_queries}：\n{listing}"
+        for sql, plan in seen:
+            scans = [t for t in full_scans(sql, plan) if t not in allow_scan]
+            assert not scans, f"全表扫描 {scans}：\n{sql}\n计划：{plan}"
+
+    return budget
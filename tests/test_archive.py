@@ -0,0 +1,137 @@
+from datetime import datetime
+
+import pytest
+from sqlalchemy import func, update
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+
+from app.db import build_engine, get_session
+from app.main import app
+from app.models import ToolMovement, ToolMovementArchive
+from app.services.archive import archive_movements
+from app.services.rollup import backfill_rollup
+
+
+@pytest.fixture
+def fresh_db(client):
+    """归档边界是全库状态：这个文件的测试用单独的内存库，不影响别的测试。"""
+    engine = build_engine("sqlite://")
+    saved = app.dependency_overrides[get_session]
+
+    async def override_get_session():
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            yield session
+
+    async def create_all():
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+
+    app.dependency_overrides[get_session] = override_get_session
+    client.portal.call(create_all)
+    yield
+    app.dependency_overrides[get_session] = saved
+    client.portal.call(engine.dispose)
+
+
+def _h(client):
+    client.post("/auth/register", json={"username": "archiver", "password": "p"})
+    r = client.post("/auth/login", data={"username": "archiver", "password": "p"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def test_archived_movements_stay_queryable(client, fresh_db, db, query_budget):
+    h = _h(client)
+    tid = client.post("/tools", json={"name": "归档铣刀", "location": "Z1", "quantity": 10}, headers=h).json()["id"]
+    client.post("/movements", json={"tool_id": tid, "action": "OUT", "delta": 3}, headers=h)
+    client.post("/movements", json={"tool_id": tid, "action": "IN", "delta": 5}, headers=h)
+
+    # 把前两条挪到 2024 年初，归档 2025 年之前的
+    async def backdate(session):
+        ids = (await session.exec(select(ToolMovement.id).order_by(ToolMovement.id))).all()
+        for mv_id, day in zip(ids[:2], (1, 2)):
+            await session.exec(update(ToolMovement).where(ToolMovement.id == mv_id).values(created_at=datetime(2024, 1, day)))
+        await session.commit()
+        return ids
+
+    ids = db(backdate)
+    history = client.get(f"/tools/{tid}/history", headers=h).json()["items"]
+
+    moved = db(lambda s: archive_movements(s, datetime(2025, 1, 1), batch_size=1, pause_seconds=0))
+    assert moved == 2
+
+    async def counts(session):
+        hot = (await session.exec(select(func.count()).select_from(ToolMovement))).one()
+        cold = (await session.exec(select(func.count()).select_from(ToolMovementArchive))).one()
+        return hot, cold
+
+    assert db(counts) == (1, 2)
+
+    # 不带 start：连归档一起查，结果和 total 都和归档前一样
+    with query_budget(3):
+        data = client.get(f"/movements?tool_id={tid}&sort=id_asc", headers=h).json()
+    assert [m["id"] for m in data["items"]] == ids
+    assert data["total"] == 3
+
+    # 游标翻页跨过归档边界
+    seen, cursor = [], None
+    while True:
+        url = f"/movements?tool_id={tid}&sort=created_asc&limit=1" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url, headers=h).json()
+        seen += [m["id"] for m in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == ids
+
+    # start 够到归档边界以下才查归档表；近期范围只查主表
+    old = client.get(f"/movements?tool_id={tid}&start=2024-01-02", headers=h).json()
+    assert old["total"] == 2
+
+    # 只有时间范围 + 按 id 排序：两边各自从时间索引取 id，游标 / offset 翻页跨过归档边界
+    for sort, expected in (("id_desc", ids[::-1]), ("id_asc", ids)):
+        seen, cursor = [], None
+        while True:
+            url = f"/movements?start=2024-01-01&sort={sort}&limit=1" + (f"&cursor={cursor}" if cursor else "")
+            page = client.get(url, headers=h).json()
+            seen += [m["id"] for m in page["items"]]
+            cursor = page["next_cursor"]
+            if not cursor:
+                break
+        assert seen == expected
+        page = client.get(f"/movements?start=2024-01-01&end=2025-01-01&sort={sort}&offset=1", headers=h).json()
+        assert [m["id"] for m in page["items"]] == [i for i in expected if i in ids[:2]][1:]
+    with query_budget(3) as seen_sql:
+        recent = client.get(f"/movements?tool_id={tid}&start=2025-06-01", headers=h).json()
+    assert [m["id"] for m in recent["items"]] == ids[2:]
+    assert not any("toolmovementarchive" in sql for sql, _ in seen_sql)
+
+    csv = client.get(f"/movements/export?format=csv&tool_id={tid}", headers=h).text.strip().splitlines()
+    assert len(csv) == 1 + 3
+
+    # 历史流水和历史库存照常
+    assert client.get(f"/tools/{tid}/history", headers=h).json()["items"] == history
+    balance = client.get(f"/tools/balance?at=2024-01-01T12:00:00&tool_id={tid}", headers=h).json()
+    assert balance["items"][0]["balance"] == 10
+
+    # 重建派生数据时不会丢掉归档的流水
+    assert db(backfill_rollup) == 3
+    assert db(lambda s: archive_movements(s, datetime(2025, 1, 1), pause_seconds=0)) == 0
+
+
+def test_movement_ids_are_not_reused_after_archiving_everything(client, fresh_db, db):
+    h = _h(client)
+    tid = client.post("/tools", json={"name": "全归档铣刀", "location": "Z2", "quantity": 5}, headers=h).json()["id"]
+    first = client.post("/movements", json={"tool_id": tid, "action": "OUT", "delta": 1}, headers=h).json()["id"]
+
+    # 全部挪走（包括 id 最大的那条），主表清空
+    assert db(lambda s: archive_movements(s, datetime(2999, 1, 1), pause_seconds=0)) == 2
+
+    # 新流水不能拿回归档表里已有的 id
+    new = client.post("/movements", json={"tool_id": tid, "action": "IN", "delta": 2}, headers=h).json()["id"]
+    assert new > first
+
+    items = client.get(f"/movements?tool_id={tid}&sort=id_desc", headers=h).json()["items"]
+    assert [m["id"] for m in items] == [new, first, first - 1]
+
+    assert db(lambda s: archive_movements(s, datetime(2999, 1, 1), pause_seconds=0)) == 1
+    assert client.get(f"/tools/balance?at=2999-01-01&tool_id={tid}", headers=h).json()["items"][0]["balance"] == 6
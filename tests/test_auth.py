@@ -27,3 +27,156 @@ def test_login_invalid_credentials(client):
     assert r.json() == {
         "detail": {"code": "INVALID_CREDENTIALS", "message": "用户名或密码错误"}
     }
+
+
+def test_principal_cache_hits_skip_db_and_invalidate_on_delete(client, db):
+    from sqlalchemy import event
+    from sqlmodel import select
+    from app.models import User
+    from app.services.principal_cache import principal_cache
+
+    client.post("/auth/register", json={"username": "cached", "password": "c1"})
+    token = client.post("/auth/login", data={"username": "cached", "password": "c1"}).json()["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+
+    assert client.get("/tools/lite", headers=h).status_code == 200   # 第一次：miss，查库后写入缓存
+
+    async def get_engine(session):
+        return session.get_bind()
+
+    engine = db(get_engine)
+    statements = []
+
+    def capture(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        before = principal_cache.stats()
+        assert client.get("/tools/lite", headers=h).status_code == 200
+        after = principal_cache.stats()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    assert after["hits"] == before["hits"] + 1
+    assert not any("FROM user" in s for s in statements)
+
+    # 删除用户 -> ORM 事件让缓存失效 -> 同一个 token 立刻 401
+    async def delete_user(session):
+        user = (await session.exec(select(User).where(User.username == "cached"))).one()
+        await session.delete(user)
+        await session.commit()
+
+    db(delete_user)
+
+    r = client.get("/tools/lite", headers=h)
+    assert r.status_code == 401
+    assert r.json()["detail"]["code"] == "USER_NOT_FOUND"
+
+
+def test_principal_cache_drops_users_changed_by_other_processes(client, db, monkeypatch):
+    from sqlalchemy import text
+    from app.services.counters import USER_GEN_KEY, read_generation
+    from app.security import decode_token_claims
+    from app.services.principal_cache import Principal, principal_cache
+
+    client.post("/auth/register", json={"username": "elsewhere", "password": "e1"})
+    token = client.post("/auth/login", data={"username": "elsewhere", "password": "e1"}).json()["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+    assert client.get("/tools/lite", headers=h).status_code == 200
+    before = principal_cache.stats()
+    assert client.get("/tools/lite", headers=h).status_code == 200
+    assert principal_cache.stats()["hits"] == before["hits"] + 1
+
+    # 缓存里存的是 Principal，不是拼出来的 User 行
+    cached = principal_cache.get(decode_token_claims(token)["jti"])
+    assert type(cached) is Principal and cached.username == "elsewhere"
+
+    # 另一个进程删了这个用户：本进程的 ORM 事件收不到，只有库里的 user 代数变了
+    async def delete_elsewhere(session):
+        gen = await read_generation(session, USER_GEN_KEY)
+        await session.exec(text("DELETE FROM user WHERE username = 'elsewhere'"))
+        await session.exec(
+            text("INSERT INTO rowcounter (key, value) VALUES (:k, 1) ON CONFLICT (key) DO UPDATE SET value = value + 1"),
+            params={"k": USER_GEN_KEY},
+        )
+        await session.commit()
+        return gen
+
+    gen = db(delete_elsewhere)
+    monkeypatch.setattr(principal_cache, "recheck", 0)  # 不等 1 秒，下一个请求就复查
+    r = client.get("/tools/lite", headers=h)
+    assert r.status_code == 401
+    assert r.json()["detail"]["code"] == "USER_NOT_FOUND"
+    assert principal_cache.user_generation != gen
+
+
+def test_user_changes_bump_user_generation(client, db):
+    from sqlmodel import select
+    from app.models import User
+    from app.services.counters import USER_GEN_KEY, read_generation
+
+    client.post("/auth/register", json={"username": "bumped", "password": "b1"})
+    before = db(lambda s: read_generation(s, USER_GEN_KEY))
+
+    async def delete_user(session):
+        await session.delete((await session.exec(select(User).where(User.username == "bumped"))).one())
+        await session.commit()
+        return await read_generation(session, USER_GEN_KEY)
+
+    assert db(delete_user) != before
+
+
+def test_login_rehashes_outdated_cost(client, db):
+    from passlib.hash import pbkdf2_sha256
+    from sqlmodel import select
+    from app.models import User
+    from app.security import pwd_context
+
+    async def add_user(session):
+        session.add(User(username="oldhash", password_hash=pbkdf2_sha256.using(rounds=1000).hash("old1")))
+        await session.commit()
+
+    async def stored_hash(session):
+        return (await session.exec(select(User).where(User.username == "oldhash"))).one().password_hash
+
+    db(add_user)
+
+    r = client.post("/auth/login", data={"username": "oldhash", "password": "old1"})
+    assert r.status_code == 200
+
+    stored = db(stored_hash)
+    assert not stored.startswith("$pbkdf2-sha256$1000$")
+    assert not pwd_context.needs_update(stored)
+
+    r = client.post("/auth/login", data={"username": "oldhash", "password": "old1"})
+    assert r.status_code == 200
+
+
+def test_hash_pool_rejects_when_saturated():
+    import asyncio
+    import threading
+    import pytest
+    from fastapi import HTTPException
+    from app.security import HashPool
+
+    pool = HashPool(workers=1, queue=0)
+    release = threading.Event()
+
+    def slow():
+        release.wait(5)
+        return "done"
+
+    async def main():
+        first = asyncio.ensure_future(pool.run(slow))
+        await asyncio.sleep(0)   # 让第一个先占住唯一的槽位
+        with pytest.raises(HTTPException) as exc:
+            await pool.run(lambda: "never")
+        assert exc.value.status_code == 503
+        assert exc.value.detail["code"] == "SERVER_BUSY"
+
+        release.set()
+        assert await first == "done"
+        assert await pool.run(lambda: "ok") == "ok"
+
+    asyncio.run(main())
@@ -0,0 +1,162 @@
+import asyncio
+import sqlite3
+
+import pytest
+
+from fastapi import HTTPException
+from sqlmodel import SQLModel, select
+from sqlmodel.ext.asyncio.session import AsyncSession
+from sqlalchemy import func, text, update
+from sqlalchemy.exc import OperationalError
+
+from app.db import build_engine, retry_on_busy
+from app.models import Tool, ToolMovement
+from app.schemas import MovementAction, MovementCreate
+from app.services.ledger import record_quantity_change, apply_movement_batch
+
+WORKERS = 8
+PER_WORKER = 25
+
+
+async def _engine(tmp_path):
+    # 并发要真实的多连接（aiosqlite 每条连接一个线程），内存库 + StaticPool 只有一条连接，测不出问题
+    engine = build_engine(f"sqlite:///{tmp_path / 'stress.db'}", pool_size=WORKERS)
+    async with engine.begin() as conn:
+        await conn.run_sync(SQLModel.metadata.create_all)
+    return engine
+
+
+async def _new_tool(engine, quantity: int) -> int:
+    async with AsyncSession(engine, expire_on_commit=False) as session:
+        tool = Tool(name="压测刀", location="S1", quantity=quantity)
+        session.add(tool)
+        await session.commit()
+        return tool.id
+
+
+async def _run(engine, fn):
+    async def worker(i):
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            await fn(session, i)
+
+    await asyncio.gather(*(worker(i) for i in range(WORKERS)))
+
+
+async def _state(engine, tool_id):
+    async with AsyncSession(engine) as session:
+        qty = (await session.get(Tool, tool_id)).quantity
+        n, total = (await session.exec(
+            select(func.count(), func.coalesce(func.sum(ToolMovement.delta), 0))
+            .where(ToolMovement.tool_id == tool_id)
+        )).one()
+    await engine.dispose()
+    return qty, n, total
+
+
+def test_concurrent_in_no_lost_updates(tmp_path):
+    async def main():
+        engine = await _engine(tmp_path)
+        tool_id = await _new_tool(engine, 0)
+
+        async def worker(session, _):
+            for _ in range(PER_WORKER):
+                await record_quantity_change(session, tool_id, MovementAction.IN, 1, None, "stress")
+
+        await _run(engine, worker)
+        return await _state(engine, tool_id)
+
+    n = WORKERS * PER_WORKER
+    assert asyncio.run(main()) == (n, n, n)
+
+
+def test_concurrent_out_never_oversells(tmp_path):
+    stock = WORKERS * PER_WORKER // 2
+    ok = []
+
+    async def main():
+        engine = await _engine(tmp_path)
+        tool_id = await _new_tool(engine, stock)
+
+        async def worker(session, _):
+            for _ in range(PER_WORKER):
+                try:
+                    await record_quantity_change(session, tool_id, MovementAction.OUT, 1, None, "stress")
+                    ok.append(1)
+                except HTTPException as e:
+                    assert e.detail["code"] == "INSUFFICIENT_STOCK"
+
+        await _run(engine, worker)
+        return await _state(engine, tool_id)
+
+    assert asyncio.run(main()) == (0, stock, -stock)
+    assert len(ok) == stock
+
+
+def test_concurrent_batches_and_adjust_stay_consistent(tmp_path):
+    async def main():
+        engine = await _engine(tmp_path)
+        tool_id = await _new_tool(engine, 0)
+
+        async def worker(session, i):
+            for k in range(PER_WORKER // 5):
+                if i % 2:
+                    items = [MovementCreate(tool_id=tool_id, action=MovementAction.IN, delta=1)] * 5
+                    await apply_movement_batch(session, items, "stress", atomic=True)
+                else:
+                    await record_quantity_change(
+                        session, tool_id, MovementAction.ADJUST, 1000 + i * 100 + k, None, "stress"
+                    )
+
+        await _run(engine, worker)
+        return await _state(engine, tool_id)
+
+    qty, _, total = asyncio.run(main())
+    # 流水的 delta 累加必须和库存一致：任何一次丢更新都会让两者对不上
+    assert qty == total
+
+
+def test_sqlite_pragmas_and_reader_not_blocked_by_writer(tmp_path):
+    async def main():
+        engine = await _engine(tmp_path)
+        tool_id = await _new_tool(engine, 7)
+        async with AsyncSession(engine) as writer, AsyncSession(engine) as reader:
+            mode = (await reader.exec(text("PRAGMA journal_mode"))).scalar()
+            sync = (await reader.exec(text("PRAGMA synchronous"))).scalar()
+            # 写事务拿着锁还没提交：WAL 下读者直接读到提交前的快照，不排队
+            await writer.exec(update(Tool).where(Tool.id == tool_id).values(quantity=99))
+            seen = (await asyncio.wait_for(
+                reader.exec(select(Tool.quantity).where(Tool.id == tool_id)), timeout=1
+            )).one()
+            await writer.commit()
+        await engine.dispose()
+        return mode, sync, seen
+
+    assert asyncio.run(main()) == ("wal", 1, 7)  # synchronous=NORMAL -> 1
+
+
+def test_retry_on_busy_reruns_transaction():
+    calls = []
+
+    class FakeSession:
+        rollbacks = 0
+
+        async def rollback(self):
+            self.rollbacks += 1
+
+    @retry_on_busy
+    async def tx(session):
+        calls.append(1)
+        if len(calls) < 3:
+            raise OperationalError("UPDATE tool", {}, sqlite3.OperationalError("database is locked"))
+        return "ok"
+
+    @retry_on_busy
+    async def broken(session):
+        raise OperationalError("SELECT", {}, sqlite3.OperationalError("no such table: x"))
+
+    session = FakeSession()
+    assert asyncio.run(tx(session)) == "ok"
+    assert len(calls) == 3 and session.rollbacks == 2
+    with pytest.raises(OperationalError):
+        asyncio.run(broken(session))  # 非 BUSY 错误不重试
+    assert session.rollbacks == 2
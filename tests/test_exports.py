@@ -0,0 +1,89 @@
+import io
+import time
+
+import pytest
+from openpyxl import load_workbook
+
+from app.services.export_jobs import export_jobs
+
+
+def _h(client):
+    client.post("/auth/register", json={"username": "exporter", "password": "123456"})
+    r = client.post("/auth/login", data={"username": "exporter", "password": "123456"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _wait(client, h, job_id):
+    for _ in range(200):
+        job = client.get(f"/exports/{job_id}", headers=h).json()
+        if job["status"] in ("done", "failed"):
+            return job
+        time.sleep(0.02)
+    raise AssertionError("导出任务没跑完")
+
+
+@pytest.fixture
+def jobs(tmp_path, monkeypatch):
+    monkeypatch.setattr(export_jobs, "cache_dir", str(tmp_path))
+    monkeypatch.setattr(export_jobs, "jobs", {})
+    monkeypatch.setattr(export_jobs, "by_key", {})
+    return export_jobs
+
+
+def test_export_job_renders_in_background_and_reuses_cache(client, jobs, tmp_path):
+    h = _h(client)
+    client.post("/tools", json={"name": "后台导出镗刀", "location": "X1", "quantity": 2}, headers=h)
+
+    r = client.post("/exports", json={"q": "后台导出"}, headers=h)
+    assert r.status_code == 202
+    job = _wait(client, h, r.json()["id"])
+    assert (job["status"], job["rows"], job["total"]) == ("done", 1, 1)
+
+    f = client.get(job["file_url"], headers=h)
+    assert f.headers["content-type"].startswith("application/vnd.openxmlformats")
+    rows = list(load_workbook(io.BytesIO(f.content)).active.iter_rows(values_only=True))
+    assert rows[1][1:4] == ("后台导出镗刀", "X1", 2)
+
+    # 同样的 q、数据没变：复用同一个任务和文件
+    again = client.post("/exports", json={"q": "后台导出"}, headers=h).json()
+    assert (again["id"], again["cached"], again["status"]) == (job["id"], True, "done")
+
+    # 进程重启（任务表清空）后，磁盘上的文件照样能复用
+    jobs.jobs.clear()
+    jobs.by_key.clear()
+    after_restart = client.post("/exports", json={"q": "后台导出"}, headers=h).json()
+    assert (after_restart["cached"], after_restart["status"]) == (True, "done")
+    assert len(list(tmp_path.glob("tools-*.xlsx"))) == 1
+
+    # 有写入 -> 代数变了 -> 重新渲染出新文件
+    client.post("/tools", json={"name": "后台导出铣刀", "location": "X2", "quantity": 1}, headers=h)
+    fresh = client.post("/exports", json={"q": "后台导出"}, headers=h).json()
+    assert fresh["cached"] is False
+    assert _wait(client, h, fresh["id"])["rows"] == 2
+    assert len(list(tmp_path.glob("tools-*.xlsx"))) == 2
+
+    # 过了 TTL：提交时顺手清掉旧文件
+    jobs.ttl = 0
+    try:
+        client.post("/exports", json={"q": "别的查询"}, headers=h)
+    finally:
+        jobs.ttl = 600
+    assert client.get(f"/exports/{job['id']}", headers=h).status_code == 404
+
+
+def test_export_job_not_ready_and_queue_bound(client, jobs, monkeypatch):
+    h = _h(client)
+    monkeypatch.setattr(jobs, "max_pending", 0)
+    r = client.post("/exports", json={"q": "排队已满"}, headers=h)
+    assert (r.status_code, r.json()["detail"]["code"]) == (429, "EXPORT_BUSY")
+
+    monkeypatch.setattr(jobs, "max_pending", 16)
+    # 并发名额占满：任务只能排队，下载返回 409
+    monkeypatch.setattr(jobs, "_sem", None)
+    monkeypatch.setattr(jobs, "workers", 0)
+    job = client.post("/exports", json={"q": "排队中"}, headers=h).json()
+    assert job["status"] == "queued"
+    r = client.get(f"/exports/{job['id']}/file", headers=h)
+    assert (r.status_code, r.json()["detail"]["code"]) == (409, "EXPORT_NOT_READY")
+    client.portal.call(jobs.get(job["id"]).task.cancel)
+    monkeypatch.setattr(jobs, "_sem", None)
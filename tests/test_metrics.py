@@ -0,0 +1,77 @@
+import asyncio
+import re
+
+from sqlalchemy import text
+
+from app.db import build_engine
+from app.services.metrics import pool_wait
+
+
+def _h(client):
+    client.post("/auth/register", json={"username": "metrics", "password": "123456"})
+    r = client.post("/auth/login", data={"username": "metrics", "password": "123456"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+def _sample(body: str, name: str, **labels) -> float:
+    want = ",".join(f'{k}="{v}"' for k, v in labels.items())
+    for line in body.splitlines():
+        if line.startswith(f"{name}{{{want}}} ") or (not labels and line.startswith(f"{name} ")):
+            return float(line.rsplit(" ", 1)[1])
+    return 0.0
+
+
+def test_metrics_route_labels_and_server_timing(client):
+    h = _h(client)
+    tool_id = client.post("/tools", json={"name": "指标刀", "quantity": 1}, headers=h).json()["id"]
+    before = client.get("/metrics").text
+
+    r = client.get(f"/tools/{tool_id}", headers=h)
+    timing = r.headers["server-timing"]
+    m = re.search(r'db;dur=([\d.]+);desc="(\d+) queries"', timing)
+    assert m and int(m.group(2)) >= 1
+    assert "app;dur=" in timing
+    client.get("/definitely-not-a-route")
+
+    r = client.get("/metrics")
+    assert r.headers["content-type"].startswith("text/plain")
+    body = r.text
+    # 按路由模板聚合，不是真实路径
+    route = "/tools/{tool_id}"
+    labels = {"method": "GET", "route": route, "status": "200"}
+    assert _sample(body, "http_requests_total", **labels) == _sample(before, "http_requests_total", **labels) + 1
+    assert _sample(body, "http_requests_total", method="GET", route="unmatched", status="404") >= 1
+    assert f'http_request_duration_seconds_bucket{{method="GET",route="{route}",le="+Inf"}}' in body
+    assert _sample(body, "http_request_db_queries_sum", route=route) >= int(m.group(2))
+    assert _sample(body, "http_requests_in_flight") == 1  # 只有 /metrics 自己
+    assert "# TYPE db_pool_checkout_wait_seconds histogram" in body
+
+
+def test_pool_checkout_wait_is_observed(tmp_path):
+    async def main():
+        engine = build_engine(f"sqlite:///{tmp_path / 'pool.db'}", pool_size=1, max_overflow=0)
+        try:
+            async with engine.connect() as conn:
+                await conn.execute(text("select 1"))
+        finally:
+            await engine.dispose()
+
+    before = sum(v[-2] for v in pool_wait._values.values())
+    asyncio.run(main())
+    assert sum(v[-2] for v in pool_wait._values.values()) == before + 1
+
+
+def test_principal_cache_metrics(client):
+    from app.services.principal_cache import principal_cache
+
+    h = _h(client)  # 新 token：第一次鉴权查库，第二次命中缓存
+    before = client.get("/metrics").text
+    client.get("/tools", headers=h)
+    client.get("/tools", headers=h)
+    body = client.get("/metrics").text
+
+    assert "# TYPE principal_cache_hits_total counter" in body
+    assert "# TYPE principal_cache_size gauge" in body
+    assert _sample(body, "principal_cache_misses_total") == _sample(before, "principal_cache_misses_total") + 1
+    assert _sample(body, "principal_cache_hits_total") == _sample(before, "principal_cache_hits_total") + 1
+    assert _sample(body, "principal_cache_size") == principal_cache.stats()["size"] >= 1
@@ -0,0 +1,103 @@
+import asyncio
+
+from sqlalchemy import event, text
+from sqlmodel import SQLModel
+
+from app.db import build_engine
+from app.migrations import LATEST_VERSION, MIGRATIONS, ensure_schema, run_migrations
+
+# 最早建库时就有的单列索引；之后加到模型里的索引都得有迁移给老库补上
+ORIGINAL_INDEXES = {"ix_tool_name", "ix_toolmovement_tool_id", "ix_toolmovement_action", "ix_toolmovement_operator"}
+MIGRATED_INDEXES = {spec.name for m in MIGRATIONS for spec in m.indexes}
+
+
+def _model_indexes(*tables: str) -> set[str]:
+    return {ix.name for t in tables for ix in SQLModel.metadata.tables[t].indexes}
+
+
+def test_every_model_index_has_a_migration():
+    assert _model_indexes("tool", "toolmovement") - ORIGINAL_INDEXES <= MIGRATED_INDEXES
+
+
+def test_migrations_upgrade_old_database(tmp_path):
+    async def go():
+        engine = build_engine(f"sqlite:///{tmp_path / 'old.db'}")
+        try:
+            # 模拟老库：表在，后来加的复合索引都没有
+            async with engine.begin() as conn:
+                await conn.run_sync(SQLModel.metadata.create_all)
+                for name in MIGRATED_INDEXES:
+                    await conn.execute(text(f"DROP INDEX {name}"))
+                await conn.execute(text("ALTER TABLE tool DROP COLUMN change_seq"))  # 后来加的列
+                # 老库的流水表没有 AUTOINCREMENT，最新的流水（id=2）已经在归档表里
+                ddl = (await conn.execute(text("SELECT sql FROM sqlite_master WHERE name = 'toolmovement'"))).scalar()
+                await conn.execute(text("DROP TABLE toolmovement"))
+                await conn.execute(text(ddl.replace(" AUTOINCREMENT", "")))
+                await conn.execute(text("ALTER TABLE toolmovement DROP COLUMN batch_seq"))
+                await conn.execute(text(
+                    "INSERT INTO toolmovement (id, tool_id, action, delta, operator, created_at) "
+                    "VALUES (1, 1, 'IN', 1, 'op', '2024-01-02')"
+                ))
+                await conn.execute(text(
+                    "INSERT INTO toolmovementarchive (id, tool_id, action, delta, operator, created_at) "
+                    "VALUES (2, 1, 'IN', 1, 'op', '2023-01-01')"
+                ))
+                # 老口径的搜索倒排（1~2 字 gram）
+                await conn.execute(text("INSERT INTO tool (id, name, location, quantity, updated_at) VALUES (1, '老镗刀', 'K1', 0, '2024-01-01')"))
+                await conn.execute(text("INSERT INTO toolsearchgram (gram, tool_id) VALUES ('镗', 1), ('镗刀', 1)"))
+
+            ran = await run_migrations(engine, verbose=False)
+            again = await run_migrations(engine, verbose=False)
+
+            async with engine.begin() as conn:
+                indexes = set((await conn.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))).scalars())
+                versions = (await conn.execute(text("SELECT version FROM schemamigration ORDER BY version"))).scalars().all()
+                grams = set((await conn.execute(text("SELECT gram FROM toolsearchgram"))).scalars())
+                seqs = (await conn.execute(text("SELECT change_seq FROM tool"))).scalars().all()
+                mv_columns = [row[1] for row in (await conn.execute(text("PRAGMA table_info(toolmovement)"))).all()]
+                rolled_up = (await conn.execute(text("SELECT sum(movement_count) FROM movementrollup"))).scalar()
+                await conn.execute(text(
+                    "INSERT INTO toolmovement (tool_id, action, delta, operator, created_at) "
+                    "VALUES (1, 'IN', 1, 'op', '2024-01-03')"
+                ))
+                movement_ids = (await conn.execute(text("SELECT id FROM toolmovement ORDER BY id"))).scalars().all()
+                plan = (await conn.execute(text(
+                    "EXPLAIN QUERY PLAN SELECT id FROM toolmovement WHERE operator = 'op' "
+                    "ORDER BY created_at DESC, id DESC LIMIT 50"
+                ))).all()
+            return ran, again, indexes, versions, grams, seqs, mv_columns, rolled_up, movement_ids, " ".join(row[-1] for row in plan)
+        finally:
+            await engine.dispose()
+
+    ran, again, indexes, versions, grams, seqs, mv_columns, rolled_up, movement_ids, plan = asyncio.run(go())
+    assert [m.version for m in ran] == [m.version for m in MIGRATIONS]
+    assert again == []  # 跑过的不再跑
+    assert MIGRATED_INDEXES <= indexes
+    assert versions[-1] == LATEST_VERSION
+    assert seqs == [0]  # 加列：老行取默认值
+    assert "batch_seq" in mv_columns
+    assert rolled_up == 2  # 升级前的流水（含归档）补进了汇总表
+    assert movement_ids == [1, 3]  # 整表拷过来了；新流水越过归档里的 2，不复用
+    assert grams == {"老镗刀", "老镗", "镗刀"}  # 按三字组 + 汉字二字组重建；“K1” 没有可用的 gram
+    # 按操作人过滤 + 按时间排序：走复合索引，不用临时 B 树排序
+    assert "ix_toolmovement_operator_created_at_id" in plan
+    assert "TEMP B-TREE" not in plan
+
+
+def test_ensure_schema_fast_path_when_current(tmp_path):
+    async def go():
+        engine = build_engine(f"sqlite:///{tmp_path / 'new.db'}")
+        try:
+            first = await ensure_schema(engine, verbose=False)  # 新库：建表 + 记下所有迁移
+            statements = []
+            event.listen(engine.sync_engine, "before_cursor_execute", lambda *a: statements.append(a[2]))
+            second = await ensure_schema(engine, verbose=False)
+            return first, second, statements
+        finally:
+            await engine.dispose()
+
+    first, second, statements = asyncio.run(go())
+    assert len(first) == len(MIGRATIONS)
+    # 已是最新版本：只查一次版本号，不做 create_all 的逐表反射
+    assert second == []
+    assert len(statements) == 1 and "max(schemamigration.version)" in statements[0]
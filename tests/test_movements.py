@@ -16,3 +16,296 @@ def test_list_movements(client):
     data = r2.json()
     assert data["total"] >= 1
     assert len(data["items"]) >= 1
+
+
+def test_list_movements_cursor_pages_match_offset(client):
+    token = _token(client)
+    h = {"Authorization": f"Bearer {token}"}
+
+    r = client.post("/tools", json={"name": "游标测试刀", "location": "P1", "quantity": 1}, headers=h)
+    tool_id = r.json()["id"]
+    for _ in range(4):
+        client.post("/movements", json={"tool_id": tool_id, "action": "IN", "delta": 1}, headers=h)
+
+    for sort in ("id_desc", "id_asc", "created_desc", "created_asc"):
+        base = f"/movements?tool_id={tool_id}&sort={sort}"
+        expected = [m["id"] for m in client.get(base + "&limit=200", headers=h).json()["items"]]
+        assert len(expected) == 5
+
+        seen, cursor = [], None
+        while True:
+            url = base + "&limit=2" + (f"&cursor={cursor}" if cursor else "")
+            data = client.get(url, headers=h).json()
+            seen += [m["id"] for m in data["items"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        assert seen == expected
+
+
+def test_list_movements_bad_cursor(client):
+    token = _token(client)
+    h = {"Authorization": f"Bearer {token}"}
+
+    r = client.get("/movements?cursor=not-a-cursor", headers=h)
+    assert r.status_code == 400
+    assert r.json()["detail"]["code"] == "BAD_CURSOR"
+
+
+def test_export_movements_formats(client):
+    import csv
+    import io
+    import json
+    from openpyxl import load_workbook
+
+    token = _token(client)
+    h = {"Authorization": f"Bearer {token}"}
+
+    r = client.post("/tools", json={"name": "导出流水刀", "location": "X1", "quantity": 2}, headers=h)
+    tool_id = r.json()["id"]
+    client.post("/movements", json={"tool_id": tool_id, "action": "OUT", "delta": 1}, headers=h)
+
+    base = f"/movements/export?tool_id={tool_id}&sort=id_asc"
+
+    r = client.get(base + "&format=ndjson", headers=h)
+    assert r.status_code == 200
+    lines = [json.loads(x) for x in r.text.splitlines()]
+    assert [(m["action"], m["delta"]) for m in lines] == [("IN", 2), ("OUT", -1)]
+
+    r = client.get(base + "&format=csv", headers=h)
+    rows = list(csv.reader(io.StringIO(r.content.decode("utf-8-sig"))))
+    assert rows[0][0] == "流水号"
+    assert [row[2] for row in rows[1:]] == ["IN", "OUT"]
+
+    r = client.get(base + "&format=xlsx&action=OUT", headers=h)
+    ws = load_workbook(io.BytesIO(r.content)).active
+    data = list(ws.iter_rows(values_only=True))
+    assert data[1][1:4] == (tool_id, "OUT", -1)
+    assert data[-1][0] == "导出时间"
+
+
+def test_batch_movements_sequential_and_partial(client):
+    token = _token(client)
+    h = {"Authorization": f"Bearer {token}"}
+
+    tool_id = client.post("/tools", json={"name": "批量刀", "location": "B9", "quantity": 1}, headers=h).json()["id"]
+    items = [
+        {"tool_id": tool_id, "action": "IN", "delta": 4},
+        {"tool_id": tool_id, "action": "OUT", "delta": 5},   # 基于上一条算：5-5=0
+        {"tool_id": tool_id, "action": "OUT", "delta": 1},   # 库存不足
+        {"tool_id": 999999, "action": "IN", "delta": 1},     # 刀具不存在
+    ]
+
+    # 默认 all-or-nothing：整批拒绝，库存不变
+    r = client.post("/movements/batch", json={"items": items}, headers=h)
+    assert r.status_code == 400
+    assert r.json()["detail"]["code"] == "INSUFFICIENT_STOCK"
+    assert client.get(f"/tools/{tool_id}", headers=h).json()["quantity"] == 1
+
+    r = client.post("/movements/batch", json={"items": items, "atomic": False}, headers=h)
+    assert r.status_code == 200
+    data = r.json()
+    assert (data["total"], data["succeeded"], data["failed"]) == (4, 2, 2)
+    assert [it["code"] for it in data["items"][2:]] == ["INSUFFICIENT_STOCK", "NOT_FOUND"]
+    assert client.get(f"/tools/{tool_id}", headers=h).json()["quantity"] == 0
+
+    mvs = client.get(f"/movements?tool_id={tool_id}&sort=id_asc", headers=h).json()["items"]
+    assert [m["delta"] for m in mvs] == [1, 4, -5]
+    assert [m["id"] for m in mvs[1:]] == [it["id"] for it in data["items"][:2]]
+
+
+def test_large_batch_is_few_statements_and_ids_match_items(client, db, query_budget):
+    from sqlmodel import select
+    from app.models import ToolMovement
+
+    h = {"Authorization": f"Bearer {_token(client)}"}
+    tids = [client.post("/tools", json={"name": f"大批量{i}", "location": "B8", "quantity": 10}, headers=h).json()["id"]
+            for i in range(3)]
+    items = [
+        {"tool_id": tids[i % 3], "action": "IN" if i % 4 else "OUT", "delta": 2 if i % 4 else 1, "note": f"n{i}"}
+        for i in range(3, 2003)
+    ]
+
+    # 流水多行 VALUES 插入、缺的计数行一次补齐：语句数和批量大小无关
+    with query_budget(20) as seen:
+        data = client.post("/movements/batch", json={"items": items}, headers=h).json()
+    assert data["succeeded"] == len(items)
+    assert sum(sql.startswith("INSERT INTO toolmovement ") for sql, _ in seen) <= 3
+
+    # 返回的 id 和条目按位置对得上：库里这条流水的 note 就是提交时的 note
+    ids = [it["id"] for it in data["items"]]
+
+    async def notes(session):
+        return dict((await session.exec(select(ToolMovement.id, ToolMovement.note).where(ToolMovement.id.in_(ids)))).all())
+
+    by_id = db(notes)
+    assert len(by_id) == len(items)
+    assert [by_id[mv_id] for mv_id in ids] == [it["note"] for it in items]
+
+
+def test_list_movements_totals_from_counters(client, db):
+    from sqlalchemy import delete, event, func
+    from sqlmodel import select
+    from app.models import RowCounter, ToolMovement
+
+    token = _token(client)
+    h = {"Authorization": f"Bearer {token}"}
+
+    tool_id = client.post("/tools", json={"name": "计数刀", "location": "C1", "quantity": 2}, headers=h).json()["id"]
+    client.post("/movements", json={"tool_id": tool_id, "action": "IN", "delta": 3}, headers=h)
+    client.post("/movements/batch", json={"items": [
+        {"tool_id": tool_id, "action": "OUT", "delta": 1},
+        {"tool_id": tool_id, "action": "ADJUST", "delta": 9},
+    ]}, headers=h)
+
+    async def real_counts(session):
+        total = (await session.exec(select(func.count()).select_from(ToolMovement))).one()
+        return total, session.get_bind()
+
+    # 老库没有计数行：第一次读按 COUNT 补种子
+    async def drop_counters(session):
+        await session.exec(delete(RowCounter))
+        await session.commit()
+
+    db(drop_counters)
+    assert client.get(f"/movements?tool_id={tool_id}", headers=h).json()["total"] == 4
+
+    statements = []
+
+    def capture(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    real_total, engine = db(real_counts)
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        client.get("/movements", headers=h)  # 补种子
+        statements.clear()
+        all_total = client.get("/movements", headers=h).json()["total"]
+        per_tool = client.get(f"/movements?tool_id={tool_id}&limit=1", headers=h).json()
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+
+    # 计数器已存在：列表不再对流水表做 COUNT
+    assert not any("count(" in s.lower() for s in statements)
+    assert all_total == real_total
+    assert per_tool["total"] == 4 and per_tool["total_estimated"] is False
+
+    # 后续写入增量维护
+    client.post("/movements", json={"tool_id": tool_id, "action": "OUT", "delta": 1}, headers=h)
+    assert client.get(f"/movements?tool_id={tool_id}", headers=h).json()["total"] == 5
+
+    r = client.get(f"/movements?tool_id={tool_id}&include_total=false", headers=h).json()
+    assert r["total"] is None and len(r["items"]) == 5
+
+    # 带其它过滤的 estimate：几秒内复用同一个 COUNT 结果
+    url = f"/movements?tool_id={tool_id}&action=OUT&estimate=true"
+    first = client.get(url, headers=h).json()
+    assert first["total"] == 2 and first["total_estimated"] is True
+    client.post("/movements", json={"tool_id": tool_id, "action": "OUT", "delta": 1}, headers=h)
+    assert client.get(url, headers=h).json()["total"] == 2
+    assert client.get(url.replace("&estimate=true", ""), headers=h).json()["total"] == 3
+
+
+def test_movement_summary_from_rollup_tz_buckets(client, db):
+    from datetime import datetime
+    from sqlalchemy import update
+    from sqlmodel import select
+    from app.models import ToolMovement
+    from app.services.rollup import backfill_rollup
+
+    client.post("/auth/register", json={"username": "summary", "password": "s1"})
+    token = client.post("/auth/login", data={"username": "summary", "password": "s1"}).json()["access_token"]
+    h = {"Authorization": f"Bearer {token}"}
+
+    tool_id = client.post("/tools", json={"name": "汇总刀", "location": "R1", "quantity": 10}, headers=h).json()["id"]
+    client.post("/movements", json={"tool_id": tool_id, "action": "OUT", "delta": 3}, headers=h)
+    client.post("/movements/batch", json={"items": [
+        {"tool_id": tool_id, "action": "IN", "delta": 4},
+        {"tool_id": tool_id, "action": "OUT", "delta": 2},
+    ]}, headers=h)
+
+    # 写入路径同步累加 rollup
+    r = client.get("/movements/summary?operator=summary&group_by=action", headers=h).json()
+    assert r["source"] == "rollup"
+    by_action = {i["action"]: i for i in r["items"]}
+    assert by_action["IN"]["count"] == 2 and by_action["IN"]["qty_in"] == 14
+    assert by_action["OUT"]["count"] == 2 and by_action["OUT"]["qty_out"] == 5
+
+    # 把流水挪到 UTC 1/12 15:30 和 16:30（上海 1/12 23:30、1/13 00:30），回填后按上海时区分日
+    async def move_and_backfill(session):
+        mvs = (await session.exec(
+            select(ToolMovement.id).where(ToolMovement.tool_id == tool_id).order_by(ToolMovement.id)
+        )).all()
+        times = [datetime(2026, 1, 12, 15, 30), datetime(2026, 1, 12, 16, 30)]
+        for i, mv_id in enumerate(mvs):
+            await session.exec(update(ToolMovement).where(ToolMovement.id == mv_id).values(created_at=times[i % 2]))
+        await session.commit()
+        await backfill_rollup(session)
+
+    db(move_and_backfill)
+
+    base = f"/movements/summary?tool_id={tool_id}&start=2026-01-01&end=2026-02-01"
+    r = client.get(base + "&tz=Asia/Shanghai", headers=h).json()
+    assert r["source"] == "rollup"
+    assert [(i["bucket"], i["count"], i["net"]) for i in r["items"]] == [("2026-01-12", 2, 14), ("2026-01-13", 2, -5)]
+
+    r = client.get(base, headers=h).json()   # UTC：全在 1/12
+    assert [(i["bucket"], i["count"], i["net"]) for i in r["items"]] == [("2026-01-12", 4, 9)]
+
+    r = client.get(base + "&tz=Asia/Shanghai&bucket=week&group_by=tool,operator", headers=h).json()
+    assert [(i["bucket"], i["tool_id"], i["operator"], i["count"]) for i in r["items"]] == [
+        ("2026-01-12", tool_id, "summary", 4)
+    ]
+    r = client.get(base + "&bucket=month", headers=h).json()
+    assert [i["bucket"] for i in r["items"]] == ["2026-01"]
+
+    # 半小时时区：小时桶切不准，退回直接聚合流水，结果依旧正确
+    r = client.get(base + "&tz=Asia/Kolkata", headers=h).json()
+    assert r["source"] == "movements"
+    assert [(i["bucket"], i["count"]) for i in r["items"]] == [("2026-01-12", 4)]  # 当地 21:00 / 22:00
+
+    assert client.get(base + "&group_by=nope", headers=h).status_code == 400
+
+
+def test_summary_items_sort_by_value_not_text():
+    from datetime import timezone
+    from app.services.rollup import _Summary
+
+    s = _Summary("day", ["tool", "operator"], timezone.utc)
+    for tool_id, operator in ((10, "b"), (2, "b"), (2, None), (10, "a")):
+        s.add("2026-01-12", (tool_id, operator), 1, 1, 0, 1)
+    # tool_id 按数字排（2 在 10 前面），None 排在最前
+    assert [(i["tool_id"], i["operator"]) for i in s.items()] == [(2, None), (2, "b"), (10, "a"), (10, "b")]
+
+
+
+def test_fast_list_path_matches_response_model_and_compresses(client):
+    import gzip
+    from app.schemas import MovementListResponse, ToolListResponse, ToolListItem
+
+    token = _token(client)
+    h = {"Authorization": f"Bearer {token}"}
+    tool_id = client.post("/tools", json={"name": "序列化刀", "location": "J1", "quantity": 1}, headers=h).json()["id"]
+    client.post("/movements", json={"tool_id": tool_id, "action": "OUT", "delta": 1, "note": "出库"}, headers=h)
+
+    # 快路径的输出和走 response_model 序列化的结果逐字段一致
+    for url, model in (
+        ("/movements?limit=200", MovementListResponse),
+        ("/tools?limit=200", ToolListResponse),
+    ):
+        data = client.get(url, headers={**h, "Accept-Encoding": "identity"}).json()
+        assert model.model_validate(data).model_dump(mode="json") == data
+    lite = client.get("/tools/lite", headers=h).json()
+    assert [ToolListItem.model_validate(x).model_dump(mode="json") for x in lite] == lite
+
+    # 大 body 按 Accept-Encoding 压缩；小 body 不压
+    r = client.get("/movements?limit=200", headers={**h, "Accept-Encoding": "gzip"})
+    assert r.headers["content-encoding"] == "gzip" and r.headers["vary"] == "Accept-Encoding"
+    assert r.json()["items"]  # httpx 已自动解压
+    r = client.get(f"/movements?tool_id={tool_id}&limit=1", headers={**h, "Accept-Encoding": "gzip"})
+    assert "content-encoding" not in r.headers
+
+    from app.services.fastjson import pick_encoding, _compress
+    assert pick_encoding("gzip;q=0, identity") is None
+    assert pick_encoding("br;q=1.0, gzip;q=0.8") in ("br", "gzip")
+    assert gzip.decompress(_compress(b"x" * 2000, "gzip")) == b"x" * 2000
@@ -0,0 +1,80 @@
+import pytest
+
+
+def _h(client):
+    client.post("/auth/register", json={"username": "budget", "password": "123456"})
+    r = client.post("/auth/login", data={"username": "budget", "password": "123456"})
+    return {"Authorization": f"Bearer {r.json()['access_token']}"}
+
+
+# (URL, 最多几条 SQL, 允许整表扫的表)；{tid} 换成测试里建的刀具
+BUDGETS = [
+    ("/tools", 3, ()),
+    ("/tools?q=预算铣", 4, ()),  # 多一条：先数 q 的每个 gram 有多少条倒排
+    ("/tools?q=预算", 4, ()),  # 两个字的中文走汉字二字组的倒排
+    ("/tools?sort=name_asc", 3, ()),
+    ("/tools?include_total=false", 2, ()),
+    ("/tools/lite", 3, ()),
+    ("/tools/lite?since=2020-01-01", 3, ()),
+    ("/tools/{tid}", 1, ()),
+    ("/tools/{tid}/history", 2, ()),
+    ("/tools/balance?at=2030-01-01", 3, ()),
+    ("/tools/balance?at=2030-01-01&tool_id={tid}", 3, ()),
+    ("/movements", 3, ()),
+    ("/movements?tool_id={tid}", 3, ()),
+    ("/movements?action=OUT", 3, ()),
+    ("/movements?operator=budget", 3, ()),
+    ("/movements?operator=budget&sort=created_desc", 3, ()),
+    ("/movements?action=OUT&sort=created_desc", 3, ()),
+    ("/movements?sort=created_desc&start=2020-01-01", 3, ()),
+    # 按 id 排序 + 只有时间范围：从 (created_at, id) 索引取窗口内的 id，不沿主键走
+    ("/movements?start=2020-01-01", 3, ()),
+    ("/movements?start=2020-01-01&end=2020-02-01&sort=id_asc", 3, ()),
+    ("/movements/summary?group_by=tool&start=2020-01-01", 2, ()),
+    # 不带时间范围的汇总本来就要读整张 rollup 表（按小时聚合过，行数很少）
+    ("/movements/summary", 2, ("movementrollup",)),
+]
+
+
+@pytest.mark.parametrize("url,max_queries,allow_scan", BUDGETS)
+def test_endpoint_query_budget(client, query_budget, url, max_queries, allow_scan):
+    h = _h(client)
+    tid = client.post("/tools", json={"name": "预算铣刀", "location": "Q1", "quantity": 5}, headers=h).json()["id"]
+    client.patch(f"/tools/{tid}/quantity", json={"action": "OUT", "delta": 1}, headers=h)
+    url = url.format(tid=tid)
+    assert client.get(url, headers=h).status_code == 200  # 预热：计数器第一次读要补种子
+
+    with query_budget(max_queries, allow_scan):
+        assert client.get(url, headers=h).status_code == 200
+
+
+def test_query_budget_catches_regressions(client, db, query_budget):
+    from sqlalchemy import text
+
+    h = _h(client)
+    with pytest.raises(AssertionError, match="预算 0"):
+        with query_budget(0):
+            client.get("/tools", headers=h)
+
+    async def like_scan(session):
+        await session.exec(text("SELECT id FROM tool WHERE name LIKE '%铣%'"))
+
+    with pytest.raises(AssertionError, match=r"全表扫描 \['tool'\]"):
+        with query_budget(5):
+            db(like_scan)
+
+
+def test_slow_query_log_has_plan_and_route(client, caplog, monkeypatch):
+    from app.config import settings
+
+    h = _h(client)
+    client.get("/movements/summary", headers=h)
+    monkeypatch.setattr(settings, "slow_query_ms", 1e-9)  # 每条都算慢
+    with caplog.at_level("WARNING", logger="app.slow_query"):
+        client.get("/movements/summary", headers=h)
+
+    logs = [r.getMessage() for r in caplog.records if r.name == "app.slow_query"]
+    page = next(m for m in logs if "FROM movementrollup" in m)
+    assert "route=/movements/summary " in page
+    assert "full_scan=movementrollup" in page
+    assert "SCAN movementrollup" in page
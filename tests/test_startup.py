@@ -0,0 +1,27 @@
+import subprocess
+import sys
+
+from app.startup_profile import by_package, parse_importtime
+
+SAMPLE = """import time: self [us] | cumulative | imported package
+import time:       120 |        120 |     sqlalchemy.util
+import time:       300 |        420 |   sqlalchemy
+import time:        50 |        470 | app.db
+"""
+
+
+def test_parse_importtime():
+    records = parse_importtime(SAMPLE)
+    assert [(r.name, r.self_us, r.cumulative_us, r.depth) for r in records] == [
+        ("sqlalchemy.util", 120, 120, 2),
+        ("sqlalchemy", 300, 420, 1),
+        ("app.db", 50, 470, 0),
+    ]
+    assert by_package(records) == [("sqlalchemy", 420), ("app", 50)]
+
+
+def test_importing_app_skips_export_only_dependencies():
+    # openpyxl 只有导入 / 导出 xlsx 时才用：冷启动的 worker 不该为它付导入时间
+    code = "import sys, app.main; print('openpyxl' in sys.modules)"
+    out = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True).stdout
+    assert out.strip().splitlines()[-1] == "False"
@@ -49,3 +49,418 @@ def test_out_not_enough_stock(client):
 
     r2 = client.patch(f"/tools/{tool_id}/quantity", json={"action": "OUT", "delta": 999}, headers=h)
     assert r2.status_code == 400
+
+def test_list_tools_cursor_stable_for_every_sort(client):
+    token = _token(client)
+    h = _h(token)
+
+    # 同名 + 同数量，只能靠 id 兜底排序
+    for _ in range(3):
+        client.post("/tools", json={"name": "翻页同名刀", "location": "Z9", "quantity": 4}, headers=h)
+    client.post("/tools", json={"name": "翻页另一把", "location": "Z9", "quantity": 1}, headers=h)
+
+    for sort in ("id_desc", "id_asc", "name_asc", "name_desc", "qty_asc", "qty_desc"):
+        base = f"/tools?q=翻页&sort={sort}"
+        expected = [t["id"] for t in client.get(base + "&limit=200", headers=h).json()["items"]]
+        assert len(expected) == 4
+
+        seen, cursor = [], None
+        while True:
+            url = base + "&limit=1" + (f"&cursor={cursor}" if cursor else "")
+            data = client.get(url, headers=h).json()
+            seen += [t["id"] for t in data["items"]]
+            cursor = data["next_cursor"]
+            if not cursor:
+                break
+        assert seen == expected
+
+def test_search_short_chinese_and_location(client):
+    token = _token(client)
+    h = _h(token)
+
+    client.post("/tools", json={"name": "合金立铣刀", "location": "Q7-架", "quantity": 1}, headers=h)
+    client.post("/tools", json={"name": "合金丝锥", "location": "Q8", "quantity": 0}, headers=h)
+
+    def names(q):
+        data = client.get(f"/tools?q={q}&limit=200", headers=h).json()
+        assert data["total"] == len(data["items"])
+        return sorted(t["name"] for t in data["items"])
+
+    assert names("合金") == ["合金丝锥", "合金立铣刀"]  # 两个字的中文走二字组倒排
+    assert names("立铣") == ["合金立铣刀"]
+    assert names("-架") == ["合金立铣刀"]    # 只要有一个汉字，二字组就进倒排
+    assert names("q7") == ["合金立铣刀"]     # 两个字母数字没有 gram，退回 LIKE；ASCII 不区分大小写，和 LIKE 一致
+    assert names("合金立") == ["合金立铣刀"]  # 三字及以上走倒排
+    assert names("q7-架") == ["合金立铣刀"]
+    assert names("铣刀合") == []
+
+
+def test_rebuild_search_index():
+    import asyncio
+    from sqlmodel import SQLModel, select
+    from sqlalchemy.ext.asyncio import create_async_engine
+    from sqlmodel.ext.asyncio.session import AsyncSession
+    from app.models import Tool
+    from app.services.search import rebuild_search_index, search_condition
+
+    async def main():
+        engine = create_async_engine("sqlite+aiosqlite://")
+        async with engine.begin() as conn:
+            await conn.run_sync(SQLModel.metadata.create_all)
+        async with AsyncSession(engine, expire_on_commit=False) as session:
+            session.add(Tool(name="老库里的镗刀", location="K1"))
+            await session.commit()
+            assert (await session.exec(select(Tool).where(await search_condition(session, "的镗刀")))).all() == []
+
+            assert await rebuild_search_index(session) == 1
+            found = (await session.exec(select(Tool).where(await search_condition(session, "的镗刀")))).all()
+            assert [t.name for t in found] == ["老库里的镗刀"]
+        await engine.dispose()
+
+    asyncio.run(main())
+
+
+def test_export_xlsx_streams_workbook(client):
+    import io
+    from openpyxl import load_workbook
+
+    token = _token(client)
+    h = _h(token)
+    client.post("/tools", json={"name": "导出专用铰刀", "location": "E5", "quantity": 6}, headers=h)
+
+    r = client.get("/tools/export.xlsx?q=导出专用", headers=h)
+    assert r.status_code == 200
+    assert r.headers["content-type"].startswith("application/vnd.openxmlformats")
+    assert int(r.headers["content-length"]) == len(r.content)
+
+    ws = load_workbook(io.BytesIO(r.content)).active
+    rows = list(ws.iter_rows(values_only=True))
+    assert rows[0][:4] == ("编号", "名称", "库位", "数量")
+    assert rows[1][1:4] == ("导出专用铰刀", "E5", 6)
+    assert ws.cell(row=2, column=4).number_format == "0"
+    assert rows[3][0] == "导出时间"
+    assert list(ws.tables.values())[0].ref == "A1:H2"
+
+
+
+def test_import_tools_round_trips_export_and_validates_up_front(client):
+    token = _token(client)
+    h = _h(token)
+    client.post("/tools", json={"name": "导入样板丝锥", "location": "I1", "quantity": 7}, headers=h)
+    client.post("/tools", json={"name": "导入样板空刀", "location": "I2", "quantity": 0}, headers=h)
+    sheet = client.get("/tools/export.xlsx?q=导入样板", headers=h).content
+    total_before = client.get("/tools", headers=h).json()["total"]
+
+    files = {"file": ("tools.xlsx", sheet, "application/octet-stream")}
+    r = client.post("/tools/import?dry_run=true", files=files, headers=h).json()
+    assert (r["total"], r["valid"], r["invalid"], r["imported"]) == (2, 2, 0, 0)
+    assert client.get("/tools", headers=h).json()["total"] == total_before
+
+    r = client.post("/tools/import", files=files, headers=h).json()
+    assert r["imported"] == 2
+    assert client.get("/tools", headers=h).json()["total"] == total_before + 2
+    found = client.get("/tools?q=导入样板丝锥&sort=id_asc", headers=h).json()["items"]
+    assert [(t["location"], t["quantity"]) for t in found] == [("I1", 7), ("I1", 7)]
+    mv = client.get(f"/movements?tool_id={found[1]['id']}", headers=h).json()
+    assert (mv["total"], mv["items"][0]["action"], mv["items"][0]["delta"]) == (1, "IN", 7)
+    assert mv["items"][0]["note"] == "导入入库"
+
+    # CSV：任意一行不合格就整表不导入，报告带表格行号
+    csv_body = "名称,库位,数量\n导入CSV甲,C1,3\n,C2,1\n导入CSV乙,C3,-2\n导入CSV丙,,2.5\n".encode("utf-8-sig")
+    r = client.post("/tools/import", files={"file": ("t.csv", csv_body)}, headers=h).json()
+    assert (r["total"], r["valid"], r["invalid"], r["imported"]) == (4, 1, 3, 0)
+    assert [(e["row"], e["code"]) for e in r["errors"]] == [
+        (3, "INVALID_NAME"), (4, "INVALID_QUANTITY"), (5, "INVALID_QUANTITY"),
+    ]
+    assert client.get("/tools?q=导入CSV", headers=h).json()["total"] == 0
+
+    r = client.post("/tools/import", files={"file": ("t.csv", "name,quantity\n导入CSV丁,4\n".encode())}, headers=h)
+    assert r.json()["imported"] == 1
+    assert client.get("/tools?q=导入CSV丁", headers=h).json()["items"][0]["location"] == "unknown"
+
+    assert client.post("/tools/import", files={"file": ("t.txt", b"x")}, headers=h).status_code == 400
+    assert client.post("/tools/import", files={"file": ("t.xlsx", b"not a zip")}, headers=h).status_code == 400
+
+
+def test_list_tools_total_counter_and_include_total(client):
+    token = _token(client)
+    h = _h(token)
+
+    before = client.get("/tools?limit=1", headers=h).json()["total"]
+    tool_id = client.post("/tools", json={"name": "计数台账", "location": "Z9", "quantity": 0}, headers=h).json()["id"]
+    assert client.get("/tools?limit=1", headers=h).json()["total"] == before + 1
+
+    client.delete(f"/tools/{tool_id}", headers=h)
+    data = client.get("/tools?limit=1", headers=h).json()
+    assert data["total"] == before
+
+    data = client.get("/tools?limit=1&include_total=false", headers=h).json()
+    assert data["total"] is None and len(data["items"]) == 1
+
+
+def test_balance_at_and_history_use_checkpoints(client, db, monkeypatch):
+    from datetime import datetime, timedelta
+    from sqlmodel import select
+    from app.config import settings
+    from app.models import ToolBalanceCheckpoint
+    from app.services.balances import rebuild_checkpoints
+
+    monkeypatch.setattr(settings, "balance_checkpoint_every", 3)
+    token = _token(client)
+    h = _h(token)
+
+    tool = client.post("/tools", json={"name": "历史库存刀", "location": "H1", "quantity": 5}, headers=h).json()
+    tool_id = tool["id"]
+    ops = [("IN", 2), ("OUT", 1), ("IN", 3), ("ADJUST", 20), ("OUT", 4), ("IN", 1), ("IN", 1)]
+    expected = [5]
+    times = []
+    first = client.get(f"/movements?tool_id={tool_id}", headers=h).json()["items"][0]
+    times.append(first["created_at"])
+    for action, delta in ops:
+        mv = client.post("/movements", json={"tool_id": tool_id, "action": action, "delta": delta}, headers=h).json()
+        expected.append(delta if action == "ADJUST" else expected[-1] + (delta if action == "IN" else -delta))
+        times.append(mv["created_at"])
+
+    async def checkpoints(session):
+        rows = (await session.exec(
+            select(ToolBalanceCheckpoint).where(ToolBalanceCheckpoint.tool_id == tool_id)
+            .order_by(ToolBalanceCheckpoint.movement_id)
+        )).all()
+        return [(cp.movement_id, cp.balance) for cp in rows]
+
+    written = db(checkpoints)
+    assert [b for _, b in written] == [expected[2], expected[5]]  # 第 3、6 条之后
+
+    def balance(at: datetime) -> int:
+        r = client.get(f"/tools/balance?at={at.isoformat()}&tool_id={tool_id}", headers=h)
+        assert r.status_code == 200
+        return r.json()["items"][0]["balance"]
+
+    for t, want in zip(times, expected):
+        assert balance(datetime.fromisoformat(t) + timedelta(microseconds=1)) == want
+    assert balance(datetime.fromisoformat(times[0]) - timedelta(seconds=1)) == 0
+
+    # 纯日期 + 时区：按当地当天结束算
+    assert balance(datetime.fromisoformat(times[-1]) + timedelta(days=1)) == expected[-1]
+    r = client.get(f"/tools/balance?at=2000-01-01&tz=Asia/Shanghai&tool_id={tool_id}", headers=h)
+    assert r.json()["items"][0]["balance"] == 0
+
+    hist = client.get(f"/tools/{tool_id}/history", headers=h).json()
+    assert hist["opening_balance"] == 0
+    assert [p["balance"] for p in hist["items"]] == expected
+
+    # 分页：游标带着余额接着算
+    seen, cursor = [], None
+    while True:
+        url = f"/tools/{tool_id}/history?limit=3" + (f"&cursor={cursor}" if cursor else "")
+        page = client.get(url, headers=h).json()
+        seen += [p["balance"] for p in page["items"]]
+        cursor = page["next_cursor"]
+        if not cursor:
+            break
+    assert seen == expected
+
+    hist = client.get(f"/tools/{tool_id}/history?start={times[4]}", headers=h).json()
+    assert hist["opening_balance"] == expected[3]
+    assert [p["balance"] for p in hist["items"]] == expected[4:]
+
+    # 老库重算出来的检查点和写入时记的一致
+    async def rebuild(session):
+        await rebuild_checkpoints(session)
+        return await checkpoints(session)
+
+    assert db(rebuild) == written
+
+    assert client.get("/tools/999999/history", headers=h).status_code == 404
+
+
+def test_checkpoints_sum_movements_like_rebuild(client, db, monkeypatch):
+    from datetime import datetime
+    from sqlmodel import select
+    from app.config import settings
+    from app.models import Tool, ToolBalanceCheckpoint
+    from app.services.balances import balance_at, rebuild_checkpoints
+    from app.services.counters import TOOL_KEY, bump_counters
+
+    monkeypatch.setattr(settings, "balance_checkpoint_every", 3)
+    h = _h(_token(client))
+
+    # 老数据：库存 7 但没有期初流水，Tool.quantity 和流水之和对不上
+    async def legacy_tool(session):
+        tool = Tool(name="无期初流水刀", location="Q1", quantity=7)
+        session.add(tool)
+        await bump_counters(session, {TOOL_KEY: 1})
+        await session.commit()
+        return tool.id
+
+    tool_id = db(legacy_tool)
+    for _ in range(3):
+        client.post("/movements", json={"tool_id": tool_id, "action": "IN", "delta": 1}, headers=h)
+
+    async def checkpoints(session):
+        rows = (await session.exec(
+            select(ToolBalanceCheckpoint.movement_id, ToolBalanceCheckpoint.balance)
+            .where(ToolBalanceCheckpoint.tool_id == tool_id)
+        )).all()
+        return [tuple(r) for r in rows]
+
+    written = db(checkpoints)
+    # 写入时和重算、和没有检查点时的现算是同一个口径：流水求和
+    assert [b for _, b in written] == [3]
+
+    async def rebuild(session):
+        await rebuild_checkpoints(session)
+        return await checkpoints(session)
+
+    assert db(rebuild) == written
+
+    async def without_checkpoints(session):
+        await session.exec(ToolBalanceCheckpoint.__table__.delete())
+        await session.commit()
+        return await balance_at(session, tool_id, datetime(2999, 1, 1))
+
+    assert db(without_checkpoints) == 3
+
+
+def test_conditional_get_etag_and_last_modified(client, db):
+    from sqlalchemy import event
+
+    token = _token(client)
+    h = _h(token)
+    tool_id = client.post("/tools", json={"name": "看板刀", "location": "E1", "quantity": 1}, headers=h).json()["id"]
+
+    r = client.get("/tools/lite", headers=h)
+    etag = r.headers["etag"]
+    assert r.status_code == 200 and r.headers["cache-control"] == "private, no-cache"
+
+    async def get_engine(session):
+        return session.get_bind()
+
+    statements = []
+
+    def capture(conn, cursor, statement, *args):
+        statements.append(statement)
+
+    engine = db(get_engine)
+    event.listen(engine, "before_cursor_execute", capture)
+    try:
+        r = client.get("/tools/lite", headers={**h, "If-None-Match": etag})
+    finally:
+        event.remove(engine, "before_cursor_execute", capture)
+    # 没变：304、没有 body、只查了一次代数，不碰 tool 表
+    assert r.status_code == 304 and r.content == b""
+    assert r.headers["etag"] == etag
+    assert len(statements) == 1 and "rowcounter" in statements[0].lower()
+
+    # 列表：参数不同 ETag 不同；参数顺序无关
+    a = client.get("/tools?limit=5&sort=id_asc", headers=h).headers["etag"]
+    assert client.get("/tools?sort=id_asc&limit=5", headers=h).headers["etag"] == a
+    assert client.get("/tools?limit=6&sort=id_asc", headers=h).headers["etag"] != a
+    assert client.get("/tools?limit=5&sort=id_asc", headers={**h, "If-None-Match": a}).status_code == 304
+
+    r = client.get(f"/tools/{tool_id}", headers=h)
+    one_etag, last_modified = r.headers["etag"], r.headers["last-modified"]
+    assert client.get(f"/tools/{tool_id}", headers={**h, "If-None-Match": one_etag}).status_code == 304
+    assert client.get(f"/tools/{tool_id}", headers={**h, "If-Modified-Since": last_modified}).status_code == 304
+    m_etag = client.get(f"/movements?tool_id={tool_id}", headers=h).headers["etag"]
+
+    # 改库存：tool / movement 代数都变，旧 ETag 失效
+    client.patch(f"/tools/{tool_id}/quantity", json={"action": "IN", "delta": 2}, headers=h)
+    r = client.get("/tools/lite", headers={**h, "If-None-Match": etag})
+    assert r.status_code == 200 and r.headers["etag"] != etag
+    assert client.get("/tools?limit=5&sort=id_asc", headers={**h, "If-None-Match": a}).status_code == 200
+    r = client.get(f"/tools/{tool_id}", headers={**h, "If-None-Match": one_etag})
+    assert r.status_code == 200 and r.json()["quantity"] == 3
+    assert client.get(f"/movements?tool_id={tool_id}", headers={**h, "If-None-Match": m_etag}).status_code == 200
+
+    # 新建 / 删除刀具也会让列表失效
+    etag = client.get("/tools/lite", headers=h).headers["etag"]
+    client.delete(f"/tools/{tool_id}", headers=h)
+    assert client.get("/tools/lite", headers={**h, "If-None-Match": etag}).status_code == 200
+
+
+def test_tools_lite_compact_paged_and_incremental(client):
+    from datetime import datetime, timedelta
+
+    token = _token(client)
+    h = _h(token)
+    ids = [
+        client.post("/tools", json={"name": f"下拉{i}", "location": "L1", "quantity": 1}, headers=h).json()["id"]
+        for i in range(3)
+    ]
+
+    full = client.get("/tools/lite", headers=h).json()
+    assert set(full[0]) == {"id", "name", "location", "quantity"}
+    assert int(client.get("/tools/lite", headers=h).headers["x-tool-count"]) == len(full)
+
+    # compact：同样的数据，数组的数组
+    r = client.get("/tools/lite?format=compact", headers=h)
+    assert r.headers["x-columns"] == "id,name,location,quantity"
+    assert r.json() == [[t["id"], t["name"], t["location"], t["quantity"]] for t in full]
+
+    # limit + X-Next-Cursor 翻完整个目录
+    seen, cursor = [], None
+    while True:
+        r = client.get("/tools/lite?limit=2" + (f"&cursor={cursor}" if cursor else ""), headers=h)
+        seen += [t["id"] for t in r.json()]
+        cursor = r.headers.get("x-next-cursor")
+        if not cursor:
+            break
+    assert seen == [t["id"] for t in full]
+
+    # 增量：拿到游标后只改一把刀，下次只返回这一把
+    since = (datetime.utcnow() - timedelta(minutes=5)).isoformat()
+    cursor = None
+    while True:
+        r = client.get(f"/tools/lite?since={since}&limit=500" + (f"&cursor={cursor}" if cursor else ""), headers=h)
+        cursor = r.headers["x-next-cursor"]
+        if len(r.json()) < 500:
+            break
+    assert client.get(f"/tools/lite?cursor={cursor}", headers=h).json() == []
+
+    client.patch(f"/tools/{ids[1]}/quantity", json={"action": "IN", "delta": 4}, headers=h)
+    r = client.get(f"/tools/lite?cursor={cursor}&format=compact", headers=h)
+    assert r.json() == [[ids[1], "下拉1", "L1", 5]]
+    assert client.get(f"/tools/lite?cursor={r.headers['x-next-cursor']}", headers=h).json() == []
+
+    r = client.get("/tools/lite?format=msgpack", headers=h)
+    try:
+        import msgpack
+    except ImportError:
+        assert r.status_code == 406
+    else:
+        assert msgpack.unpackb(r.content) == [[t["id"], t["name"], t["location"], t["quantity"]] for t in full]
+
+    assert client.get("/tools/lite?limit=100000", headers=h).status_code == 422
+    assert client.get("/tools/lite?cursor=bogus", headers=h).status_code == 400
+
+
+def test_tools_lite_sync_keeps_changes_committed_out_of_order(client, monkeypatch):
+    from datetime import datetime
+    from app.services import ledger
+
+    h = _h(_token(client))
+    a = client.post("/tools", json={"name": "乱序A", "location": "S1", "quantity": 1}, headers=h).json()["id"]
+    b = client.post("/tools", json={"name": "乱序B", "location": "S1", "quantity": 1}, headers=h).json()["id"]
+
+    cursor = client.get("/tools/lite?since=2000-01-01&limit=10000", headers=h).headers["x-next-cursor"]
+
+    # B 先提交，客户端同步到 B 之后
+    client.patch(f"/tools/{b}/quantity", json={"action": "IN", "delta": 1}, headers=h)
+    r = client.get(f"/tools/lite?cursor={cursor}", headers=h)
+    assert [t["id"] for t in r.json()] == [b]
+    cursor = r.headers["x-next-cursor"]
+
+    # A 的 updated_at 在 B 之前就取好了（比如排队等写锁），提交却在 B 之后
+    class Earlier(datetime):
+        @classmethod
+        def utcnow(cls):
+            return datetime(2000, 1, 2)
+
+    monkeypatch.setattr(ledger, "datetime", Earlier)
+    client.patch(f"/tools/{a}/quantity", json={"action": "IN", "delta": 1}, headers=h)
+    monkeypatch.undo()
+
+    r = client.get(f"/tools/lite?cursor={cursor}", headers=h)
+    assert r.json() == [{"id": a, "name": "乱序A", "location": "S1", "quantity": 2}]
+    assert client.get(f"/tools/lite?cursor={r.headers['x-next-cursor']}", headers=h).json() == []